@@ -0,0 +1,789 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# auto-adjust-photos.py
+# =====================
+# Auto-adjusts images based on metadata, file size and image dimensions.
+# Originally written for automatically modifying images uploaded to the
+# 'Camera Uploads' Dropbox folder.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Replacement for "auto-adjust-photos.sh".
+
+What is done to an image is determined by the camera/device model that
+took it, as given by a table of rules.  A rule downsamples images whose
+file size exceed a threshold, and optionally rotates images to the
+orientation given by their EXIF "Orientation" tag.
+
+Rather than running "stat", "exiftool", "jhead" and "mogrify" for every
+step, the file size, model and orientation are read from a single parse
+of the start of the file and the image is scaled and rotated in a single
+decode and encode with Pillow.  Images are processed by a pool of worker
+processes.
+
+With "--watch", the given directories are watched for new images, which
+are processed as soon as they have been completely written, instead of
+rescanning the directories from "cron".
+"""
+
+import argparse
+import collections
+import io
+import json
+import os
+import signal
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+try:
+    from PIL import Image, ImageOps, PngImagePlugin
+except ImportError:
+    Image = None
+
+import directory_watcher
+import exif_thumbnail
+import image_discovery
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+# Results of processing an image, the same as the return values of "main()"
+# in the shell script.
+PASSED = 0
+FAILED = 1
+SKIPPED = 2
+
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+
+# JPEG markers of the segments holding IPTC data (Photoshop image resource
+# blocks) and of the start of the compressed data.
+JPEG_MARKER_APP13 = 0xed
+JPEG_MARKER_SOS = 0xda
+
+# Number of images passed to a worker process at a time.
+CHUNK_SIZE = 4
+
+# Number of images queued per worker process in watch mode.  Once the
+# queue is full, no more events are read until an image is done.
+QUEUED_IMAGES_PER_JOB = 4
+
+# Maximum number of seconds between checks for finished images in watch
+# mode.
+WATCH_POLL_INTERVAL = 0.2
+
+
+class Rule(object):
+    """What to do with images taken by a camera/device model."""
+    def __init__(self, name, threshold=None, scale=1.0, quality=85,
+                 orient=False):
+        """
+        :param name: Short name of the model, used in messages.
+        :param threshold: File size in bytes.  Images larger than this are
+                          downsampled.  None to never downsample.
+        :param scale: Factor to scale the dimensions of images by.
+        :param quality: JPEG quality of downsampled images.
+        :param orient: Whether to rotate images to the orientation given
+                       by their EXIF "Orientation" tag.
+        """
+        self.name = name
+        self.threshold = threshold
+        self.scale = scale
+        self.quality = quality
+        self.orient = orient
+
+    @property
+    def implemented(self):
+        return self.threshold is not None or self.orient
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['name'], values.get('threshold'),
+                   float(values.get('scale', 1.0)),
+                   int(values.get('quality', 85)),
+                   bool(values.get('orient', False)))
+
+
+# Rules keyed by the EXIF "Model" tag.  Images taken by models without any
+# rule, or whose rule does nothing, are skipped.
+RULES = {
+    # Photos taken with the OnePlus X camera app are very big and blurry
+    # and take up way too much disk space.
+    'ONE E1003': Rule('oneplusx', threshold=2500000, scale=0.75, quality=85),
+    'DMC-FZ200': Rule('compactsystem', threshold=3500000, scale=0.5,
+                      quality=90, orient=True),
+    # Recognised, but their photos are left as they are.
+    'GT-I9100': Rule('galaxys4'),
+    'iPhone 4': Rule('iphone4'),
+}
+
+
+def load_rules(path):
+    """
+    Reads rules from a JSON file, mapping models to objects with the keys
+    "name", "threshold", "scale", "quality" and "orient", like:
+
+        {"ONE E1003": {"name": "oneplusx", "threshold": 2500000,
+                       "scale": 0.75, "quality": 85}}
+
+    :return: Dict of "Rule" keyed by model.
+    :raises ValueError: The file is not a valid rule table.
+    """
+    with open(path, 'r', encoding='utf-8') as fh:
+        table = json.load(fh)
+    try:
+        return {model: Rule.from_dict(values)
+                for model, values in table.items()}
+    except (AttributeError, KeyError, TypeError) as e:
+        raise ValueError('Invalid rule table "{}": {!s}'.format(path, e))
+
+
+ImageInfo = collections.namedtuple('ImageInfo',
+                                   'image_type size model orientation')
+
+
+def _png_exif_offset(data):
+    """Returns the offset of the "eXIf" chunk data of a PNG, if any."""
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack_from('>I4s', data, pos)
+        if chunk_type == b'eXIf':
+            return pos + 8
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        pos += 12 + length
+    return None
+
+
+def read_image_info(path):
+    """
+    Gets the type, file size, camera/device model and orientation of an
+    image from the start of the file.
+
+    :return: An "ImageInfo", whose "model" and "orientation" are None if
+             the image has no such EXIF tags, or None if the file is not
+             a JPEG or PNG image.
+    :raises OSError: The file could not be read.
+    """
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        data = fh.read(exif_thumbnail.HEADER_READ_SIZE)
+
+    image_type = image_discovery.image_type_from_header(data)
+    if image_type not in ('jpg', 'png'):
+        return None
+
+    model = orientation = None
+    try:
+        if image_type == 'jpg':
+            location = exif_thumbnail.find_exif_tiff_header(data)
+            tiff_start = location[0] if location else None
+        else:
+            tiff_start = _png_exif_offset(data)
+
+        if tiff_start is not None:
+            tiff = exif_thumbnail.TiffReader(data, tiff_start)
+            ifd0, _ = tiff.read_ifd(tiff.first_ifd_offset)
+            if TAG_MODEL in ifd0:
+                model = tiff.value(ifd0[TAG_MODEL]) or None
+            if TAG_ORIENTATION in ifd0:
+                orientation = tiff.value(ifd0[TAG_ORIENTATION])
+    except (exif_thumbnail.ExifError, struct.error):
+        pass
+
+    return ImageInfo(image_type, size, model, orientation)
+
+
+def _jpeg_segments(data):
+    """
+    Yields tuples of the marker, start and end of the segments of a JPEG
+    image before its compressed data.
+    """
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xff:
+        marker = data[pos + 1]
+        if marker == 0xff:
+            # Fill byte.
+            pos += 1
+            continue
+        if marker == JPEG_MARKER_SOS:
+            return
+        length, = struct.unpack('>H', data[pos + 2:pos + 4])
+        yield marker, pos, pos + 2 + length
+        pos += 2 + length
+
+
+def _jpeg_iptc_segments(path):
+    """Returns the raw APP13 (IPTC) segments of a JPEG image."""
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    return [data[start:end] for marker, start, end in _jpeg_segments(data)
+            if marker == JPEG_MARKER_APP13]
+
+
+def _insert_jpeg_segments(data, segments):
+    """
+    Inserts segments into a JPEG image after its leading APPn segments,
+    where they are in images written by cameras.
+    """
+    pos = 2
+    for marker, _, end in _jpeg_segments(data):
+        if not 0xe0 <= marker <= 0xef:
+            break
+        pos = end
+    return data[:pos] + b''.join(segments) + data[pos:]
+
+
+def _png_text_info(text):
+    """
+    Returns a "PngInfo" with the text chunks, including XMP, of a PNG
+    image.
+    """
+    pnginfo = PngImagePlugin.PngInfo()
+    for key, value in text.items():
+        if key == 'XML:com.adobe.xmp':
+            pnginfo.add_itxt(key, value)
+        else:
+            pnginfo.add_text(key, value)
+    return pnginfo
+
+
+def adjust_image(path, rule, scale, orient):
+    """
+    Scales and/or rotates an image in a single decode and encode, keeping
+    its metadata; EXIF, ICC profile, XMP, IPTC and PNG text chunks.  The
+    image is replaced atomically.
+
+    :param path: Path to the image.
+    :param rule: The "Rule" giving the JPEG quality.
+    :param scale: Factor to scale the dimensions by, or None.
+    :param orient: Whether to apply the EXIF orientation.
+    """
+    with Image.open(path) as image:
+        image_format = image.format
+        info = dict(image.info)
+        text = dict(getattr(image, 'text', None) or {})
+        width, height = image.size
+        if scale:
+            size = (max(1, round(width * scale)),
+                    max(1, round(height * scale)))
+            # Lets libjpeg decode at a fraction of the full size, which is
+            # much faster than decoding everything and scaling afterwards.
+            image.draft(image.mode, size)
+        else:
+            size = None
+
+        exif = image.getexif()
+        adjusted = image
+        if orient:
+            # Orientations 5 to 8 swap the width and height.
+            if size and exif.get(TAG_ORIENTATION) in (5, 6, 7, 8):
+                size = (size[1], size[0])
+            adjusted = ImageOps.exif_transpose(image)
+            # Same EXIF, without the now applied "Orientation" tag.
+            exif = adjusted.getexif()
+        if size and adjusted.size != size:
+            adjusted = adjusted.resize(size, Image.Resampling.LANCZOS)
+
+        options = {}
+        if len(exif):
+            options['exif'] = exif.tobytes()
+        if info.get('icc_profile'):
+            options['icc_profile'] = info['icc_profile']
+        iptc = []
+        if image_format == 'JPEG':
+            options['quality'] = rule.quality
+            if info.get('xmp'):
+                options['xmp'] = info['xmp']
+            iptc = _jpeg_iptc_segments(path)
+        elif image_format == 'PNG' and text:
+            options['pnginfo'] = _png_text_info(text)
+
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.{}.'.format(os.path.basename(path)), suffix='.tmp',
+            dir=os.path.dirname(path) or os.curdir
+        )
+        try:
+            os.fchmod(fd, os.stat(path).st_mode & 0o7777)
+            with os.fdopen(fd, 'wb') as fh:
+                if iptc:
+                    # Pillow does not write IPTC, so the segments are
+                    # copied over as they are.
+                    buf = io.BytesIO()
+                    adjusted.save(buf, image_format, **options)
+                    fh.write(_insert_jpeg_segments(buf.getvalue(), iptc))
+                else:
+                    adjusted.save(fh, image_format, **options)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def process_image(path, rules=None, dry_run=False):
+    """
+    Auto-adjusts an image by the rule of its camera/device model.
+
+    :param path: Path to the image.
+    :param rules: Dict of "Rule" keyed by model.  Defaults to "RULES".
+    :param dry_run: Only report what would be done.
+    :return: Tuple of the result, one of "PASSED", "FAILED" and
+             "SKIPPED", or None if the file is not an image, and a list of
+             tuples of message types and texts.
+    """
+    rules = RULES if rules is None else rules
+    messages = []
+
+    def msg(msg_type, text):
+        messages.append((msg_type, text))
+
+    # Pillow raises all sorts of errors on broken images, like SyntaxError
+    # and DecompressionBombError, which fail the image but must not stop
+    # the others.
+    try:
+        info = read_image_info(path)
+    except Exception as e:
+        msg('error', 'Unable to read "{}": {!s}'.format(path, e))
+        return FAILED, messages
+    if info is None:
+        msg('warn', 'Not an image: "{}"'.format(path))
+        return None, messages
+
+    msg('info', 'Got image file "{}"'.format(path))
+    if info.model is None:
+        msg('error',
+            'Camera/device model check failed for "{}"'.format(path))
+        return FAILED, messages
+
+    rule = rules.get(info.model)
+    if rule is None or not rule.implemented:
+        msg('warn', 'Behaviour for model "{}" ("{}") not implemented. '
+                    'Skipping ..'.format(rule.name if rule else 'unknown',
+                                         info.model))
+        return SKIPPED, messages
+    msg('debug', 'Camera/device model: "{}" ("{}")'.format(rule.name,
+                                                          info.model))
+
+    scale = None
+    if rule.threshold is not None:
+        if info.size > rule.threshold:
+            msg('debug', 'Size exceeds threshold ({} > {})'.format(
+                info.size, rule.threshold))
+            scale = rule.scale
+        else:
+            msg('debug', 'Size does not exceed threshold ({} < {})'.format(
+                info.size, rule.threshold))
+    orient = rule.orient and (info.orientation or 0) > 1
+
+    if not scale and not orient:
+        return PASSED, messages
+
+    actions = []
+    if scale:
+        actions.append('downsampling to {:g}% at quality {}'.format(
+            scale * 100, rule.quality))
+    if orient:
+        actions.append('auto-orienting')
+    msg('info', '{} "{}" ..'.format(' and '.join(actions).capitalize(), path))
+    if dry_run:
+        return PASSED, messages
+
+    try:
+        adjust_image(path, rule, scale, orient)
+        new_size = os.path.getsize(path)
+    except Exception as e:
+        msg('error', 'Failed processing "{}": {!s}'.format(path, e))
+        return FAILED, messages
+
+    change = (new_size - info.size) / info.size * 100
+    msg('stats', 'Size (bytes)  was: {:>12}'.format(info.size))
+    msg('stats', '              now: {:>12}     ({:<6.2f}% change)'.format(
+        new_size, change))
+    return PASSED, messages
+
+
+def _process(args):
+    return process_image(*args)
+
+
+class Reporter(object):
+    """Prints messages like the shell script did, colored on terminals."""
+    COLORS = {
+        'error': '\033[31m',
+        'info': '\033[32m',
+        'warn': '\033[33m',
+        'debug': '',
+        'stats': '',
+    }
+    LABELS = {
+        'error': 'ERROR',
+        'info': 'status',
+        'warn': 'warning',
+        'debug': 'debug',
+        'stats': 'stats',
+    }
+
+    def __init__(self, brief=False, verbose=False, color=None):
+        self.brief = brief
+        self.verbose = verbose
+        self.color = sys.stdout.isatty() if color is None else color
+
+    def _label(self, msg_type):
+        label = self.LABELS[msg_type]
+        if self.color and self.COLORS[msg_type]:
+            return '[{}{}\033[0m]'.format(self.COLORS[msg_type], label)
+        return '[{}]'.format(label)
+
+    def msg(self, msg_type, text):
+        if msg_type == 'debug' and not self.verbose:
+            return
+        if self.brief and msg_type not in ('error', 'warn'):
+            return
+        print('{}  {}'.format(self._label(msg_type), text))
+
+
+def print_summary(counts):
+    """Prints the summary report, kept below 60 columns."""
+    rows = [
+        ('Total number of files', counts['total']),
+        ('Total number of IMAGES', counts['images']),
+        ('Images failed', counts['failed']),
+        ('Images passed', counts['passed']),
+    ]
+    print('')
+    print('Summary report')
+    print('=' * 52)
+    for name, value in rows:
+        print('{:<22.22s} : {!s:35.35s}'.format(name, value).rstrip())
+    print('')
+
+
+def _report_result(reporter, counts, result, messages):
+    counts['total'] += 1
+    for msg_type, text in messages:
+        reporter.msg(msg_type, text)
+    if result is None:
+        return
+
+    counts['images'] += 1
+    if result == SKIPPED:
+        counts['skipped'] += 1
+    elif result == FAILED:
+        counts['failed'] += 1
+    else:
+        counts['passed'] += 1
+
+    # Extra newline for readability ONLY if brief mode is disabled.
+    if not reporter.brief:
+        print('')
+    sys.stdout.flush()
+
+
+def main(paths, brief=False, dry_run=False, verbose=False, jobs=1,
+         rules=None):
+    """
+    Auto-adjusts images in a pool of worker processes.
+
+    :return: 0 if no image failed, otherwise 1.
+    """
+    reporter = Reporter(brief, verbose)
+    counts = collections.Counter()
+    tasks = [(path, rules, dry_run) for path in paths]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result, messages in executor.map(_process, tasks,
+                                             chunksize=CHUNK_SIZE):
+            _report_result(reporter, counts, result, messages)
+
+    if not brief:
+        print_summary(counts)
+
+    return 1 if counts['failed'] else 0
+
+
+class WatchStats(object):
+    """Counters of the watch mode."""
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def set_queue_depth(self, depth):
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def add_latency(self, seconds):
+        self.total_latency += seconds
+        self.max_latency = max(self.max_latency, seconds)
+
+    def format(self):
+        """
+        Formats the counters.  Latency is the time from the first event of
+        a file until it has been processed, including the settle time.
+        """
+        done = self.counts['total']
+        mean_latency = self.total_latency / done if done else 0.0
+        return ('queue depth {} (max {}), processed {} (passed {}, failed {}, '
+                'skipped {}), latency mean {:.2f}s max {:.2f}s'.format(
+                    self.queue_depth, self.max_queue_depth, done,
+                    self.counts['passed'], self.counts['failed'],
+                    self.counts['skipped'], mean_latency, self.max_latency))
+
+
+def _init_worker():
+    # Leaves it to the main process to stop the workers and print counters.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def watch(directories, brief=False, dry_run=False, verbose=False, jobs=1,
+          rules=None, recursive=False,
+          settle_time=directory_watcher.DEFAULT_SETTLE_TIME,
+          poll_interval=None, queue_size=None, stats_interval=None):
+    """
+    Watches directories and auto-adjusts new images in a pool of worker
+    processes, until interrupted.  The counters are printed on SIGUSR1,
+    every "stats_interval" seconds and before returning.
+
+    :param directories: Paths to the directories to watch.
+    :param recursive: Whether to watch sub-directories as well.
+    :param settle_time: Number of seconds a file must go unchanged before
+                        it is processed.
+    :param poll_interval: Number of seconds between scans of the
+                          directories.  If given, the directories are
+                          polled instead of watched with inotify.
+    :param queue_size: Maximum number of images queued or being processed.
+                       Defaults to "QUEUED_IMAGES_PER_JOB" per job.
+    :param stats_interval: Number of seconds between printing counters.
+    :return: 0 if no image failed, otherwise 1.
+    :raises directory_watcher.WatchError: A directory could not be watched.
+    """
+    reporter = Reporter(brief, verbose)
+    stats = WatchStats()
+    queue_size = queue_size or jobs * QUEUED_IMAGES_PER_JOB
+
+    watcher = directory_watcher.open_watcher(directories, recursive,
+                                             poll_interval)
+    debouncer = directory_watcher.Debouncer(settle_time)
+
+    # Tuples of the path, the time of its first event and its size and
+    # modification time when queued, keyed by future.
+    in_flight = {}
+    # Sizes and modification times of the images we replaced, to ignore
+    # the events of our own writes.
+    written = {}
+
+    def _print_stats(*_):
+        print('[stats]  {}'.format(stats.format()))
+        sys.stdout.flush()
+
+    signal.signal(signal.SIGUSR1, _print_stats)
+    next_stats = time.monotonic() + stats_interval if stats_interval else None
+    reporter.msg('info', 'Watching {} ..'.format(
+        ', '.join('"{}"'.format(d) for d in directories)))
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_init_worker) as executor:
+            while True:
+                for future in [f for f in in_flight if f.done()]:
+                    path, first_seen, state = in_flight.pop(future)
+                    try:
+                        result, messages = future.result()
+                    except Exception as e:
+                        result, messages = FAILED, [(
+                            'error',
+                            'Failed processing "{}": {!s}'.format(path, e))]
+                    stats.add_latency(time.monotonic() - first_seen)
+                    _report_result(reporter, stats.counts, result, messages)
+                    new_state = _file_state(path)
+                    if new_state != state and new_state is not None:
+                        written[path] = new_state
+
+                busy = {path for path, _, _ in in_flight.values()}
+                for path, first_seen in debouncer.pop_ready(
+                        queue_size - len(in_flight)):
+                    if path in busy:
+                        # Changed while being processed; look again later.
+                        debouncer.touch(path)
+                        continue
+                    state = _file_state(path)
+                    if state is None or written.pop(path, None) == state:
+                        continue
+                    future = executor.submit(process_image, path, rules,
+                                             dry_run)
+                    in_flight[future] = (path, first_seen, state)
+
+                stats.set_queue_depth(len(in_flight) + len(debouncer))
+                if next_stats is not None and time.monotonic() >= next_stats:
+                    _print_stats()
+                    next_stats = time.monotonic() + stats_interval
+
+                if len(in_flight) >= queue_size:
+                    # Leave new events in the kernel queue until there is
+                    # room for more images.
+                    wait(in_flight, timeout=debouncer.timeout(),
+                         return_when=FIRST_COMPLETED)
+                    continue
+
+                timeout = debouncer.timeout()
+                if in_flight:
+                    timeout = min(timeout or WATCH_POLL_INTERVAL,
+                                  WATCH_POLL_INTERVAL)
+                if next_stats is not None:
+                    until_stats = max(0.0, next_stats - time.monotonic())
+                    timeout = min(timeout if timeout is not None
+                                  else until_stats, until_stats)
+                for path in watcher.read(timeout):
+                    debouncer.touch(path)
+                if watcher.overflowed:
+                    watcher.overflowed = False
+                    reporter.msg('warn', 'Missed some events, scanned for '
+                                         'recently changed files')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    stats.set_queue_depth(len(debouncer))
+    _print_stats()
+    return 1 if stats.counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Auto-adjusts images based on metadata, file size and '
+                    'image dimensions.  Originally written for automatically '
+                    'modifying images uploaded to the \'Camera Uploads\' '
+                    'Dropbox folder.  Reads file type from magic header '
+                    'bytes, file extension should not matter.',
+        epilog='Exits with status 1 if any image failed processing.  '
+               'Requires Pillow.'
+    )
+    parser.add_argument(
+        dest='files', nargs='*', metavar='FILE',
+        help='Images to process, or directories to watch with "--watch".'
+    )
+    parser.add_argument(
+        '-b', '--brief',
+        dest='brief', action='store_true', default=False,
+        help='Brief mode, prints less output.'
+    )
+    parser.add_argument(
+        '-d', '--dry-run',
+        dest='dry_run', action='store_true', default=False,
+        help='Dry run, simulates what would happen.'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        dest='verbose', action='store_true', default=False,
+        help='Increase verbosity, prints more debug information.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+        help='Number of worker processes.  Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--rules',
+        dest='rules_path', default=None, metavar='PATH',
+        help='JSON file of rules keyed by camera/device model, used instead '
+             'of the built-in rules.  See "load_rules()" for the format.'
+    )
+    watch_group = parser.add_argument_group('watch mode')
+    watch_group.add_argument(
+        '-w', '--watch',
+        dest='watch', action='store_true', default=False,
+        help='Watch the given directories and process images as they are '
+             'written, until interrupted.  Send SIGUSR1 to print the queue '
+             'depth and latency counters.'
+    )
+    watch_group.add_argument(
+        '-r', '--recursive',
+        dest='recursive', action='store_true', default=False,
+        help='Also watch all sub-directories.'
+    )
+    watch_group.add_argument(
+        '--settle',
+        dest='settle_time', type=float,
+        default=directory_watcher.DEFAULT_SETTLE_TIME, metavar='SECONDS',
+        help='Number of seconds an image must go unchanged before it is '
+             'processed.  Defaults to %(default)s.'
+    )
+    watch_group.add_argument(
+        '--poll',
+        dest='poll_interval', type=float, default=None, metavar='SECONDS',
+        help='Scan the directories every SECONDS seconds instead of using '
+             'inotify.'
+    )
+    watch_group.add_argument(
+        '--queue-size',
+        dest='queue_size', type=int, default=None, metavar='N',
+        help='Maximum number of images queued for the workers.  Defaults to '
+             '{} per job.'.format(QUEUED_IMAGES_PER_JOB)
+    )
+    watch_group.add_argument(
+        '--stats-interval',
+        dest='stats_interval', type=float, default=None, metavar='SECONDS',
+        help='Print the counters every SECONDS seconds.'
+    )
+    args = parser.parse_args()
+
+    if not args.files:
+        print('[warning]  No arguments provided.')
+        print('[warning]  For help run: "{} -h"'.format(PROGRAM_NAME))
+        sys.exit(1)
+
+    if Image is None:
+        sys.exit('[ERROR] Pillow is not available on this system.\n'
+                 '        Please install Pillow before running this script.')
+
+    rules = None
+    if args.rules_path:
+        try:
+            rules = load_rules(args.rules_path)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    try:
+        if args.watch:
+            sys.exit(watch(args.files, args.brief, args.dry_run, args.verbose,
+                           max(1, args.jobs), rules, args.recursive,
+                           args.settle_time, args.poll_interval,
+                           args.queue_size, args.stats_interval))
+        sys.exit(main(args.files, args.brief, args.dry_run, args.verbose,
+                      max(1, args.jobs), rules))
+    except directory_watcher.WatchError as e:
+        sys.exit('[ERROR]  {!s}'.format(e))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
@@ -25,6 +25,8 @@ set -o noclobber -o nounset -o pipefail
 # set -x
 
 SCRIPT_NAME="$(basename "$0")"
+_SELF_DIRPATH="$(dirname -- "$(readlink --canonicalize -- "${BASH_SOURCE[0]}")")"
+readonly _SELF_DIRPATH
 
 C_NORMAL="$(tput sgr0)"
 C_RED="$(tput setaf 1)"
@@ -119,6 +121,23 @@ assert_command_available()
 }
 
 
+# Camera/device models of all given files, keyed by path.  Looked up at once by
+# a pool of long-lived exiftool processes instead of starting exiftool per file.
+declare -A models
+
+read_models()
+{
+    local _path _model
+    while IFS= read -r -d '' _path && IFS= read -r -d '' _model
+    do
+        models["$_path"]="$_model"
+    # Files that cannot be read are reported when processed, but errors like a
+    # failure to start exiftool are shown.
+    done < <(python3 "${_SELF_DIRPATH}/exiftool_pool.py" get --null --tag Model -- "$@" \
+                 2> >(grep -v ': Unable to read "' >&2))
+}
+
+
 # Main logic starts from this function which takes a single file as argument.
 # Return values:    0 - success, image processed ok
 #                   1 - failure, image processing failed
@@ -134,9 +153,15 @@ main()
     # First try to extract the model using exiftool, then process image based on
     # results. If the model cannot be determined, proceed with checking the ratio
     # of size to disk space usage.
-    unset model_result
-    model_result="$(exiftool -if '$model' -quiet -s3 -model "${_image}" 2>/dev/null)"
-    model_check_exit_code="$?"
+    # Models were read up front by "read_models". Like "exiftool -if '$model'",
+    # the check fails for files without a model.
+    model_result=''
+    model_check_exit_code=1
+    if [ -n "${models[${_image}]+set}" ] && [ -n "${models[${_image}]}" ]
+    then
+        model_result="${models[${_image}]}"
+        model_check_exit_code=0
+    fi
 
     # TODO: Really bail if check fails?
     if [ "$model_check_exit_code" -ne "0" ]
@@ -310,6 +335,7 @@ TIMESTAMP="$(date +%F\ %H:%M:%S)"
 msg_type debug "${TIMESTAMP} starting ${SCRIPT_NAME}"
 
 assert_command_available exiftool
+assert_command_available python3
 assert_command_available mogrify
 assert_command_available convert
 assert_command_available aaphoto
@@ -349,6 +375,9 @@ else
     TIMESTAMP="$(date +%F\ %H:%M:%S)"
     msg_type debug "${TIMESTAMP} ${SCRIPT_NAME} is starting."
 
+    msg_type debug "Reading camera/device models of ${#} files .."
+    read_models "$@"
+
     # Start iteration over arguments.
     for arg in "$@"
     do
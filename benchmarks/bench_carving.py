@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# bench_carving.py
+# ================
+# Compares the thumbdata carving engines of extract-android-thumbdata.py
+# on a synthetic blob of embedded images.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from corpora import write_blob
+from harness import load_script
+
+
+def run_engine(func, blob_path, expected_digests):
+    with tempfile.TemporaryDirectory() as out_dir:
+        started = time.perf_counter()
+        count = func(blob_path, out_dir)
+        elapsed = time.perf_counter() - started
+
+        correct = 0
+        for name in os.listdir(out_dir):
+            with open(os.path.join(out_dir, name), 'rb') as f:
+                if hashlib.sha1(f.read()).digest() in expected_digests:
+                    correct += 1
+
+    return count, correct, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compares the thumbdata carving engines on a synthetic '
+                    'blob of JPEG, PNG and WebP images.'
+    )
+    parser.add_argument(
+        '-s', '--size',
+        dest='size_mib', type=int, default=256, metavar='MIB',
+        help='Size of the synthetic blob in MiB.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed', type=int, default=0,
+        help='Random seed used to generate the blob.'
+    )
+    args = parser.parse_args()
+
+    thumbdata = load_script('extract-android-thumbdata.py')
+    engines = [
+        ('markers', thumbdata.extract_files_from_thumbdata_file),
+        ('segments', thumbdata.carve_files_from_thumbdata_file),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        blob_path = os.path.join(tmp_dir, 'thumbdata3-synthetic')
+        print('Writing {} MiB synthetic blob ..'.format(args.size_mib))
+        expected_digests = write_blob(blob_path, args.size_mib * 1024 * 1024,
+                                      args.seed)
+        size = os.path.getsize(blob_path)
+
+        for name, func in engines:
+            count, correct, elapsed = run_engine(func, blob_path,
+                                                 expected_digests)
+            print('{:10s} {:8d} files  {:8d} correct  {:8.2f} s  '
+                  '{:8.1f} MiB/s'.format(name, count, correct, elapsed,
+                                         size / elapsed / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# corpora.py
+# ==========
+# Generates deterministic synthetic inputs for the benchmarks in this
+# directory.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Synthetic benchmark inputs.
+
+The images are structurally valid, I.E. they have the segments, chunks and
+checksums that the tools in this repository look at, but the image data is
+random and can not be decoded.  The same seed always gives the same files.
+"""
+
+import base64
+import collections
+import hashlib
+import os
+import random
+import struct
+import zlib
+
+
+def _segment(marker, payload):
+    return struct.pack('>BBH', 0xff, marker, len(payload) + 2) + payload
+
+
+def _entropy_coded_data(rng, size):
+    data = bytearray(rng.getrandbits(8) for _ in range(size))
+    # Stuff every 0xFF with a zero byte, as required within scan data.
+    data = data.replace(b'\xff', b'\xff\x00')
+    # Sprinkle in restart markers.
+    for i, pos in enumerate(range(512, len(data), 512)):
+        if data[pos - 1] != 0xff:
+            data[pos:pos] = bytes([0xff, 0xd0 + i % 8])
+    return bytes(data)
+
+
+def _jpeg(rng, scan_size, app_segments):
+    parts = [b'\xff\xd8']
+    parts.append(_segment(0xe0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01'
+                                b'\x00\x00'))
+    parts.extend(app_segments)
+    parts.append(_segment(0xdb, bytes(65)))
+    parts.append(_segment(0xc0, b'\x08\x00\x10\x00\x10\x01\x01\x11\x00'))
+    parts.append(_segment(0xc4, bytes(29)))
+    parts.append(_segment(0xda, b'\x01\x01\x00\x00\x3f\x00'))
+    parts.append(_entropy_coded_data(rng, scan_size))
+    parts.append(b'\xff\xd9')
+    return b''.join(parts)
+
+
+def synthetic_jpeg(rng, scan_size, with_thumbnail=True):
+    """
+    Builds a structurally valid JPEG.  Optionally with an embedded EXIF
+    thumbnail, whose end-of-image marker fools naive carvers.
+    """
+    segments = []
+    if with_thumbnail:
+        thumbnail = synthetic_jpeg(rng, scan_size // 16, with_thumbnail=False)
+        segments.append(_segment(0xe1, b'Exif\x00\x00' + thumbnail))
+    return _jpeg(rng, scan_size, segments)
+
+
+def _tiff_with_thumbnail(thumbnail):
+    # IFD0 at offset 8 with the orientation, IFD1 at offset 26 with the
+    # location of the thumbnail, which follows at offset 56.
+    ifd0 = struct.pack('<H', 1) + \
+        struct.pack('<HHIHH', 0x0112, 3, 1, 1, 0) + struct.pack('<I', 26)
+    ifd1 = struct.pack('<H', 2) + \
+        struct.pack('<HHII', 0x0201, 4, 1, 56) + \
+        struct.pack('<HHII', 0x0202, 4, 1, len(thumbnail)) + \
+        struct.pack('<I', 0)
+    return b'II*\x00' + struct.pack('<I', 8) + ifd0 + ifd1 + thumbnail
+
+
+def exif_jpeg(rng, scan_size):
+    """
+    Builds a structurally valid JPEG with a proper EXIF segment, holding
+    an EXIF thumbnail that can be found by "exif_thumbnail".
+    """
+    thumbnail = synthetic_jpeg(rng, max(256, scan_size // 16),
+                               with_thumbnail=False)
+    return _jpeg(rng, scan_size, [
+        _segment(0xe1, b'Exif\x00\x00' + _tiff_with_thumbnail(thumbnail))
+    ])
+
+
+def _png_chunk(chunk_type, payload):
+    crc = zlib.crc32(chunk_type + payload) & 0xffffffff
+    return struct.pack('>I', len(payload)) + chunk_type + payload + \
+        struct.pack('>I', crc)
+
+
+def synthetic_png(rng, size):
+    idat = bytes(rng.getrandbits(8) for _ in range(size))
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', 16, 16, 8, 2, 0, 0, 0)),
+        _png_chunk(b'IDAT', idat),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def synthetic_webp(rng, size):
+    payload = b'VP8 ' + struct.pack('<I', size) + \
+        bytes(rng.getrandbits(8) for _ in range(size)) + bytes(size & 1)
+    return b'RIFF' + struct.pack('<I', len(payload) + 4) + b'WEBP' + payload
+
+
+def write_blob(path, size, seed=0, distinct_images=64):
+    """
+    Writes "size" bytes of zero-padded, synthetic images to "path", like
+    an Android thumbdata file.
+
+    :return: Set of SHA-1 digests of all the embedded images.
+    """
+    rng = random.Random(seed)
+    images = []
+    for i in range(distinct_images):
+        kind = i % 8
+        if kind == 6:
+            images.append(synthetic_png(rng, rng.randint(1024, 16384)))
+        elif kind == 7:
+            images.append(synthetic_webp(rng, rng.randint(1024, 16384)))
+        else:
+            images.append(synthetic_jpeg(rng, rng.randint(4096, 32768)))
+
+    written = 0
+    with open(path, 'wb') as f:
+        while written < size:
+            image = images[rng.randrange(len(images))]
+            padding = bytes(rng.randint(0, 512))
+            f.write(image)
+            f.write(padding)
+            written += len(image) + len(padding)
+
+    return {hashlib.sha1(image).digest() for image in images}
+
+
+def write_html(path, size, seed=0, distinct_images=32):
+    """
+    Writes about "size" bytes of HTML to "path", with images embedded as
+    base64 data URIs wrapped at 76 characters, as done by mail clients and
+    "save as single file" browser extensions.
+
+    :return: Tuple of the number of embedded images and their total
+             decoded size.
+    """
+    rng = random.Random(seed)
+    images = []
+    for i in range(distinct_images):
+        if i % 4 == 3:
+            images.append(('png', synthetic_png(rng,
+                                                rng.randint(4096, 65536))))
+        else:
+            images.append(('jpeg', synthetic_jpeg(rng,
+                                                  rng.randint(8192, 131072))))
+    encoded = []
+    for subtype, data in images:
+        text = base64.b64encode(data)
+        lines = b'\n'.join(text[i:i + 76] for i in range(0, len(text), 76))
+        encoded.append((subtype, lines, len(data)))
+
+    count = decoded = written = 0
+    filler = b'<p>' + b'Lorem ipsum dolor sit amet. ' * 20 + b'</p>\n'
+    with open(path, 'wb') as f:
+        f.write(b'<!DOCTYPE html>\n<html><body>\n')
+        while written < size:
+            subtype, lines, length = encoded[rng.randrange(len(encoded))]
+            chunk = b''.join([
+                filler * rng.randint(0, 8),
+                b'<img alt="" src="data:image/', subtype.encode('ascii'),
+                b';base64,\n', lines, b'">\n',
+            ])
+            f.write(chunk)
+            written += len(chunk)
+            count += 1
+            decoded += length
+        f.write(b'</body></html>\n')
+    return count, decoded
+
+
+# Kinds of files in the image trees and how often they occur.
+TREE_FILE_KINDS = [
+    ('jpeg', 50),
+    ('png', 20),
+    ('truncated_jpeg', 10),
+    ('corrupt_png', 5),
+    ('truncated_png', 5),
+    ('junk', 5),
+    ('text', 5),
+]
+
+
+def write_image_tree(root, files, seed=0, files_per_directory=50):
+    """
+    Writes a directory tree of "files" images to "root", mixing valid JPEG
+    images with EXIF thumbnails and PNG images with truncated and corrupt
+    ones, junk with image extensions and other files.
+
+    :return: Counter of the number of files and bytes of each kind,
+             keyed like "jpeg" and "jpeg_bytes".
+    """
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight in TREE_FILE_KINDS for _ in range(weight)]
+    counts = collections.Counter()
+    for number in range(files):
+        directory = os.path.join(
+            root, 'dir{:04d}'.format(number // files_per_directory),
+            'sub{:d}'.format(number // files_per_directory % 3))
+        if number % files_per_directory == 0:
+            os.makedirs(directory, exist_ok=True)
+
+        kind = rng.choice(kinds)
+        if kind in ('jpeg', 'truncated_jpeg'):
+            data = exif_jpeg(rng, rng.randint(4096, 32768))
+            extension = '.jpg'
+        elif kind in ('png', 'corrupt_png', 'truncated_png'):
+            data = synthetic_png(rng, rng.randint(2048, 32768))
+            extension = '.png'
+        elif kind == 'junk':
+            data = bytes(rng.getrandbits(8) for _ in range(4096))
+            extension = '.jpg'
+        else:
+            data = b'Not an image.\n' * 64
+            extension = '.txt'
+
+        if kind.startswith('truncated'):
+            data = data[:rng.randint(len(data) // 4, len(data) - 16)]
+        elif kind == 'corrupt_png':
+            data = bytearray(data)
+            data[60] ^= 0xff
+            data = bytes(data)
+
+        path = os.path.join(directory, 'img{:06d}{}'.format(number,
+                                                           extension))
+        with open(path, 'wb') as f:
+            f.write(data)
+        counts[kind] += 1
+        counts[kind + '_bytes'] += len(data)
+    return counts
+
+
+def write_screencaptures(directory, files, seed=0):
+    """
+    Writes "files" empty files named like the screenshots of the "Full
+    Page Screen Capture" Chrome plugin to "directory", taken in 2016-2019.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    millis = 1451606400000
+    for number in range(files):
+        millis += rng.randint(1000, 60000)
+        name = 'screencapture-example-com-page-{}-{}.png'.format(number,
+                                                                 millis)
+        open(os.path.join(directory, name), 'wb').close()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# harness.py
+# ==========
+# Measures the time, throughput and peak memory use of the stages of the
+# benchmarks in this directory.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Benchmark harness.
+
+Every stage of a benchmark is measured as a "Stage": wall and CPU time,
+the amount of data and number of items processed, and the peak resident
+set size.  Stages run in process are measured with the peak RSS of this
+process, which is reset before each stage on Linux, and commands are
+measured with the peak RSS of the command and its children.
+"""
+
+import importlib.util
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# Version of the layout of the JSON results.
+RESULTS_VERSION = 1
+
+
+def load_script(filename):
+    """Imports one of the scripts in the repository, I.E. those whose names
+    are not valid module names."""
+    path = os.path.join(REPO_DIR, filename)
+    name = os.path.splitext(filename)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_quiet_script(filename):
+    """
+    Imports a script whose functions log through a module-level "log",
+    which the scripts only set up when run as programs.  Only warnings and
+    errors are logged, so that logging does not dominate the timings.
+    """
+    module = load_script(filename)
+    module.log = logging.getLogger(module.__name__)
+    module.log.setLevel(logging.WARNING)
+    return module
+
+
+def _reset_peak_rss():
+    # Writing "5" to "clear_refs" resets the peak RSS (VmHWM) on Linux.
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kib():
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Peak of the whole life of the process, in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """
+    :return: Dict of the given percentiles of "values" and the maximum,
+             keyed like "p50" and "max", or None if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    result = {}
+    for point in points:
+        index = min(len(values) - 1, int(round(point / 100 * len(values))))
+        result['p{}'.format(point)] = values[index]
+    result['max'] = values[-1]
+    return result
+
+
+class Stage(object):
+    """
+    Measures one stage of a benchmark.  Used as a context manager, or
+    through "Results.run_command()" for external commands.
+
+    The amount of data and number of items processed are set by the code
+    being measured, through "add()", along with the latency of individual
+    items, through "add_latency()".
+    """
+    def __init__(self, benchmark, name):
+        self.benchmark = benchmark
+        self.name = name
+        self.seconds = None
+        self.cpu_seconds = None
+        self.bytes = 0
+        self.items = 0
+        self.peak_rss_kib = None
+        self.latencies = []
+        self.skipped = None
+        self.extra = {}
+
+    def add(self, size=0, items=0):
+        self.bytes += size
+        self.items += items
+
+    def add_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def skip(self, reason):
+        self.skipped = reason
+
+    def __enter__(self):
+        self._rss_reset = _reset_peak_rss()
+        self._cpu_started = time.process_time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._started
+        self.cpu_seconds = time.process_time() - self._cpu_started
+        if self._rss_reset:
+            self.peak_rss_kib = _peak_rss_kib()
+        else:
+            self.extra['peak_rss_is_lifetime'] = True
+            self.peak_rss_kib = _peak_rss_kib()
+
+    def as_dict(self):
+        result = {'benchmark': self.benchmark, 'stage': self.name}
+        if self.skipped:
+            result['skipped'] = self.skipped
+            return result
+        result.update({
+            'seconds': round(self.seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'bytes': self.bytes,
+            'items': self.items,
+            'peak_rss_kib': self.peak_rss_kib,
+        })
+        if self.seconds > 0:
+            if self.bytes:
+                result['mib_per_second'] = round(
+                    self.bytes / self.seconds / 1024 / 1024, 3)
+            result['items_per_second'] = round(self.items / self.seconds, 3)
+        latency = percentiles(self.latencies)
+        if latency:
+            result['latency_ms'] = {key: round(value * 1000, 3)
+                                    for key, value in latency.items()}
+        result.update(self.extra)
+        return result
+
+
+# Runs commands for "_Spawner" and reports their resource usage.
+_SPAWNER_SCRIPT = """
+import json, os, subprocess, sys, time
+for line in sys.stdin:
+    request = json.loads(line)
+    started = time.perf_counter()
+    proc = subprocess.Popen(request['cmd'], cwd=request['cwd'],
+                            stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    print(json.dumps({
+        'seconds': time.perf_counter() - started,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'maxrss': usage.ru_maxrss,
+        'status': proc.returncode,
+    }), flush=True)
+"""
+
+
+class _Spawner(object):
+    """
+    Runs commands from a small separate process.
+
+    The peak RSS reported for a command on Linux is at least the RSS of
+    the process that forked it, which for the benchmarks would be that of
+    the benchmark process, with all its inputs and outputs.  Commands are
+    instead forked by a fresh interpreter, so the peak RSS of commands is
+    only overstated by its few megabytes.
+    """
+    def __init__(self):
+        self._proc = subprocess.Popen(
+            [sys.executable, '-S', '-c', _SPAWNER_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            universal_newlines=True)
+
+    def run(self, cmd, cwd=None):
+        """
+        Runs a command and waits for it.  Its own children are included
+        in the usage, as "wait4()" reports them along with the command.
+
+        :return: Dict with the wall and CPU "seconds" and "cpu_seconds",
+                 the peak RSS "maxrss" in KiB and the exit "status".
+        """
+        self._proc.stdin.write(json.dumps({'cmd': cmd, 'cwd': cwd}) + '\n')
+        self._proc.stdin.flush()
+        return json.loads(self._proc.stdout.readline())
+
+    def close(self):
+        self._proc.stdin.close()
+        self._proc.wait()
+
+
+class Results(object):
+    """Collects the stages of all benchmarks of a run."""
+    def __init__(self, parameters=None):
+        self.parameters = parameters or {}
+        self.stages = []
+        self._spawner = None
+
+    def stage(self, benchmark, name):
+        """Returns a new "Stage", to be used as a context manager."""
+        stage = Stage(benchmark, name)
+        self.stages.append(stage)
+        return stage
+
+    def skip(self, benchmark, name, reason):
+        self.stage(benchmark, name).skip(reason)
+
+    def run_command(self, benchmark, name, cmd, cwd=None, size=0, items=0,
+                    expected_status=(0, )):
+        """
+        Runs and measures an external command, with its output discarded.
+
+        :return: The "Stage", with the exit status in "extra".
+        """
+        stage = self.stage(benchmark, name)
+        if self._spawner is None:
+            self._spawner = _Spawner()
+        usage = self._spawner.run(cmd, cwd)
+        stage.seconds = usage['seconds']
+        stage.cpu_seconds = usage['cpu_seconds']
+        stage.peak_rss_kib = usage['maxrss']
+        stage.add(size, items)
+        stage.extra['exit_status'] = usage['status']
+        if usage['status'] not in expected_status:
+            stage.extra['failed'] = True
+        return stage
+
+    def close(self):
+        if self._spawner is not None:
+            self._spawner.close()
+            self._spawner = None
+
+    def as_dict(self):
+        return {
+            'version': RESULTS_VERSION,
+            'revision': _revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'parameters': self.parameters,
+            'results': [stage.as_dict() for stage in self.stages],
+        }
+
+    def write(self, fh):
+        json.dump(self.as_dict(), fh, indent=2, sort_keys=True)
+        fh.write('\n')
+
+
+def _revision():
+    try:
+        revision = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision.decode('utf-8').strip()
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares the results of two runs, as loaded from their JSON.
+
+    :param threshold: Relative increase in wall time counted as a
+                      regression.
+    :return: Tuple of a list of lines describing every stage in both runs
+             and the number of regressions.
+    """
+    def _stages(results):
+        return {(r['benchmark'], r['stage']): r for r in results['results']
+                if 'seconds' in r}
+
+    old, new = _stages(baseline), _stages(current)
+    lines = ['{:50s} {:>14s} {:>14s} {:>8s}'.format(
+        'stage', baseline.get('revision') or 'baseline',
+        current.get('revision') or 'current', 'change')]
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key]['seconds'], new[key]['seconds']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        lines.append('{:50s} {:13.3f}s {:13.3f}s {:+7.1%}{}'.format(
+            '/'.join(key), before, after, change, flag))
+    return lines, regressions
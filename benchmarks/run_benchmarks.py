@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# run_benchmarks.py
+# =================
+# Runs the tools in this repository on synthetic inputs and writes the
+# time, throughput and peak memory use of every stage as JSON.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Benchmark suite.
+
+Each benchmark generates its inputs with "corpora", from a fixed seed, and
+measures the stages listed below with "harness".  Save the JSON results of
+two revisions and compare them with "--compare".
+
+  thumbdata       extract_files_from_thumbdata_file()
+                  carve_files_from_thumbdata_file()
+  base64          extract_encoded_images_from_html(), decoding only
+                  decode_and_write_to_disk()
+                  extract_base64_media.py
+  vision          get_images()
+                  query_api(), one image at a time
+                  main(), with "--vision-jobs" threads
+  tree            detect-bad-images.py, detect-bad-images.sh
+                  extract_exif_thumbnails.py, extract_exif_thumbnails.sh
+  screencaptures  chrome-screencapture-renamer.py
+                  chrome-screencapture-renamer.sh
+
+The Vision API is replaced by a local server ("vision_server"), and shell
+tools whose programs are not installed are reported as skipped.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import corpora
+import harness
+from vision_server import VisionStandIn
+
+BENCHMARKS = ['thumbdata', 'base64', 'vision', 'tree', 'screencaptures']
+
+THUMBNAIL_SUFFIX = '_exif_thumbnail.jpg'
+
+
+def _progress(message):
+    print('[{}] {}'.format(time.strftime('%H:%M:%S'), message),
+          file=sys.stderr)
+
+
+def _script(filename):
+    return os.path.join(harness.REPO_DIR, filename)
+
+
+def _missing_programs(programs):
+    missing = [program for program in programs if not shutil.which(program)]
+    if missing:
+        return 'Missing {}'.format(', '.join(missing))
+    return None
+
+
+def _image_tree(workdir, args):
+    root = os.path.join(workdir, 'tree')
+    if not os.path.isdir(root):
+        _progress('Writing a tree of {} files ..'.format(args.tree_files))
+        os.makedirs(root)
+        counts = corpora.write_image_tree(root, args.tree_files, args.seed)
+        with open(os.path.join(workdir, 'tree.json'), 'w') as fh:
+            json.dump(counts, fh)
+    with open(os.path.join(workdir, 'tree.json')) as fh:
+        counts = json.load(fh)
+    size = sum(v for k, v in counts.items() if k.endswith('_bytes'))
+    return root, size
+
+
+def bench_thumbdata(results, workdir, args):
+    thumbdata = harness.load_script('extract-android-thumbdata.py')
+    blob = os.path.join(workdir, 'thumbdata3-synthetic')
+    _progress('Writing a {} MiB thumbdata file ..'.format(args.thumbdata_size))
+    corpora.write_blob(blob, args.thumbdata_size * 1024 * 1024, args.seed)
+    size = os.path.getsize(blob)
+
+    for func in (thumbdata.extract_files_from_thumbdata_file,
+                 thumbdata.carve_files_from_thumbdata_file):
+        out_dir = tempfile.mkdtemp(dir=workdir)
+        _progress('Running {}() ..'.format(func.__name__))
+        with results.stage('thumbdata', func.__name__) as stage:
+            stage.add(size, func(blob, out_dir))
+        shutil.rmtree(out_dir)
+    os.remove(blob)
+
+
+def bench_base64(results, workdir, args):
+    media = harness.load_quiet_script('extract_base64_media.py')
+    html = os.path.join(workdir, 'data-uris.html')
+    _progress('Writing {} MiB of HTML ..'.format(args.html_size))
+    count, _ = corpora.write_html(html, args.html_size * 1024 * 1024,
+                                  args.seed)
+    size = os.path.getsize(html)
+
+    _progress('Running extract_encoded_images_from_html() ..')
+    with results.stage('base64', 'extract_encoded_images_from_html') as stage:
+        for image in media.extract_encoded_images_from_html(html):
+            for _ in image['chunks']:
+                pass
+            stage.add(items=1)
+        stage.add(size)
+
+    # Images are written to the current directory.
+    out_dir = tempfile.mkdtemp(dir=workdir)
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        _progress('Running decode_and_write_to_disk() ..')
+        with results.stage('base64', 'decode_and_write_to_disk') as stage:
+            media.decode_and_write_to_disk(
+                media.extract_encoded_images_from_html(html))
+            stage.add(size, len(os.listdir(out_dir)))
+    finally:
+        os.chdir(cwd)
+    shutil.rmtree(out_dir)
+
+    out_dir = tempfile.mkdtemp(dir=workdir)
+    _progress('Running extract_base64_media.py ..')
+    results.run_command('base64', 'extract_base64_media.py',
+                        [sys.executable, _script('extract_base64_media.py'),
+                         html], cwd=out_dir, size=size, items=count)
+    shutil.rmtree(out_dir)
+    os.remove(html)
+
+
+def bench_vision(results, workdir, args):
+    vision = harness.load_quiet_script('microsoft_vision.py')
+    tree, _ = _image_tree(workdir, args)
+
+    _progress('Running get_images() ..')
+    with results.stage('vision', 'get_images') as stage:
+        paths = list(vision.get_images([tree], recursive=True))
+        stage.add(items=len(paths))
+    paths = paths[:args.vision_images]
+    size = sum(os.path.getsize(path) for path in paths)
+
+    with VisionStandIn(args.vision_latency) as server:
+        client = vision.VisionClient('benchmark', server.endpoint)
+        _progress('Running query_api() on {} images ..'.format(len(paths)))
+        with results.stage('vision', 'query_api') as stage:
+            for path in paths:
+                started = time.perf_counter()
+                if vision.query_api(path, 'benchmark', client) is not False:
+                    stage.add(os.path.getsize(path), 1)
+                stage.add_latency(time.perf_counter() - started)
+        client.close()
+
+        _progress('Running main() with {} threads ..'.format(
+            args.vision_jobs))
+        name = 'main_jobs{}'.format(args.vision_jobs)
+        requests = server.requests
+        with results.stage('vision', name) as stage, \
+                contextlib.redirect_stdout(io.StringIO()):
+            vision.main(paths, 'benchmark', jobs=args.vision_jobs,
+                        endpoint=server.endpoint)
+            stage.add(size, len(paths))
+        stage.extra['server_requests'] = server.requests - requests
+
+
+def _remove_thumbnails(tree):
+    for dirpath, _, filenames in os.walk(tree):
+        for filename in filenames:
+            if filename.endswith(THUMBNAIL_SUFFIX):
+                os.remove(os.path.join(dirpath, filename))
+
+
+def bench_tree(results, workdir, args):
+    tree, size = _image_tree(workdir, args)
+
+    _progress('Running detect-bad-images.py ..')
+    results.run_command(
+        'tree', 'detect-bad-images.py',
+        [sys.executable, _script('detect-bad-images.py'), '--brief',
+         '--recursive', '--no-cache', tree],
+        size=size, items=args.tree_files, expected_status=(0, 1))
+
+    reason = _missing_programs(['exiftool', 'jpeginfo'])
+    if reason:
+        results.skip('tree', 'detect-bad-images.sh', reason)
+    else:
+        _progress('Running detect-bad-images.sh ..')
+        results.run_command(
+            'tree', 'detect-bad-images.sh',
+            ['find', tree, '-type', 'f', '-exec',
+             _script('detect-bad-images.sh'), '-b', '{}', '+'],
+            size=size, items=args.tree_files, expected_status=(0, 1))
+
+    _progress('Running extract_exif_thumbnails.py ..')
+    results.run_command(
+        'tree', 'extract_exif_thumbnails.py',
+        [sys.executable, _script('extract_exif_thumbnails.py'),
+         '--recursive', tree],
+        size=size, items=args.tree_files, expected_status=(0, 1))
+    _remove_thumbnails(tree)
+
+    reason = _missing_programs(['exif'])
+    if reason:
+        results.skip('tree', 'extract_exif_thumbnails.sh', reason)
+    else:
+        _progress('Running extract_exif_thumbnails.sh ..')
+        results.run_command(
+            'tree', 'extract_exif_thumbnails.sh',
+            ['find', tree, '-type', 'f', '-name', '*.jpg', '-exec',
+             _script('extract_exif_thumbnails.sh'), '{}', '+'],
+            size=size, items=args.tree_files, expected_status=(0, 1))
+        _remove_thumbnails(tree)
+
+
+def bench_screencaptures(results, workdir, args):
+    for filename in ('chrome-screencapture-renamer.py',
+                     'chrome-screencapture-renamer.sh'):
+        directory = os.path.join(workdir, 'screencaptures')
+        _progress('Writing {} screenshots ..'.format(args.screencaptures))
+        corpora.write_screencaptures(directory, args.screencaptures,
+                                     args.seed)
+        cmd = [_script(filename), directory]
+        if filename.endswith('.py'):
+            cmd = [sys.executable] + cmd + ['--quiet']
+        _progress('Running {} ..'.format(filename))
+        results.run_command('screencaptures', filename, cmd,
+                            items=args.screencaptures)
+        shutil.rmtree(directory)
+
+
+def run(args):
+    parameters = {key: value for key, value in vars(args).items()
+                  if key not in ('output', 'compare', 'work_dir')}
+    results = harness.Results(parameters)
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+    try:
+        with tempfile.TemporaryDirectory(prefix='image-utils-benchmarks-',
+                                         dir=args.work_dir) as workdir:
+            for name in args.benchmarks:
+                globals()['bench_' + name](results, workdir, args)
+    finally:
+        results.close()
+    return results.as_dict()
+
+
+def main(args):
+    if args.compare and len(args.compare) == 2:
+        current_path = args.compare[1]
+        with open(current_path) as fh:
+            current = json.load(fh)
+    else:
+        current = run(args)
+        if args.output:
+            with open(args.output, 'w') as fh:
+                json.dump(current, fh, indent=2, sort_keys=True)
+                fh.write('\n')
+        elif not args.compare:
+            json.dump(current, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write('\n')
+
+    if not args.compare:
+        return 0
+    with open(args.compare[0]) as fh:
+        baseline = json.load(fh)
+    lines, regressions = harness.compare(baseline, current,
+                                         args.threshold / 100)
+    print('\n'.join(lines))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Runs the tools in this repository on synthetic inputs '
+                    'and prints the time, throughput and peak memory use of '
+                    'every stage as JSON.'
+    )
+    parser.add_argument(
+        dest='benchmarks', nargs='*', metavar='BENCHMARK', default=BENCHMARKS,
+        help='Benchmarks to run, any of {}.  Defaults to all.'.format(
+            ', '.join(BENCHMARKS))
+    )
+    parser.add_argument(
+        '-o', '--output',
+        dest='output', metavar='PATH',
+        help='Write the results to PATH instead of standard output.'
+    )
+    parser.add_argument(
+        '--compare',
+        dest='compare', nargs='+', metavar='PATH',
+        help='Compare the wall times of the results in the first PATH with '
+             'those of this run, or of the second PATH, and exit with '
+             'status 1 if any stage got slower than the threshold.'
+    )
+    parser.add_argument(
+        '--threshold',
+        dest='threshold', type=float, default=10, metavar='PERCENT',
+        help='Slowdown counted as a regression.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--work-dir',
+        dest='work_dir', metavar='PATH',
+        help='Directory to write the inputs to, created if missing.  '
+             'Defaults to the system temporary directory.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed', type=int, default=0,
+        help='Random seed used to generate the inputs.'
+    )
+    parser.add_argument(
+        '--thumbdata-size',
+        dest='thumbdata_size', type=int, default=256, metavar='MIB',
+        help='Size of the thumbdata file.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--html-size',
+        dest='html_size', type=int, default=64, metavar='MIB',
+        help='Size of the HTML file.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--tree-files',
+        dest='tree_files', type=int, default=2000, metavar='N',
+        help='Number of files in the image tree.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--vision-images',
+        dest='vision_images', type=int, default=200, metavar='N',
+        help='Number of images sent to the Vision stand-in.  Defaults to '
+             '%(default)s.'
+    )
+    parser.add_argument(
+        '--vision-latency',
+        dest='vision_latency', type=float, default=0.02, metavar='SECONDS',
+        help='Response time of the Vision stand-in.  Defaults to '
+             '%(default)s.'
+    )
+    parser.add_argument(
+        '--vision-jobs',
+        dest='vision_jobs', type=int, default=8, metavar='N',
+        help='Number of concurrent Vision queries.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--screencaptures',
+        dest='screencaptures', type=int, default=5000, metavar='N',
+        help='Number of screenshots to rename.  Defaults to %(default)s.'
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: {}'.format(', '.join(unknown)))
+
+    sys.exit(main(args))
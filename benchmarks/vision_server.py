@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# vision_server.py
+# ================
+# Local stand-in for the Microsoft Vision API "describe" endpoint, used
+# to benchmark microsoft_vision.py without the network.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import argparse
+import collections
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINT_PATH = '/vision/v1.0/describe'
+
+
+def _response(size):
+    return {
+        'description': {
+            'tags': ['synthetic', 'benchmark'],
+            'captions': [{
+                'text': 'a synthetic image of {} bytes'.format(size),
+                'confidence': 0.9,
+            }],
+        },
+        'requestId': '00000000-0000-0000-0000-000000000000',
+        'metadata': {'width': 16, 'height': 16, 'format': 'Jpeg'},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep connections alive, like the real API.
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and body of responses in one segment, so that the
+    # delayed ACKs of the client do not add to the latency.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        content = self.rfile.read(length)
+        self.server.count(len(content))
+        if self.path.split('?')[0] != ENDPOINT_PATH:
+            self._reply(404, {'error': 'Not found'})
+            return
+        if not self.headers.get('Ocp-Apim-Subscription-Key'):
+            self._reply(401, {'error': 'Missing subscription key'})
+            return
+        status = self.server.next_failure()
+        if status:
+            self._reply(status, {'error': 'Injected failure'})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self._reply(200, _response(len(content)))
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class VisionStandIn(ThreadingHTTPServer):
+    """
+    Serves canned responses to "describe" requests on a local port, after
+    a fixed latency, from a background thread.  Used as a context manager.
+
+    HTTP statuses added to "failures", like 429 or 503, are replied to the
+    next requests instead, to exercise the retries of the client.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, port=0):
+        """
+        :param latency: Seconds to wait before responding, to simulate
+                        the time taken by the API.
+        :param port: Port to listen on, or 0 for any free port.
+        """
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.requests = 0
+        self.bytes_received = 0
+        self.failures = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        """URL of the endpoint, to pass to "VisionClient"."""
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1],
+                                              ENDPOINT_PATH)
+
+    def count(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += size
+
+    def next_failure(self):
+        """Returns the next status in "failures", or None."""
+        with self._lock:
+            return self.failures.popleft() if self.failures else None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serves a local stand-in for the Microsoft Vision API '
+                    '"describe" endpoint.'
+    )
+    parser.add_argument(
+        '-p', '--port',
+        dest='port', type=int, default=8080,
+        help='Port to listen on.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '-l', '--latency',
+        dest='latency', type=float, default=0.05, metavar='SECONDS',
+        help='Time to wait before responding.  Defaults to %(default)s.'
+    )
+    args = parser.parse_args()
+
+    server = VisionStandIn(args.latency, args.port)
+    print('Serving {} ..'.format(server.endpoint))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
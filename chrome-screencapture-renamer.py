@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# chrome-screencapture-renamer.py
+# ===============================
+# Renames images created by the "Full Page Screen Capture" Chrome plugin.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Replacement for "chrome-screencapture-renamer.sh".
+
+  screencapture-carlosbecker-posts-jekyll-with-sass-1479831540449.png
+  --> 2016-11-22T171900 carlosbecker-posts-jekyll-with-sass -- screenshot.png
+
+The directory is listed once and the timestamps are converted in process,
+instead of running "grep" and "date" for every file.  All new names are
+planned before anything is renamed: files that would end up with the same
+name, or with the name of a file that is not renamed, are left alone, and
+renames are ordered so that no file is renamed to a name that is still
+taken.  Cycles are broken with temporary names.
+
+Files are renamed with "renameat2(RENAME_NOREPLACE)" where available, so
+that existing files are never replaced, and every rename is written to a
+journal in the directory, which "--undo" uses to revert the last run.
+"""
+
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import re
+import sys
+import time
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+TS_FORMAT = '%Y-%m-%dT%H%M%S'
+MATCH_PREFIX = 'screencapture-'
+MATCH_EXTENS = 'png'
+ADD_FILETAG = 'screenshot'
+FILETAG_SEP = ' -- '
+
+# Expect 13 digits of milliseconds since the epoch.
+# Note: Hardcoded leading "1" followed by 12 digits means
+#       dates before 2001-09-09T034640 are ignored.
+TIMESTAMP_REGEX = re.compile(r'1[0-9]{12}')
+
+# Timestamps further than this many seconds into the future are assumed
+# to be something else.
+MAX_FUTURE_SECONDS = 24 * 3600
+
+JOURNAL_FILENAME = '.chrome-screencapture-renamer.journal'
+
+# From "<linux/fs.h>".
+RENAME_NOREPLACE = 1
+
+
+def new_filename(filename, now=None):
+    """
+    Gets the new name of a file created by the Chrome plugin.
+
+    :param filename: File name, without any directories.
+    :param now: The current time in seconds since the epoch, used to sanity
+                check timestamps.  Defaults to "time.time()".
+    :return: The new name, or None if the name is not on the expected
+             form or the timestamp is not sane.
+    """
+    if not (filename.startswith(MATCH_PREFIX) and
+            filename.endswith('.' + MATCH_EXTENS)):
+        return None
+    match = TIMESTAMP_REGEX.search(filename)
+    if match is None:
+        return None
+
+    # Get the first 10 of the 13 digits.
+    seconds = int(match.group()[:10])
+    if seconds > (time.time() if now is None else now) + MAX_FUTURE_SECONDS:
+        return None
+    timestamp = time.strftime(TS_FORMAT, time.localtime(seconds))
+
+    # Strip from '-' followed by the digits to the end.
+    cut = filename.rfind('-' + match.group())
+    if cut < 0:
+        cut = len(filename) - len(MATCH_EXTENS) - 1
+    base = filename[:cut]
+
+    tag = ''
+    if ADD_FILETAG:
+        tag = FILETAG_SEP + ADD_FILETAG
+        base = base[len(MATCH_PREFIX):]
+    return '{} {}{}.{}'.format(timestamp, base, tag, MATCH_EXTENS)
+
+
+def _temporary_name(name, taken):
+    for i in range(1000):
+        candidate = '.{}.renaming-{}'.format(name, i)
+        if candidate not in taken:
+            return candidate
+    raise RuntimeError('No free temporary name for "{}"'.format(name))
+
+
+def plan_renames(renames, existing):
+    """
+    Orders renames so that no file is renamed to a name that is taken when
+    the rename happens.
+
+    :param renames: Dict of new names keyed by current names.
+    :param existing: Set of the names of all files in the directory.
+    :return: Tuple of a list of tuples of current and new names, in the
+             order to rename them, and a list of tuples of current names,
+             new names and the reason the file is not renamed.
+    """
+    conflicts = []
+    pending = {src: dst for src, dst in renames.items() if src != dst}
+
+    sources_by_dst = collections.defaultdict(list)
+    for src, dst in pending.items():
+        sources_by_dst[dst].append(src)
+    for dst, sources in sources_by_dst.items():
+        if len(sources) > 1:
+            for src in sorted(sources):
+                conflicts.append((src, dst, 'same new name as another file'))
+                del pending[src]
+
+    # Files whose new name is taken by a file staying put also stay put,
+    # which may in turn block others.
+    blocked = True
+    while blocked:
+        blocked = [src for src, dst in pending.items()
+                   if dst in existing and dst not in pending]
+        for src in blocked:
+            conflicts.append((src, pending.pop(src), 'new name exists'))
+
+    # Renames whose new name is free go first, which frees the old name
+    # for the rename waiting for it, if any.
+    waiting_for = {dst: src for src, dst in pending.items() if dst in pending}
+    ready = collections.deque(sorted(src for src, dst in pending.items()
+                                     if dst not in pending))
+    steps = []
+    taken = set(existing) | set(pending.values())
+    while pending:
+        if not ready:
+            # Only cycles are left.  Move one file of a cycle out of the
+            # way, which lets the rest of the cycle through.
+            src = min(pending)
+            temp = _temporary_name(src, taken)
+            taken.add(temp)
+            steps.append((src, temp))
+            pending[temp] = pending.pop(src)
+            waiting_for[pending[temp]] = temp
+            ready.append(waiting_for.pop(src))
+            continue
+
+        src = ready.popleft()
+        steps.append((src, pending.pop(src)))
+        if src in waiting_for:
+            ready.append(waiting_for.pop(src))
+
+    return steps, conflicts
+
+
+def _load_renameat2():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return None
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int,
+                          ctypes.c_char_p, ctypes.c_uint]
+    return renameat2
+
+
+class Renamer(object):
+    """
+    Renames files within a directory without ever replacing a file, and
+    journals every rename.
+    """
+    def __init__(self, dir_fd, journal=None):
+        """
+        :param dir_fd: File descriptor of the directory.
+        :param journal: Optional text file to write the renames to.
+        """
+        self.dir_fd = dir_fd
+        self.journal = journal
+        self._renameat2 = _load_renameat2()
+
+    def _rename_noreplace(self, src, dst):
+        if self._renameat2 is not None:
+            result = self._renameat2(self.dir_fd, os.fsencode(src),
+                                     self.dir_fd, os.fsencode(dst),
+                                     RENAME_NOREPLACE)
+            if result == 0:
+                return
+            error = ctypes.get_errno()
+            if error not in (errno.EINVAL, errno.ENOSYS):
+                raise OSError(error, os.strerror(error), src, None, dst)
+            # Not supported by the file system.
+            self._renameat2 = None
+
+        try:
+            os.link(src, dst, src_dir_fd=self.dir_fd, dst_dir_fd=self.dir_fd)
+        except FileExistsError:
+            raise
+        except OSError:
+            # File systems without hard links.
+            if os.path.lexists(os.path.join('/proc/self/fd',
+                                            str(self.dir_fd), dst)):
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST),
+                                      src, None, dst)
+            os.rename(src, dst, src_dir_fd=self.dir_fd, dst_dir_fd=self.dir_fd)
+            return
+        os.unlink(src, dir_fd=self.dir_fd)
+
+    def rename(self, src, dst):
+        """
+        :raises OSError: The file could not be renamed, for instance
+                         because "dst" exists ("FileExistsError").
+        """
+        self._rename_noreplace(src, dst)
+        if self.journal is not None:
+            self.journal.write(json.dumps({'src': src, 'dst': dst}) + '\n')
+
+
+def _open_journal(dirpath):
+    path = os.path.join(dirpath, JOURNAL_FILENAME)
+    journal = open(path, 'a', encoding='utf-8', buffering=1)
+    journal.write(json.dumps({'run': time.strftime(TS_FORMAT)}) + '\n')
+    return journal
+
+
+def _apply(steps, renamer, verbose):
+    failed = 0
+    for src, dst in steps:
+        try:
+            renamer.rename(src, dst)
+        except OSError as e:
+            print('{}: Unable to rename "{}": {!s}'.format(PROGRAM_NAME, src,
+                                                            e),
+                  file=sys.stderr)
+            failed += 1
+            continue
+        if verbose:
+            sys.stdout.write('renamed \'{}\' -> \'{}\'\n'.format(src, dst))
+    return failed
+
+
+def rename_screencaptures(dirpath, dry_run=False, verbose=True):
+    """
+    Renames all files created by the Chrome plugin in a directory.
+
+    :return: 0 if all files were renamed, otherwise 1.
+    """
+    with os.scandir(dirpath) as entries:
+        existing = {entry.name for entry in entries}
+
+    now = time.time()
+    renames = {}
+    for name in existing:
+        if not name.startswith(MATCH_PREFIX):
+            continue
+        new_name = new_filename(name, now)
+        if new_name is not None:
+            renames[name] = new_name
+        elif name.endswith('.' + MATCH_EXTENS) and \
+                TIMESTAMP_REGEX.search(name):
+            print('  WARNING  -- Failed sanity check. Skipping ..')
+            print('   [FILE] : {}'.format(name))
+
+    steps, conflicts = plan_renames(renames, existing)
+    for src, dst, reason in conflicts:
+        print('Not renaming "{}" to "{}": {}'.format(src, dst, reason))
+
+    if dry_run:
+        for src, dst in steps:
+            print('   [FILE] : {}'.format(src))
+            print(' [RESULT] : {}'.format(dst))
+        return 1 if conflicts else 0
+
+    dir_fd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+    journal = _open_journal(dirpath) if steps else None
+    try:
+        failed = _apply(steps, Renamer(dir_fd, journal), verbose)
+    finally:
+        if journal is not None:
+            journal.close()
+        os.close(dir_fd)
+
+    return 1 if conflicts or failed else 0
+
+
+def undo_last_run(dirpath, verbose=True):
+    """
+    Reverts the renames of the last run in a directory, as recorded in its
+    journal, and removes them from the journal.
+
+    :return: 0 if all renames were reverted, otherwise 1.
+    """
+    path = os.path.join(dirpath, JOURNAL_FILENAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            lines = fh.readlines()
+    except FileNotFoundError:
+        print('Nothing to undo in "{}"'.format(dirpath))
+        return 0
+
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # Last line of an interrupted run.
+            break
+    last_run = max((i for i, entry in enumerate(entries) if 'run' in entry),
+                   default=0)
+    steps = [(entry['dst'], entry['src'])
+             for entry in reversed(entries[last_run:]) if 'src' in entry]
+
+    dir_fd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        failed = _apply(steps, Renamer(dir_fd), verbose)
+    finally:
+        os.close(dir_fd)
+
+    if failed:
+        return 1
+    if last_run:
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.writelines(lines[:last_run])
+    else:
+        os.remove(path)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Renames images created by the "Full Page Screen Capture" '
+                    'Chrome plugin.  Files in PATH that matches "{}*.{}" will '
+                    'be renamed, without ever replacing existing '
+                    'files.'.format(MATCH_PREFIX, MATCH_EXTENS),
+        epilog='Renames are journaled in "{}" within PATH.'.format(
+            JOURNAL_FILENAME)
+    )
+    parser.add_argument(
+        dest='path', metavar='PATH',
+        help='Directory of files to rename.'
+    )
+    parser.add_argument(
+        '-n', '--dry-run',
+        dest='dry_run', action='store_true', default=False,
+        help='Print the new names without renaming anything.'
+    )
+    parser.add_argument(
+        '-q', '--quiet',
+        dest='verbose', action='store_false', default=True,
+        help='Do not print every renamed file.'
+    )
+    parser.add_argument(
+        '--undo',
+        dest='undo', action='store_true', default=False,
+        help='Revert the renames of the last run in PATH.'
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.path):
+        parser.error('Not a directory: "{}"'.format(args.path))
+
+    try:
+        if args.undo:
+            sys.exit(undo_last_run(args.path, args.verbose))
+        sys.exit(rename_screencaptures(args.path, args.dry_run, args.verbose))
+    except OSError as e:
+        sys.exit('{}: {!s}'.format(PROGRAM_NAME, e))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
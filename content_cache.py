@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# content_cache.py
+# ================
+# Persistent key-value cache with expiry and size-bounded LRU eviction,
+# used to avoid recomputing expensive results like API responses.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Persistent cache of binary values, stored in a SQLite database.
+
+Keys are usually derived from a hash of the content the cached value was
+computed from, see "content_key()".  Entries expire after a configurable
+time to live and the least recently used entries are evicted when the
+cache grows above a configurable size.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def default_cache_path(filename):
+    """
+    Returns the path to a cache database in the user cache directory,
+    I.E. "$XDG_CACHE_HOME/image-utils/<filename>".  The directory is
+    created if missing.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    cache_dir = os.path.join(cache_home, 'image-utils')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return os.path.join(cache_dir, filename)
+
+
+def content_key(content, *parts):
+    """
+    Returns a cache key for "content", any bytes-like object, computed
+    with some other values like parameters that affect the cached result.
+    """
+    hasher = hashlib.sha256(content)
+    for part in parts:
+        hasher.update(b'\x00' + str(part).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class ContentCache(object):
+    """
+    Persistent cache of binary values keyed by strings.  Safe to share
+    between threads and processes.
+    """
+    # Maximum number of keys per statement in the "*_many()" methods.
+    BATCH_SIZE = 500
+
+    # Expired entries are removed after every this many stored entries,
+    # or sooner if the cache grows above its maximum size.
+    EVICT_INTERVAL = 1000
+
+    def __init__(self, path, ttl=None, max_size=None):
+        """
+        :param path: Path to the SQLite database, created if missing.
+        :param ttl: Number of seconds entries are valid, or None.
+        :param max_size: Maximum total size of the cached values in bytes,
+                         or None.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # Only the most recent entries can be lost on power failure, which
+        # is fine for a cache, and commits do not wait for the disk.
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        # Makes "INSERT OR REPLACE" fire the delete triggers of replaced
+        # entries, so that the total size stays right.
+        self._db.execute('PRAGMA recursive_triggers=ON')
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                             'key TEXT PRIMARY KEY, value BLOB, size INTEGER, '
+                             'created REAL, accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+                             'ON entries (accessed)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_created '
+                             'ON entries (created)')
+            # Total size of the entries, kept up to date by triggers so
+            # that it is never summed over the whole table.
+            self._db.execute('CREATE TABLE IF NOT EXISTS total_size ('
+                             'id INTEGER PRIMARY KEY CHECK (id = 0), '
+                             'size INTEGER)')
+            self._db.execute('INSERT OR IGNORE INTO total_size (id, size) '
+                             'SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+            self._db.execute('CREATE TRIGGER IF NOT EXISTS entries_insert '
+                             'AFTER INSERT ON entries BEGIN '
+                             'UPDATE total_size SET size = size + NEW.size; '
+                             'END')
+            self._db.execute('CREATE TRIGGER IF NOT EXISTS entries_delete '
+                             'AFTER DELETE ON entries BEGIN '
+                             'UPDATE total_size SET size = size - OLD.size; '
+                             'END')
+            self._db.execute('CREATE TRIGGER IF NOT EXISTS entries_update '
+                             'AFTER UPDATE OF size ON entries BEGIN '
+                             'UPDATE total_size '
+                             'SET size = size - OLD.size + NEW.size; END')
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, key):
+        """
+        :return: The cached value, or None if missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, created FROM entries '
+                                   'WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                return None
+
+            value, created = row
+            if self.ttl is not None and created + self.ttl < now:
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key, ))
+                return None
+
+            self._db.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                             (now, key))
+        return bytes(value)
+
+    def get_many(self, keys):
+        """
+        Looks up several keys at once, in a single transaction.
+
+        :return: Dict mapping the keys found to their cached values.
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for i in range(0, len(keys), self.BATCH_SIZE):
+                    batch = keys[i:i + self.BATCH_SIZE]
+                    rows = self._db.execute(
+                        'SELECT key, value, created FROM entries '
+                        'WHERE key IN ({})'.format(','.join('?' * len(batch))),
+                        batch
+                    )
+                    for key, value, created in rows.fetchall():
+                        if self.ttl is None or created + self.ttl >= now:
+                            found[key] = bytes(value)
+                self._db.executemany(
+                    'UPDATE entries SET accessed = ? WHERE key = ?',
+                    [(now, key) for key in found]
+                )
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return found
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if the
+        cache has grown too large.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, sqlite3.Binary(value), len(value), now, now)
+            )
+        self._stored(1)
+
+    def put_many(self, items):
+        """
+        Stores several values at once, in a single transaction.
+
+        :param items: Iterable of tuples of keys and values.
+        """
+        items = list(items)
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO entries '
+                    '(key, value, size, created, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(key, sqlite3.Binary(value), len(value), now, now)
+                     for key, value in items]
+                )
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        self._stored(len(items))
+
+    def _stored(self, count):
+        # Only evicts when the cache is too large, and now and then to
+        # remove expired entries.
+        if self.max_size is None:
+            return
+        with self._lock:
+            self._puts += count
+            due = self._puts >= self.EVICT_INTERVAL
+            if due:
+                self._puts = 0
+            elif self._total_size() <= self.max_size:
+                return
+        self.evict()
+
+    def _total_size(self):
+        return self._db.execute(
+            'SELECT size FROM total_size WHERE id = 0').fetchone()[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM entries WHERE key = ?', (key, ))
+
+    def delete_many(self, keys):
+        """Removes several entries at once, in a single transaction."""
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                self._db.executemany('DELETE FROM entries WHERE key = ?',
+                                     [(key, ) for key in keys])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def items(self):
+        """
+        Yields tuples of all keys and values, ordered by key.  Entries are
+        read a page at a time, so the cache can be modified meanwhile.
+        """
+        last_key = ''
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT key, value FROM entries WHERE key > ? '
+                    'ORDER BY key LIMIT ?', (last_key, self.BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            for key, value in rows:
+                yield key, bytes(value)
+            last_key = rows[-1][0]
+
+    def evict(self, max_age=None):
+        """
+        Removes expired entries, entries not accessed within "max_age"
+        seconds and then least recently used entries until the cache is
+        no larger than its maximum size.
+
+        :return: Number of removed entries.
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            if self.ttl is not None:
+                removed += self._db.execute(
+                    'DELETE FROM entries WHERE created < ?', (now - self.ttl, )
+                ).rowcount
+            if max_age is not None:
+                removed += self._db.execute(
+                    'DELETE FROM entries WHERE accessed < ?', (now - max_age, )
+                ).rowcount
+
+            if self.max_size is None:
+                return removed
+
+            total_size = self._total_size()
+            if total_size <= self.max_size:
+                return removed
+
+            evicted = []
+            for key, size in self._db.execute(
+                    'SELECT key, size FROM entries ORDER BY accessed'):
+                if total_size <= self.max_size:
+                    break
+                evicted.append((key, ))
+                total_size -= size
+            self._db.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        return removed + len(evicted)
+
+    def vacuum(self):
+        """Reclaims disk space left by removed entries."""
+        with self._lock:
+            self._db.execute('VACUUM')
+
+    def stats(self):
+        """Returns a dict with the number of entries and their total size."""
+        with self._lock:
+            count, = self._db.execute(
+                'SELECT COUNT(*) FROM entries').fetchone()
+            size = self._total_size()
+        return {'entries': count, 'size': size}
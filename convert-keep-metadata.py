@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# convert-keep-metadata.py
+# ========================
+# Converts images from one format to another while keeping any metadata,
+# in a single decode and encode per image.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Batch replacement for "convert-keep-metadata.sh".
+
+Rather than converting with "convert" and then rewriting the converted
+file with "exiftool -tagsfromfile", every image is decoded once with
+Pillow and encoded to the target format with its EXIF, XMP and ICC
+profile blocks passed along in the same write.
+
+Images are converted by a pool of worker processes.  Converted images are
+written to a temporary file next to the destination and then linked into
+place, so there are never any partially written destinations and existing
+destinations are never overwritten.
+
+HEIC/HEIF images can be read and written if "pillow-heif" is installed.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:
+    Image = None
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+# JPEG and WebP quality, the same default as "convert".
+DEFAULT_QUALITY = 92
+
+# Number of images passed to a worker process at a time.
+CHUNK_SIZE = 8
+
+# Modes that can be saved by formats without alpha or palette support.
+RGB_ONLY_FORMATS = {'JPEG': ('RGB', 'L', 'CMYK')}
+
+# Metadata blocks each format can carry.  Anything else is dropped, with
+# a warning.
+FORMAT_METADATA = {
+    'JPEG': ('exif', 'icc_profile', 'xmp'),
+    'WEBP': ('exif', 'icc_profile', 'xmp'),
+    'PNG': ('exif', 'icc_profile', 'xmp'),
+    'TIFF': ('exif', 'icc_profile'),
+    'HEIF': ('exif', 'icc_profile', 'xmp'),
+    'AVIF': ('exif', 'icc_profile', 'xmp'),
+}
+
+# Outcomes of converting an image.
+CONVERTED = 'CONVERTED'
+SKIPPED = 'SKIPPED'
+FAILED = 'FAILED'
+
+
+def target_format(extension):
+    """
+    :param extension: Target file extension, like "jpg", with or without
+                      the leading dot.
+    :return: The Pillow format name, like "JPEG", or None if unknown.
+    """
+    extension = '.' + extension.lstrip('.').lower()
+    return Image.registered_extensions().get(extension)
+
+
+def read_metadata(image):
+    """
+    Gets the metadata blocks of an opened image.
+
+    :return: Dict with any of the keys "exif", "icc_profile" and "xmp",
+             mapped to the raw blocks as bytes.
+    """
+    metadata = {}
+
+    exif = image.info.get('exif')
+    if not exif:
+        parsed = image.getexif()
+        if len(parsed):
+            exif = parsed.tobytes()
+    if exif:
+        metadata['exif'] = exif
+
+    if image.info.get('icc_profile'):
+        metadata['icc_profile'] = image.info['icc_profile']
+
+    xmp = image.info.get('xmp')
+    if not xmp and hasattr(image, 'tag_v2'):
+        xmp = image.tag_v2.get(700)
+    if xmp:
+        if isinstance(xmp, str):
+            xmp = xmp.encode('utf-8')
+        metadata['xmp'] = xmp
+
+    return metadata
+
+
+def save_options(image_format, metadata, quality=DEFAULT_QUALITY):
+    """
+    Gets the Pillow "save()" options writing the metadata blocks along
+    with the image.
+
+    :return: Tuple of a dict of options and a list of the names of
+             metadata blocks the format cannot carry.
+    """
+    supported = FORMAT_METADATA.get(image_format, ())
+    options = {}
+    dropped = [name for name in metadata if name not in supported]
+
+    for name in ('exif', 'icc_profile'):
+        if name in metadata and name in supported:
+            options[name] = metadata[name]
+
+    if 'xmp' in metadata and 'xmp' in supported:
+        if image_format == 'PNG':
+            pnginfo = PngImagePlugin.PngInfo()
+            pnginfo.add_itxt('XML:com.adobe.xmp',
+                             metadata['xmp'].decode('utf-8', 'replace'))
+            options['pnginfo'] = pnginfo
+        else:
+            options['xmp'] = metadata['xmp']
+
+    if image_format in ('JPEG', 'WEBP', 'HEIF', 'AVIF'):
+        options['quality'] = quality
+    return options, dropped
+
+
+def destination_path(source_path, extension):
+    return '{}.{}'.format(os.path.splitext(source_path)[0],
+                          extension.lstrip('.'))
+
+
+def _file_mode():
+    """Returns the mode of new files, as restricted by the umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _link_into_place(temp_path, dest_path):
+    """
+    Moves a written temporary file to its destination, unless the
+    destination exists.  Returns False if it does.
+    """
+    try:
+        os.link(temp_path, dest_path)
+    except FileExistsError:
+        return False
+    except OSError:
+        # File systems without hard links.
+        if os.path.lexists(dest_path):
+            return False
+        os.rename(temp_path, dest_path)
+        return True
+    os.remove(temp_path)
+    return True
+
+
+def convert_keep_metadata(source_path, extension, quality=DEFAULT_QUALITY):
+    """
+    Converts an image to another format, keeping its metadata.
+
+    :param source_path: Path to the image to convert.
+    :param extension: Extension of the target format, like "jpg".
+    :param quality: JPEG/WebP/HEIF quality.
+    :return: Tuple of the outcome, one of "CONVERTED", "SKIPPED" and
+             "FAILED", and a message.
+    """
+    dest_path = destination_path(source_path, extension)
+    if os.path.lexists(dest_path):
+        return SKIPPED, 'Destination exists:  "{}"'.format(dest_path)
+    if not os.path.isfile(source_path):
+        return SKIPPED, 'Not a file:  "{}"'.format(source_path)
+    if not os.access(source_path, os.R_OK):
+        return SKIPPED, 'Not a readable file:  "{}"'.format(source_path)
+
+    image_format = target_format(extension)
+    try:
+        image = Image.open(source_path)
+    except (IOError, OSError):
+        return SKIPPED, 'Not an image:  "{}"'.format(source_path)
+
+    temp_path = None
+    try:
+        with image:
+            metadata = read_metadata(image)
+            options, dropped = save_options(image_format, metadata, quality)
+
+            modes = RGB_ONLY_FORMATS.get(image_format)
+            if modes and image.mode not in modes:
+                image = image.convert('RGB')
+
+            fd, temp_path = tempfile.mkstemp(
+                prefix='.{}.'.format(os.path.basename(dest_path)),
+                suffix='.tmp', dir=os.path.dirname(dest_path) or os.curdir
+            )
+            # Files created by mkstemp() are only readable by the owner.
+            os.fchmod(fd, _file_mode())
+            with os.fdopen(fd, 'wb') as fh:
+                image.save(fh, image_format, **options)
+
+        if not _link_into_place(temp_path, dest_path):
+            return SKIPPED, 'Destination exists:  "{}"'.format(dest_path)
+    except (IOError, OSError, ValueError, KeyError) as e:
+        return FAILED, 'Failed to convert "{}":  {!s}'.format(source_path, e)
+    finally:
+        if temp_path and os.path.lexists(temp_path):
+            os.remove(temp_path)
+
+    message = 'Converted  "{}"\n       -->  "{}"'.format(source_path,
+                                                         dest_path)
+    if dropped:
+        message += '\n  [WARNING] {} cannot hold metadata:  {}'.format(
+            image_format, ', '.join(sorted(dropped)))
+    return CONVERTED, message
+
+
+def _convert(args):
+    return convert_keep_metadata(*args)
+
+
+def main(extension, paths, jobs=1, quality=DEFAULT_QUALITY, verbose=False):
+    """
+    Converts images in a pool of worker processes.
+
+    :return: 0 if no image failed to convert, otherwise 1.
+    """
+    exit_status = 0
+    tasks = [(path, extension, quality) for path in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for outcome, message in executor.map(_convert, tasks,
+                                             chunksize=CHUNK_SIZE):
+            if outcome == CONVERTED:
+                if verbose:
+                    print(message)
+                elif '[WARNING]' in message:
+                    print(message.split('\n', 2)[-1].strip())
+            else:
+                print('[{}] {}'.format(outcome, message))
+            if outcome == FAILED:
+                exit_status = 1
+    return exit_status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Converts images from one format to another while keeping '
+                    'any metadata.  Given FILES are converted to the format '
+                    'given by TARGET_EXTENSION.  EXIF, XMP and ICC profile '
+                    'blocks of the original are written along with the '
+                    'converted image.  Existing destination files are never '
+                    'overwritten.',
+        epilog='Requires Pillow, and pillow-heif for HEIC/HEIF images.'
+    )
+    parser.add_argument(
+        dest='extension', metavar='TARGET_EXTENSION',
+        help='Extension of the target format, like "jpg" or "png".'
+    )
+    parser.add_argument(
+        dest='files', nargs='+', metavar='FILE',
+        help='Path(s) to the images to convert.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+        help='Number of worker processes.  Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '-q', '--quality',
+        dest='quality', type=int, default=DEFAULT_QUALITY,
+        help='JPEG, WebP and HEIF quality.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        dest='verbose', action='store_true', default=False,
+        help='Print every converted image.'
+    )
+    args = parser.parse_args()
+
+    if Image is None:
+        sys.exit('[ERROR] Pillow is not available on this system.\n'
+                 '        Please install Pillow before running this script.')
+    if not target_format(args.extension):
+        parser.error('Unknown target extension "{}"'.format(args.extension))
+
+    try:
+        sys.exit(main(args.extension, args.files, max(1, args.jobs),
+                      args.quality, args.verbose))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
@@ -9,6 +9,13 @@ set -o noclobber -o nounset -o pipefail -o errexit
 
 
 SELF_BASENAME="$(basename "$0")"
+SELF_DIRPATH="$(dirname -- "$(readlink --canonicalize -- "${BASH_SOURCE[0]}")")"
+readonly SELF_DIRPATH
+
+# Pairs of source and destination paths of converted images.  Metadata is
+# copied for all of them at once by a pool of long-lived exiftool processes
+# instead of starting exiftool once per image.
+converted=()
 
 
 assert_has_command()
@@ -69,22 +76,29 @@ convert_keep_metadata()
     # For instance; 'Date/Time Original' becomes 'Exif Date Time Original' ..
     if convert -quiet "$_source_path" "$_dest_path"
     then
-        if exiftool -quiet -tagsfromfile "$_source_path" "$_dest_path"
-        then
-            # TODO: Delete original?
-            return 0
-        fi
+        # TODO: Delete original?
+        converted+=("$_source_path" "$_dest_path")
+        return 0
     fi
 
     return 1
 }
 
+copy_metadata_of_converted()
+{
+    [ "${#converted[@]}" -gt "0" ] || return 0
+
+    printf '%s\0' "${converted[@]}" |
+        python3 "${SELF_DIRPATH}/exiftool_pool.py" copy-tags --quiet --stdin
+}
+
 
 # Make sure required executables are available.
 assert_has_command convert
 assert_has_command file
 assert_has_command exiftool
 assert_has_command mogrify
+assert_has_command python3
 
 # Expect at least two arguments.
 if [ "$#" -lt "2" ]
@@ -117,5 +131,7 @@ do
     fi
 done
 
+copy_metadata_of_converted
+
 
 exit $?
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# dedup_index.py
+# ==============
+# Persistent index of the contents of extracted images, used to avoid
+# writing the same data to disk over and over.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Content-hash deduplication of extracted files.
+
+Extractors hash the data they are about to write and ask the index whether
+identical data has already been written.  Duplicates are then either
+skipped or hard-linked to the first written copy.
+
+The index is a SQLite database, which can be shared by several processes
+at once.
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+
+def new_hasher():
+    """Returns a new hash object used for content digests."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_digest(data):
+    """Returns the content digest of "data", any bytes-like object."""
+    hasher = new_hasher()
+    hasher.update(data)
+    return hasher.digest()
+
+
+class DedupIndex(object):
+    """
+    Maps content digests to the path of the first file written with that
+    content.  Also keeps count of skipped duplicates and the bytes saved.
+    """
+    def __init__(self, path, hardlink=False):
+        """
+        :param path: Path to the SQLite database, created if missing.
+        :param hardlink: Whether duplicates should be hard-linked to the
+                         first written copy instead of being skipped.
+        """
+        self.path = path
+        self.hardlink = hardlink
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'digest BLOB PRIMARY KEY, size INTEGER, path TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS counters ('
+                         'name TEXT PRIMARY KEY, value INTEGER)')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def claim(self, digest, size, path):
+        """
+        Registers "path" as the first copy of the content with the given
+        digest, unless the content has already been written elsewhere.
+
+        Existing entries whose files have since been removed are replaced.
+
+        :return: Path to the existing copy, or None if "path" was registered
+                 and should be written.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO files (digest, size, path) '
+                'VALUES (?, ?, ?)', (digest, size, path)
+            )
+            if cursor.rowcount:
+                return None
+
+            existing, = self._db.execute(
+                'SELECT path FROM files WHERE digest = ?', (digest, )
+            ).fetchone()
+            if not os.path.exists(existing):
+                self._db.execute('UPDATE files SET path = ? WHERE digest = ?',
+                                 (path, digest))
+                return None
+
+            return existing
+
+    def release(self, digest):
+        """Removes an entry claimed for a file that was never written."""
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE digest = ?', (digest, ))
+
+    def _count_duplicate(self, size):
+        with self._lock:
+            for name, value in (('duplicates', 1), ('bytes_saved', size)):
+                self._db.execute(
+                    'INSERT INTO counters (name, value) VALUES (?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET value = value + ?',
+                    (name, value, value)
+                )
+
+    def _link_duplicate(self, existing, path):
+        if not self.hardlink or os.path.abspath(path) == existing:
+            return
+        if os.path.lexists(path):
+            os.remove(path)
+        os.link(existing, path)
+
+    def write(self, data, path):
+        """
+        Writes "data" to "path" unless identical data has already been
+        written, in which case "path" is either skipped or hard-linked.
+
+        :param data: Bytes-like object to write.
+        :param path: Destination path.
+        :return: True if "data" was written, False if it was a duplicate.
+        """
+        digest = content_digest(data)
+        existing = self.claim(digest, len(data), path)
+        if existing is None:
+            try:
+                # Never write through a hard link to another copy.
+                if os.path.lexists(path):
+                    os.remove(path)
+                with open(path, 'wb') as fh:
+                    fh.write(data)
+            except Exception:
+                self.release(digest)
+                raise
+            return True
+
+        self._count_duplicate(len(data))
+        self._link_duplicate(existing, path)
+        return False
+
+    def add_written(self, path, digest=None):
+        """
+        Checks a file that has already been written.  A duplicate file is
+        removed or replaced by a hard link to the first written copy.
+
+        :param path: Path to the written file.
+        :param digest: Content digest of the file, computed if not given.
+        :return: True if the file was kept, False if it was a duplicate.
+        """
+        size = os.path.getsize(path)
+        if digest is None:
+            hasher = new_hasher()
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+            digest = hasher.digest()
+
+        existing = self.claim(digest, size, path)
+        if existing is None or existing == os.path.abspath(path):
+            return True
+
+        os.remove(path)
+        self._count_duplicate(size)
+        self._link_duplicate(existing, path)
+        return False
+
+    def stats(self):
+        """Returns a dict with the number of unique files, the number of
+        skipped duplicates and the total number of bytes saved."""
+        with self._lock:
+            counters = dict(self._db.execute('SELECT name, value FROM counters'))
+            unique, = self._db.execute('SELECT COUNT(*) FROM files').fetchone()
+        return {
+            'unique_files': unique,
+            'duplicates': counters.get('duplicates', 0),
+            'bytes_saved': counters.get('bytes_saved', 0),
+        }
+
+    def format_stats(self):
+        return ('Dedup index "{}": {unique_files} unique files, '
+                '{duplicates} duplicates, {bytes_saved} bytes saved'.format(
+                    self.path, **self.stats()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Checks already written files against a deduplication '
+                    'index.  Files whose contents are already in the index '
+                    'are removed, or replaced by hard links with '
+                    '"--hardlink".'
+    )
+    parser.add_argument(
+        '-i', '--index',
+        dest='index', required=True, metavar='PATH',
+        help='Path to the deduplication index database.'
+    )
+    parser.add_argument(
+        '-l', '--hardlink',
+        dest='hardlink', action='store_true', default=False,
+        help='Replace duplicates with hard links to the first copy.'
+    )
+    parser.add_argument(
+        '-s', '--stats',
+        dest='stats', action='store_true', default=False,
+        help='Print the index statistics when done.'
+    )
+    parser.add_argument(
+        dest='files', nargs='*', metavar='FILE',
+        help='Files to check against the index.'
+    )
+    args = parser.parse_args()
+
+    exit_status = 0
+    with DedupIndex(args.index, args.hardlink) as index:
+        for path in args.files:
+            try:
+                if not index.add_written(path):
+                    print('{}: Duplicate: {}'.format(PROGRAM_NAME, path))
+            except (IOError, OSError) as e:
+                print('{}: {}'.format(PROGRAM_NAME, e), file=sys.stderr)
+                exit_status = 1
+
+        if args.stats:
+            print(index.format_stats())
+
+    sys.exit(exit_status)
@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# detect-bad-images.py
+# ====================
+# Detects corrupt images by walking their structure, without spawning any
+# external programs.  Good for sifting through data produced by data
+# recovery or forensics.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+In-process replacement for "detect-bad-images.sh".
+
+Instead of running "file", "exiftool" and "jpeginfo" for every file, the
+file type is identified from its header bytes and the image is walked
+with the functions in "image_carving": JPEG images segment by segment up
+to the end-of-image marker, PNG images chunk by chunk with every CRC
+verified.  Files are checked in batches by a pool of worker processes.
+
+The options and exit status are the same as those of the shell script.
+
+Verdicts are cached between runs, keyed by the identity of the file, I.E.
+its device, inode, size and modification time.  Only new or changed files
+are checked again.  Optionally, the contents are hashed as well, to also
+catch files modified without any change to their size and timestamp.
+"""
+
+import argparse
+import collections
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import content_cache
+import dedup_index
+import image_carving
+import image_discovery
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+# Results of checking a file, also used as exit status by the shell script.
+PASSED = 0
+FAILED = 1
+SKIPPED = 2
+
+# Number of files checked by a worker process at a time.  Batching keeps
+# the overhead of passing work between processes low for small files.
+BATCH_SIZE = 64
+
+# Number of batches queued per worker process.
+QUEUED_BATCHES_PER_JOB = 4
+
+CACHE_FILENAME = 'detect_bad_images.sqlite'
+
+# Part of every cache key.  Incremented whenever the checks change, so
+# that verdicts of earlier versions are not used.
+VERDICT_VERSION = 1
+
+# Number of new verdicts written to the cache at a time.
+CACHE_WRITE_SIZE = 1000
+
+
+def _check_jpeg(buf):
+    image_carving.jpeg_end(buf, 0, strict=True)
+
+
+def _check_png(buf):
+    image_carving.png_end(buf, 0, verify_crc=True, strict=True)
+
+
+def _check_webp(buf):
+    image_carving.webp_end(buf, 0)
+
+
+# Functions raising "image_carving.CarvingError" for corrupt images, keyed by
+# image type as returned by "image_discovery.image_type_from_header()".
+CHECKS = {
+    'jpg': _check_jpeg,
+    'png': _check_png,
+    'webp': _check_webp,
+}
+
+
+def _check_image(path):
+    if not os.path.exists(path):
+        return SKIPPED, 'File "{}" does not exist.'.format(path)
+    if not os.path.isfile(path):
+        return SKIPPED, '"{}" is not a file.'.format(path)
+
+    with open(path, 'rb') as fh:
+        header = fh.read(image_discovery.SNIFF_SIZE)
+        check = CHECKS.get(image_discovery.image_type_from_header(header))
+        if check is None:
+            return SKIPPED, 'File "{}" is not an image.'.format(path)
+
+        try:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                check(mm)
+        except image_carving.CarvingError as e:
+            return FAILED, str(e)
+
+    return PASSED, None
+
+
+def check_image(path):
+    """
+    Checks the integrity of an image file.
+
+    :param path: Path to the file.
+    :return: Tuple of the result, one of "PASSED", "FAILED" and "SKIPPED",
+             and a message describing why the file failed or was skipped.
+    """
+    try:
+        return _check_image(path)
+    except (IOError, OSError, ValueError) as e:
+        return FAILED, 'Unable to read file: {!s}'.format(e)
+
+
+def file_digest(path):
+    """Returns the hex content digest of a file."""
+    hasher = dedup_index.new_hasher()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def verify_images(tasks, hash_contents=False):
+    """
+    Checks a batch of image files, unless they have cached verdicts.
+
+    :param tasks: List of tuples of the path, the cache key (None if the
+                  file could not be identified) and the cached verdict
+                  (None if there is none), see "VerdictCache.lookup()".
+    :param hash_contents: Whether to only use cached verdicts of files
+                          whose content digest is unchanged.
+    :return: List of tuples of the path, result, message, whether the
+             result was cached and a tuple of the cache key and verdict to
+             cache, if any.
+    """
+    results = []
+    for path, key, cached in tasks:
+        if cached is not None and not hash_contents:
+            results.append((path, cached['result'], cached['message'], True,
+                            None))
+            continue
+
+        try:
+            digest = file_digest(path) if key and hash_contents else None
+            if cached is not None and cached['digest'] == digest:
+                results.append((path, cached['result'], cached['message'],
+                                True, None))
+                continue
+            result, message = _check_image(path)
+        except (IOError, OSError, ValueError) as e:
+            # Possibly transient, so never cached.
+            results.append((path, FAILED,
+                            'Unable to read file: {!s}'.format(e), False,
+                            None))
+            continue
+
+        verdict = None
+        if key:
+            # Absolute, so that "VerdictCache.compact()" finds the file
+            # from any working directory.
+            verdict = (key, {'path': os.path.abspath(path), 'result': result,
+                             'message': message, 'digest': digest})
+        results.append((path, result, message, False, verdict))
+    return results
+
+
+def verdict_key(st):
+    """Returns the cache key of the file with the given "os.stat()"."""
+    return 'v{}:{}:{}:{}:{}'.format(VERDICT_VERSION, st.st_dev, st.st_ino,
+                                    st.st_size, st.st_mtime_ns)
+
+
+class VerdictCache(object):
+    """
+    Verdicts of earlier runs stored in a "content_cache.ContentCache",
+    keyed by the device, inode, size and modification time of files.
+    """
+    def __init__(self, cache, trust=True):
+        """
+        :param cache: The "content_cache.ContentCache" to use.
+        :param trust: Whether to use cached verdicts.  If False, all files
+                      are checked again and the cache is only updated.
+        """
+        self.cache = cache
+        self.trust = trust
+        self._pending = []
+
+    def lookup(self, paths):
+        """
+        :param paths: List of paths to files.
+        :return: List of tuples of the path, the cache key and the cached
+                 verdict, as passed to "verify_images()".
+        """
+        keys = []
+        for path in paths:
+            try:
+                keys.append(verdict_key(os.stat(path)))
+            except OSError:
+                keys.append(None)
+
+        cached = {}
+        if self.trust:
+            cached = self.cache.get_many([key for key in keys if key])
+
+        tasks = []
+        for path, key in zip(paths, keys):
+            verdict = cached.get(key)
+            if verdict is not None:
+                verdict = json.loads(verdict.decode('utf-8'))
+            tasks.append((path, key, verdict))
+        return tasks
+
+    def store(self, key, verdict):
+        self._pending.append((key, json.dumps(verdict).encode('utf-8')))
+        if len(self._pending) >= CACHE_WRITE_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.cache.put_many(self._pending)
+            self._pending = []
+
+    def compact(self, max_age=None):
+        """
+        Removes the verdicts of files that have since been changed, moved or
+        removed, or of earlier versions of the checks, and verdicts not used
+        within "max_age" seconds.  Then reclaims the disk space.
+
+        :return: Number of removed verdicts.
+        """
+        stale = []
+        for key, value in self.cache.items():
+            try:
+                path = json.loads(value.decode('utf-8'))['path']
+                current_key = verdict_key(os.stat(path))
+            except (OSError, ValueError, KeyError):
+                current_key = None
+            if current_key != key:
+                stale.append(key)
+
+        for i in range(0, len(stale), CACHE_WRITE_SIZE):
+            self.cache.delete_many(stale[i:i + CACHE_WRITE_SIZE])
+        removed = len(stale) + self.cache.evict(max_age)
+        self.cache.vacuum()
+        return removed
+
+
+def batches(iterable, size):
+    """Yields lists of up to "size" consecutive items of "iterable"."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _tasks(paths, verdicts):
+    for batch in batches(paths, BATCH_SIZE):
+        if verdicts is None:
+            yield [(path, None, None) for path in batch]
+        else:
+            yield verdicts.lookup(batch)
+
+
+def run_checks(paths, jobs, verdicts=None, hash_contents=False):
+    """
+    Checks image files in worker processes.
+
+    :param paths: Iterable of paths to files, consumed lazily.
+    :param jobs: Number of worker processes.
+    :param verdicts: Optional "VerdictCache" of earlier verdicts.
+    :param hash_contents: Whether to only use cached verdicts of files
+                          whose content digest is unchanged.
+    :return: Generator of tuples as returned by "verify_images()", in the
+             same order as "paths".
+    """
+    if jobs <= 1:
+        for tasks in _tasks(paths, verdicts):
+            for result in verify_images(tasks, hash_contents):
+                yield result
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        queued = collections.deque()
+        for tasks in _tasks(paths, verdicts):
+            if not hash_contents and all(t[2] is not None for t in tasks):
+                # Nothing to check; no need to involve a worker.
+                future = Future()
+                future.set_result(verify_images(tasks))
+            else:
+                future = executor.submit(verify_images, tasks, hash_contents)
+            queued.append(future)
+
+            if len(queued) >= jobs * QUEUED_BATCHES_PER_JOB:
+                for result in queued.popleft().result():
+                    yield result
+        while queued:
+            for result in queued.popleft().result():
+                yield result
+
+
+class Reporter(object):
+    """Prints messages like the shell script did, colored on terminals."""
+    COLORS = {
+        'error': '\033[31m',
+        'info': '\033[32m',
+        'warn': '\033[33m',
+    }
+    LABELS = {
+        'error': 'ERROR',
+        'info': '+',
+        'warn': '!',
+    }
+
+    def __init__(self, brief=False, color=None):
+        self.brief = brief
+        self.color = sys.stdout.isatty() if color is None else color
+
+    def _label(self, msg_type):
+        label = self.LABELS[msg_type]
+        if self.color:
+            return '[{}{}\033[0m]'.format(self.COLORS[msg_type], label)
+        return '[{}]'.format(label)
+
+    def msg(self, msg_type, text):
+        if not self.brief:
+            print('{}  {}'.format(self._label(msg_type), text))
+
+
+def print_summary(counts, elapsed):
+    """Prints the test summary, kept below 60 columns."""
+    rate = counts['total'] / elapsed if elapsed > 0 else 0.0
+    rows = [
+        ('Total number of files', counts['total']),
+        ('Cached verdicts', counts['cached']),
+        ('Total number of IMAGES', counts['images']),
+        ('[PASSED]', counts['passed']),
+        ('[FAILED]', counts['failed']),
+        ('Files per second', '{:.1f}'.format(rate)),
+    ]
+    print('')
+    print('-' * 52)
+    print('TEST RUN RESULTS SUMMARY:')
+    for name, value in rows:
+        print('{:>22.22s} : {!s:35.35s}'.format(name, value).rstrip())
+
+
+def main(paths, brief=False, delete=False, stats=False, jobs=1,
+         verdicts=None, hash_contents=False):
+    """
+    Checks the integrity of image files.
+
+    :param paths: Iterable of paths to files.
+    :param brief: Only print the paths of corrupt files.
+    :param delete: Delete files that fail the tests.
+    :param stats: Print the test summary, unless "brief" is True.
+    :param jobs: Number of worker processes.
+    :param verdicts: Optional "VerdictCache" of earlier verdicts, updated
+                     with the new ones.
+    :param hash_contents: Whether to only use cached verdicts of files
+                          whose content digest is unchanged.
+    :return: 0 if no image failed the tests, otherwise 1.
+    """
+    reporter = Reporter(brief)
+    counts = collections.Counter()
+    started = time.perf_counter()
+
+    try:
+        for result in run_checks(paths, jobs, verdicts, hash_contents):
+            _report_result(reporter, counts, delete, verdicts, *result)
+    finally:
+        if verdicts is not None:
+            verdicts.flush()
+
+    if stats and not brief:
+        print_summary(counts, time.perf_counter() - started)
+
+    return 1 if counts['failed'] else 0
+
+
+def _report_result(reporter, counts, delete, verdicts, path, result, message,
+                   cached, verdict):
+    counts['total'] += 1
+    if cached:
+        counts['cached'] += 1
+    if verdict is not None and verdicts is not None:
+        verdicts.store(*verdict)
+
+    if result == SKIPPED:
+        reporter.msg('warn', message)
+        return
+
+    counts['images'] += 1
+    if result == PASSED:
+        counts['passed'] += 1
+        reporter.msg('info', 'Image "{}" passed the tests.'.format(path))
+        return
+
+    counts['failed'] += 1
+    reporter.msg('error', 'Image "{}" failed the tests! {}'.format(
+        path, message))
+    if reporter.brief:
+        print(path)
+    sys.stdout.flush()
+
+    if delete:
+        reporter.msg('info', 'Deleting "{}" ..'.format(path))
+        try:
+            os.remove(path)
+        except OSError as e:
+            print('{}: {!s}'.format(PROGRAM_NAME, e), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Detects corrupt images from reading their contents. '
+                    'Good for sifting through data produced by data recovery '
+                    'or forensics. Reads the file type from magic header '
+                    'bytes, file extensions do not matter.',
+        epilog='Exits with status 1 if any image failed the tests.'
+    )
+    parser.add_argument(
+        dest='files', nargs='*', metavar='FILE',
+        help='Files to check.  Directories are searched with "--recursive".'
+    )
+    parser.add_argument(
+        '-b', '--brief',
+        dest='brief', action='store_true', default=False,
+        help='Print corrupt files only (less verbose).'
+    )
+    parser.add_argument(
+        '-d', '--delete',
+        dest='delete', action='store_true', default=False,
+        help='Delete files that fail the tests (USE WITH CAUTION).'
+    )
+    parser.add_argument(
+        '-s', '--stats',
+        dest='stats', action='store_true', default=False,
+        help='Print test summary/statistics.'
+    )
+    parser.add_argument(
+        '-r', '--recursive',
+        dest='recursive', action='store_true', default=False,
+        help='Check all files in directories, recursively.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+        help='Number of worker processes.  Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--cache',
+        dest='cache_path', default=None, metavar='PATH',
+        help='Path to the verdict cache database.  Defaults to '
+             '"~/.cache/image-utils/{}".'.format(CACHE_FILENAME)
+    )
+    parser.add_argument(
+        '--no-cache',
+        dest='use_cache', action='store_false', default=True,
+        help='Neither use nor update the verdict cache.'
+    )
+    trust_group = parser.add_mutually_exclusive_group()
+    trust_group.add_argument(
+        '--trust-cache',
+        dest='trust_cache', action='store_true', default=True,
+        help='Do not check files again whose cached verdicts are still '
+             'valid.  This is the default.'
+    )
+    trust_group.add_argument(
+        '--recheck',
+        dest='trust_cache', action='store_false',
+        help='Check all files again, updating the cached verdicts.'
+    )
+    parser.add_argument(
+        '--hash',
+        dest='hash_contents', action='store_true', default=False,
+        help='Also hash the contents of files and only use cached verdicts '
+             'if unchanged.  Catches files modified without any change to '
+             'their size and modification time, at the cost of reading '
+             'every file.'
+    )
+    parser.add_argument(
+        '--compact-cache',
+        dest='compact_cache', action='store_true', default=False,
+        help='Remove cached verdicts of files that have since been changed, '
+             'moved or removed, and shrink the cache database.  Runs before '
+             'checking any given files.'
+    )
+    parser.add_argument(
+        '--cache-max-age',
+        dest='cache_max_age_days', type=float, default=None, metavar='DAYS',
+        help='With "--compact-cache", also remove verdicts not used within '
+             'the last DAYS days.'
+    )
+    args = parser.parse_args()
+
+    if not args.files and not args.compact_cache:
+        print('[!]  No arguments provided.')
+        print('[!]  For help run: "{} -h"'.format(PROGRAM_NAME))
+        sys.exit(1)
+
+    verdicts = None
+    if args.use_cache:
+        verdicts = VerdictCache(
+            content_cache.ContentCache(
+                args.cache_path or
+                content_cache.default_cache_path(CACHE_FILENAME)),
+            args.trust_cache
+        )
+    elif args.compact_cache:
+        parser.error('"--compact-cache" cannot be used with "--no-cache"')
+
+    paths = args.files
+    if args.recursive:
+        paths = image_discovery.walk_files(args.files)
+
+    try:
+        if args.compact_cache:
+            max_age = None
+            if args.cache_max_age_days is not None:
+                max_age = args.cache_max_age_days * 24 * 3600
+            removed = verdicts.compact(max_age)
+            if not args.brief:
+                print('Removed {} cached verdicts, {} remaining'.format(
+                    removed, verdicts.cache.stats()['entries']))
+
+        exit_status = 0
+        if args.files:
+            exit_status = main(paths, args.brief, args.delete, args.stats,
+                               max(1, args.jobs), verdicts, args.hash_contents)
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
+    finally:
+        if verdicts is not None:
+            verdicts.cache.close()
+
+    sys.exit(exit_status)
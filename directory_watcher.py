@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# directory_watcher.py
+# ====================
+# Watches directories for new and changed files, reporting each file once
+# it has been completely written.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Directory watching.
+
+On Linux, directories are watched with inotify, called through "ctypes".
+Files are reported when closed after writing ("IN_CLOSE_WRITE") or moved
+into a watched directory ("IN_MOVED_TO"), which is how most sync clients,
+Dropbox included, put finished downloads in place.  Elsewhere, or when
+asked to, directories are polled instead, and files are reported when
+their size or modification time changes.
+
+Either way, the reported files are passed through a "Debouncer", which
+holds on to each file until it has not changed for a while, so that files
+still being written are not picked up early.
+
+Only changes after the watch started are reported.  Existing files are
+not scanned, unless the kernel event queue overflows.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+# Number of seconds a file must go unchanged before it is reported.
+DEFAULT_SETTLE_TIME = 2.0
+
+# Number of seconds between scans of the polling watcher.
+DEFAULT_POLL_INTERVAL = 1.0
+
+# inotify flags, from "<sys/inotify.h>".
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Size of the buffer events are read into.  Holds at least a few hundred
+# events, as each one is 16 bytes plus the file name.
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+class WatchError(Exception):
+    """A directory could not be watched."""
+
+
+def _is_hidden(name):
+    # Temporary files of sync clients, and those of our own atomic writes.
+    return name.startswith('.')
+
+
+def _scan(directory, recursive):
+    """Yields tuples of the paths and "os.stat()" of files in a directory."""
+    stack = [directory]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if _is_hidden(entry.name):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher(object):
+    """Watches directories with Linux inotify."""
+    def __init__(self, directories, recursive=False):
+        """
+        :param directories: Paths to the directories to watch.
+        :param recursive: Whether to watch all sub-directories as well,
+                          including those created later.
+        :raises WatchError: inotify is not available, or a directory
+                            could not be watched.
+        """
+        self.libc = _load_libc()
+        if self.libc is None:
+            raise WatchError('inotify is not available on this system')
+
+        self.recursive = recursive
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError(os.strerror(ctypes.get_errno()))
+
+        self.watches = {}
+        self.overflowed = False
+        self._pending = []
+        self._last_event = time.time()
+        try:
+            for directory in directories:
+                self._add_watch(directory)
+                if recursive:
+                    for root, dirnames, _ in os.walk(directory):
+                        dirnames[:] = [d for d in dirnames
+                                       if not _is_hidden(d)]
+                        for dirname in dirnames:
+                            self._add_watch(os.path.join(root, dirname))
+        except WatchError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                         WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchError(
+                    'Too many watches, raise fs.inotify.max_user_watches')
+            raise WatchError('Unable to watch "{}": {}'.format(
+                directory, os.strerror(error)))
+        self.watches[wd] = directory
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped.  Fall back to a scan of files changed
+            # since the last event we did see.
+            self.overflowed = True
+            since = self._last_event - 1
+            for directory in set(self.watches.values()):
+                for path, st in _scan(directory, False):
+                    if st.st_mtime >= since:
+                        self._pending.append(path)
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None or not name or _is_hidden(name):
+            return
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._add_watch(path)
+                except WatchError:
+                    return
+                # Files may have been put there before the watch was added.
+                self._pending.extend(p for p, _ in _scan(path, True))
+            return
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MODIFY):
+            self._pending.append(path)
+
+    def read(self, timeout=None):
+        """
+        Waits for files to be written.
+
+        :param timeout: Maximum number of seconds to wait, or None to wait
+                        until anything happens.
+        :return: List of paths to files written since the last call, in
+                 the order of the events, possibly with duplicates.
+        """
+        if not self._pending:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            while readable:
+                try:
+                    data = os.read(self.fd, EVENT_BUFFER_SIZE)
+                except BlockingIOError:
+                    break
+                self._last_event = time.time()
+                pos = 0
+                while pos + EVENT_HEADER.size <= len(data):
+                    wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                    pos += EVENT_HEADER.size
+                    name = data[pos:pos + length].split(b'\x00', 1)[0]
+                    pos += length
+                    self._handle_event(wd, mask, os.fsdecode(name))
+
+        paths, self._pending = self._pending, []
+        return paths
+
+
+class PollingWatcher(object):
+    """Watches directories by scanning them at regular intervals."""
+    def __init__(self, directories, recursive=False,
+                 interval=DEFAULT_POLL_INTERVAL):
+        """
+        :param directories: Paths to the directories to watch.
+        :param recursive: Whether to watch all sub-directories as well.
+        :param interval: Number of seconds between scans.
+        :raises WatchError: A directory does not exist.
+        """
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise WatchError('Not a directory: "{}"'.format(directory))
+        self.directories = list(directories)
+        self.recursive = recursive
+        self.interval = interval
+        self.overflowed = False
+        self._snapshot = self._take_snapshot()
+        self._next_scan = time.monotonic() + interval
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for directory in self.directories:
+            for path, st in _scan(directory, self.recursive):
+                snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def fileno(self):
+        return None
+
+    def close(self):
+        pass
+
+    def read(self, timeout=None):
+        """
+        Waits for the next scan, unless "timeout" seconds pass first.
+
+        :return: List of paths to files new or changed since the last scan.
+        """
+        delay = self._next_scan - time.monotonic()
+        if timeout is not None and delay > timeout:
+            time.sleep(max(0, timeout))
+            return []
+        if delay > 0:
+            time.sleep(delay)
+
+        snapshot = self._take_snapshot()
+        changed = [path for path, state in snapshot.items()
+                   if self._snapshot.get(path) != state]
+        self._snapshot = snapshot
+        self._next_scan = time.monotonic() + self.interval
+        return changed
+
+
+def open_watcher(directories, recursive=False, poll_interval=None):
+    """
+    Watches directories with inotify, if available, otherwise by polling.
+
+    :param poll_interval: Number of seconds between scans when polling.
+                          If given, directories are always polled.
+    :raises WatchError: A directory could not be watched.
+    """
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(directories, recursive)
+        except WatchError:
+            if _load_libc() is not None:
+                raise
+        poll_interval = DEFAULT_POLL_INTERVAL
+    return PollingWatcher(directories, recursive, poll_interval)
+
+
+class Debouncer(object):
+    """
+    Holds on to changed files until they have been left alone for a while.
+    """
+    def __init__(self, settle_time=DEFAULT_SETTLE_TIME, clock=time.monotonic):
+        """
+        :param settle_time: Number of seconds a file must go unchanged.
+        :param clock: Function returning the current time in seconds.
+        """
+        self.settle_time = settle_time
+        self.clock = clock
+        # Tuples of the deadline and the time first seen, keyed by path,
+        # in the order the files were first seen.
+        self._files = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def touch(self, path):
+        """Registers a change to a file, postponing its deadline."""
+        now = self.clock()
+        first_seen = self._files.pop(path, (None, now))[1]
+        self._files[path] = (now + self.settle_time, first_seen)
+
+    def timeout(self):
+        """
+        :return: Number of seconds until the next file settles, or None if
+                 there are no files.
+        """
+        if not self._files:
+            return None
+        return max(0.0, min(d for d, _ in self._files.values()) - self.clock())
+
+    def pop_ready(self, limit=None):
+        """
+        Removes the files that have settled.
+
+        :param limit: Maximum number of files to remove.
+        :return: List of tuples of the path and the time the file was
+                 first seen, oldest first.
+        """
+        now = self.clock()
+        ready = []
+        for path, (deadline, first_seen) in self._files.items():
+            if limit is not None and len(ready) >= limit:
+                break
+            if deadline <= now:
+                ready.append((path, first_seen))
+        for path, _ in ready:
+            del self._files[path]
+        return ready
+
+
+def watch_files(directories, recursive=False, settle_time=DEFAULT_SETTLE_TIME,
+                poll_interval=None):
+    """
+    Yields paths to files as they are written to the directories, once they
+    have been left alone for "settle_time" seconds.  Runs forever.
+    """
+    watcher = open_watcher(directories, recursive, poll_interval)
+    debouncer = Debouncer(settle_time)
+    try:
+        while True:
+            for path in watcher.read(debouncer.timeout()):
+                debouncer.touch(path)
+            for path, _ in debouncer.pop_ready():
+                if os.path.isfile(path):
+                    yield path
+    finally:
+        watcher.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Prints the paths of files as they are written to the '
+                    'given directories, once they have been left alone for '
+                    'a while.  Runs until interrupted.'
+    )
+    parser.add_argument(
+        dest='directories', nargs='+', metavar='DIRECTORY',
+        help='Directories to watch.'
+    )
+    parser.add_argument(
+        '-r', '--recursive',
+        dest='recursive', action='store_true', default=False,
+        help='Also watch all sub-directories.'
+    )
+    parser.add_argument(
+        '--settle',
+        dest='settle_time', type=float, default=DEFAULT_SETTLE_TIME,
+        metavar='SECONDS',
+        help='Number of seconds a file must go unchanged before it is '
+             'printed.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--poll',
+        dest='poll_interval', type=float, default=None, metavar='SECONDS',
+        help='Scan the directories every SECONDS seconds instead of using '
+             'inotify.'
+    )
+    parser.add_argument(
+        '-0', '--null',
+        dest='null', action='store_true', default=False,
+        help='Separate paths with NUL characters, for "xargs -0".'
+    )
+    args = parser.parse_args()
+
+    terminator = '\0' if args.null else '\n'
+    try:
+        for path in watch_files(args.directories, args.recursive,
+                                args.settle_time, args.poll_interval):
+            sys.stdout.write(path + terminator)
+            sys.stdout.flush()
+    except WatchError as e:
+        sys.exit('{}: {!s}'.format(PROGRAM_NAME, e))
+    except KeyboardInterrupt:
+        sys.exit(0)
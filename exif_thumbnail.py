@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# exif_thumbnail.py
+# =================
+# Locates EXIF thumbnails in JPEG files by parsing the EXIF (TIFF) header,
+# without decoding the image or reading more of the file than necessary.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Minimal EXIF parser.
+
+The EXIF data of a JPEG is stored in an APP1 segment near the start of the
+file, which in turn holds a TIFF structure of image file directories
+(IFDs).  IFD0 describes the main image and IFD1 the embedded thumbnail,
+whose location is given by the "JPEGInterchangeFormat" and
+"JPEGInterchangeFormatLength" tags.
+"""
+
+import struct
+
+# The APP1 segment is at most 64 KiB, usually preceded by a small APP0.
+HEADER_READ_SIZE = 64 * 1024 + 1024
+
+TAG_JPEG_INTERCHANGE_FORMAT = 0x0201
+TAG_JPEG_INTERCHANGE_FORMAT_LENGTH = 0x0202
+
+# Sizes in bytes of the TIFF field types.
+TIFF_TYPE_SIZES = {
+    1: 1,   # BYTE
+    2: 1,   # ASCII
+    3: 2,   # SHORT
+    4: 4,   # LONG
+    5: 8,   # RATIONAL
+    6: 1,   # SBYTE
+    7: 1,   # UNDEFINED
+    8: 2,   # SSHORT
+    9: 4,   # SLONG
+    10: 8,  # SRATIONAL
+}
+
+
+class ExifError(Exception):
+    """The EXIF data is missing or malformed."""
+
+
+def find_exif_tiff_header(data):
+    """
+    Finds the TIFF header within the EXIF APP1 segment of a JPEG.
+
+    :param data: The start of a JPEG file.
+    :return: Tuple of the offsets of the TIFF header and the end of the
+             APP1 segment, or None if there is no EXIF segment.
+    :raises ExifError: The data is not a JPEG.
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ExifError('Not a JPEG file')
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xff:
+            raise ExifError('Expected marker at offset {}'.format(pos))
+        marker = data[pos + 1]
+        if marker == 0xff:
+            pos += 1
+            continue
+        if marker in (0xd9, 0xda):
+            # No EXIF segment before the image data.
+            return None
+
+        length, = struct.unpack_from('>H', data, pos + 2)
+        if marker == 0xe1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            return pos + 10, pos + 2 + length
+        pos += 2 + length
+
+    return None
+
+
+class TiffReader(object):
+    """Reads image file directories from a TIFF structure."""
+    def __init__(self, data, start):
+        """
+        :param data: Buffer holding the TIFF structure.
+        :param start: Offset of the TIFF header within "data".
+        """
+        self.data = data
+        self.start = start
+
+        byte_order = data[start:start + 2]
+        if byte_order == b'II':
+            self.byte_order = '<'
+        elif byte_order == b'MM':
+            self.byte_order = '>'
+        else:
+            raise ExifError('Invalid TIFF byte order')
+
+        magic, self.first_ifd_offset = self._unpack('HI', 2)
+        if magic != 42:
+            raise ExifError('Invalid TIFF header')
+
+    def _unpack(self, fmt, offset):
+        """Unpacks values at an offset relative to the TIFF header."""
+        fmt = self.byte_order + fmt
+        offset += self.start
+        if offset < self.start or \
+                offset + struct.calcsize(fmt) > len(self.data):
+            raise ExifError('Offset {} out of bounds'.format(offset))
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def read_ifd(self, offset):
+        """
+        Reads the image file directory at "offset".
+
+        :return: Tuple of a dict mapping tags to tuples of (type, count,
+                 offset of the value) and the offset of the next IFD.
+        """
+        count, = self._unpack('H', offset)
+        entries = {}
+        for i in range(count):
+            entry_offset = offset + 2 + i * 12
+            tag, value_type, value_count = self._unpack('HHI', entry_offset)
+            size = TIFF_TYPE_SIZES.get(value_type, 1) * value_count
+            if size <= 4:
+                value_offset = entry_offset + 8
+            else:
+                value_offset, = self._unpack('I', entry_offset + 8)
+            entries[tag] = (value_type, value_count, value_offset)
+
+        next_offset, = self._unpack('I', offset + 2 + count * 12)
+        return entries, next_offset
+
+    def value(self, entry):
+        """
+        Returns the value of an IFD entry as returned by "read_ifd()".
+        Integers are returned for single BYTE, SHORT and LONG values and
+        strings for ASCII values.
+        """
+        value_type, count, offset = entry
+        if value_type == 2:
+            raw = self._unpack('{}s'.format(count), offset)[0]
+            return raw.split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+        if value_type in (1, 3, 4) and count >= 1:
+            fmt = {1: 'B', 3: 'H', 4: 'I'}[value_type]
+            return self._unpack(fmt, offset)[0]
+        raise ExifError('Unsupported value type {}'.format(value_type))
+
+
+def find_exif_thumbnail(data):
+    """
+    Locates the EXIF thumbnail of a JPEG.
+
+    :param data: The start of a JPEG file, at least up to the end of the
+                 EXIF segment; "HEADER_READ_SIZE" bytes is enough.
+    :return: Tuple of the offset and length of the thumbnail within the
+             file, or None if the file has no EXIF thumbnail.
+    :raises ExifError: The EXIF data is malformed.
+    """
+    location = find_exif_tiff_header(data)
+    if location is None:
+        return None
+
+    tiff_start, segment_end = location
+    tiff = TiffReader(data, tiff_start)
+    _, ifd1_offset = tiff.read_ifd(tiff.first_ifd_offset)
+    if not ifd1_offset:
+        return None
+
+    ifd1, _ = tiff.read_ifd(ifd1_offset)
+    if TAG_JPEG_INTERCHANGE_FORMAT not in ifd1 or \
+            TAG_JPEG_INTERCHANGE_FORMAT_LENGTH not in ifd1:
+        return None
+
+    offset = tiff_start + tiff.value(ifd1[TAG_JPEG_INTERCHANGE_FORMAT])
+    length = tiff.value(ifd1[TAG_JPEG_INTERCHANGE_FORMAT_LENGTH])
+    if not length or offset + length > segment_end:
+        raise ExifError('Thumbnail extends past the EXIF segment')
+    return offset, length
+
+
+def read_exif_thumbnail(path):
+    """
+    Reads the EXIF thumbnail of a JPEG file.  Only the start of the file
+    is read.
+
+    :param path: Path to the JPEG file.
+    :return: The thumbnail JPEG data, or None if the file has none.
+    :raises ExifError: The file is not a JPEG or has malformed EXIF data.
+    """
+    with open(path, 'rb') as fh:
+        header = fh.read(HEADER_READ_SIZE)
+
+    location = find_exif_thumbnail(header)
+    if location is None:
+        return None
+
+    offset, length = location
+    return header[offset:offset + length]
+
+
+def jpeg_dimensions(data):
+    """
+    Gets the dimensions of a JPEG from its start-of-frame segment.
+
+    :param data: The JPEG data, at least up to the start-of-frame segment.
+    :return: Tuple of the width and height, or None if not found.
+    """
+    if data[:2] != b'\xff\xd8':
+        return None
+
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xff:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xff:
+            pos += 1
+            continue
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack_from('>HH', data, pos + 5)
+            return width, height
+        if marker in (0xd9, 0xda):
+            return None
+
+        length, = struct.unpack_from('>H', data, pos + 2)
+        pos += 2 + length
+
+    return None
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# exiftool_pool.py
+# ================
+# Pool of long-lived exiftool processes, avoiding the Perl startup cost of
+# running exiftool once per file.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Persistent exiftool workers.
+
+Every worker is an "exiftool -stay_open True -@ -" process, which reads
+the arguments of each command from standard input, one per line, and
+runs the command once it reads "-execute".  The output of a command ends
+with a "{readyN}" line on standard output and, thanks to "-echo4", on
+standard error.
+
+Files are read in batches, several per command, spread over the workers
+of a pool.  Workers that die or hang are restarted.
+
+The command-line interface makes the pool available to shell scripts:
+
+    exiftool_pool.py get -t Model --null -- FILE...
+    exiftool_pool.py copy-tags SOURCE DEST [SOURCE DEST...]
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import queue
+import selectors
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+EXIFTOOL = 'exiftool'
+
+DEFAULT_POOL_SIZE = os.cpu_count() or 1
+
+# Number of files read by a single exiftool command.
+DEFAULT_BATCH_SIZE = 32
+
+# Number of batches queued per worker.
+QUEUED_BATCHES_PER_WORKER = 2
+
+# Seconds to wait for a worker to exit when closing the pool.
+CLOSE_TIMEOUT = 5
+
+
+class ExiftoolError(Exception):
+    """An exiftool command could not be run."""
+
+
+class ExiftoolStartError(ExiftoolError):
+    """The exiftool executable could not be started, E.G. it is missing."""
+
+
+class ExiftoolWorkerDied(ExiftoolError):
+    """The exiftool process exited or hung while running a command."""
+
+
+class ExiftoolWorker(object):
+    """A single "exiftool -stay_open" process, started on first use."""
+    def __init__(self, executable=EXIFTOOL, common_args=None):
+        """
+        :param executable: Name of or path to the exiftool executable.
+        :param common_args: Arguments added to every command.
+        """
+        self.executable = executable
+        self.common_args = list(common_args or [])
+        self._process = None
+        self._count = 0
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        args = [self.executable, '-stay_open', 'True', '-@', '-']
+        if self.common_args:
+            args += ['-common_args'] + self.common_args
+        try:
+            self._process = subprocess.Popen(
+                args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            raise ExiftoolStartError('Unable to start "{}": {!s}'.format(
+                self.executable, e))
+
+    def kill(self):
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        for stream in (self._process.stdin, self._process.stdout,
+                       self._process.stderr):
+            stream.close()
+        self._process = None
+
+    def close(self):
+        """Asks the process to exit, killing it if it does not."""
+        if not self.alive:
+            self.kill()
+            return
+        try:
+            self._process.stdin.write(b'-stay_open\nFalse\n')
+            self._process.stdin.flush()
+            self._process.wait(CLOSE_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+    def execute(self, args, timeout=None):
+        """
+        Runs a single exiftool command.
+
+        :param args: List of command-line arguments, as strings.
+        :param timeout: Seconds to wait for the command to finish, or None.
+        :return: Tuple of the standard output and error of the command,
+                 as bytes.
+        :raises ExiftoolWorkerDied: The process exited or the command timed
+                                    out.  The process is killed either way.
+        """
+        if not self.alive:
+            self.kill()
+            self.start()
+
+        self._count += 1
+        marker = '{{ready{}}}'.format(self._count).encode('ascii')
+        lines = [os.fsencode(arg) for arg in args]
+        if any(b'\n' in line for line in lines):
+            raise ValueError('exiftool arguments must not contain newlines')
+        lines += [b'-echo4', marker, b'-execute' + marker[6:-1]]
+
+        try:
+            self._process.stdin.write(b'\n'.join(lines) + b'\n')
+            self._process.stdin.flush()
+            return self._read_output(marker + b'\n', timeout)
+        except (OSError, ExiftoolWorkerDied) as e:
+            self.kill()
+            if isinstance(e, ExiftoolWorkerDied):
+                raise
+            raise ExiftoolWorkerDied('exiftool exited: {!s}'.format(e))
+
+    def _read_output(self, marker, timeout):
+        outputs = {
+            self._process.stdout.fileno(): bytearray(),
+            self._process.stderr.fileno(): bytearray(),
+        }
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with selectors.DefaultSelector() as selector:
+            for fd in outputs:
+                selector.register(fd, selectors.EVENT_READ)
+
+            while selector.get_map():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise ExiftoolWorkerDied('exiftool timed out')
+
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fd, 65536)
+                    if not data:
+                        raise ExiftoolWorkerDied(
+                            'exiftool exited with status {}'.format(
+                                self._process.wait()))
+                    output = outputs[key.fd]
+                    output += data
+                    if output.endswith(marker):
+                        selector.unregister(key.fd)
+
+        stdout = bytes(outputs[self._process.stdout.fileno()])
+        stderr = bytes(outputs[self._process.stderr.fileno()])
+        return stdout[:-len(marker)], stderr[:-len(marker)]
+
+
+class ExiftoolPool(object):
+    """
+    Runs exiftool commands on a pool of "ExiftoolWorker".  Safe to use
+    from several threads at once; each command gets a worker of its own.
+    """
+    def __init__(self, size=DEFAULT_POOL_SIZE, executable=EXIFTOOL,
+                 common_args=None, timeout=None):
+        """
+        :param size: Number of exiftool processes.
+        :param executable: Name of or path to the exiftool executable.
+        :param common_args: Arguments added to every command.
+        :param timeout: Seconds to wait for a command before the worker is
+                        restarted, or None to wait forever.
+        """
+        self.size = size
+        self.timeout = timeout
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(ExiftoolWorker(executable, common_args))
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _count(self, **values):
+        with self._stats_lock:
+            self.stats.update(values)
+
+    @contextlib.contextmanager
+    def _worker(self):
+        worker = self._idle.get()
+        try:
+            yield worker
+        finally:
+            self._idle.put(worker)
+
+    def execute(self, *args):
+        """
+        Runs an exiftool command, restarting the worker and trying again
+        once if the worker dies.
+
+        :return: Tuple of the standard output and error, as bytes.
+        :raises ExiftoolError: The command could not be run.
+        """
+        with self._worker() as worker:
+            try:
+                result = worker.execute(args, self.timeout)
+            except ExiftoolWorkerDied:
+                self._count(restarts=1)
+                result = worker.execute(args, self.timeout)
+        self._count(commands=1)
+        return result
+
+    def execute_json(self, *args):
+        """
+        Runs an exiftool command with JSON output ("-j").
+
+        :return: List of dicts, one per file successfully read.
+        """
+        stdout, _ = self.execute('-j', *args)
+        if not stdout.strip():
+            return []
+        try:
+            return json.loads(stdout.decode('utf-8', 'replace'))
+        except ValueError as e:
+            raise ExiftoolError('Invalid JSON output: {!s}'.format(e))
+
+    def _read_batch(self, paths, tag_args):
+        try:
+            records = self.execute_json(*(tag_args + ['--'] + paths))
+        except ExiftoolStartError:
+            # Not a problem with the files, so no file could be read.
+            raise
+        except (ExiftoolError, ValueError):
+            if len(paths) == 1:
+                return [None]
+            # Find the file the workers choke on by reading one at a time.
+            return [self._read_batch([path], tag_args)[0] for path in paths]
+
+        by_path = {record.get('SourceFile'): record for record in records}
+        self._count(files=len(paths))
+        return [by_path.get(path) for path in paths]
+
+    def read_metadata(self, paths, tags=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Reads metadata of files, in batches spread over the workers.
+
+        :param paths: Iterable of paths to files, consumed lazily.
+        :param tags: Names of the tags to read, like "Model", or None to
+                     read all tags.
+        :param batch_size: Number of files read by each exiftool command.
+        :return: Generator of tuples of the path and a dict of the tags
+                 read, or None if exiftool could not read the file.  In the
+                 same order as "paths".
+        :raises ExiftoolStartError: exiftool could not be started.
+        """
+        tag_args = ['-' + tag for tag in tags or []]
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            queued = collections.deque()
+            batch = []
+
+            def _submit():
+                queued.append((batch, executor.submit(self._read_batch,
+                                                      batch, tag_args)))
+
+            for path in paths:
+                batch.append(path)
+                if len(batch) >= batch_size:
+                    _submit()
+                    batch = []
+                if len(queued) >= self.size * QUEUED_BATCHES_PER_WORKER:
+                    done_batch, future = queued.popleft()
+                    for item in zip(done_batch, future.result()):
+                        yield item
+            if batch:
+                _submit()
+
+            while queued:
+                done_batch, future = queued.popleft()
+                for item in zip(done_batch, future.result()):
+                    yield item
+
+    def copy_tags(self, source, dest, *args):
+        """
+        Copies the tags of one file to another, like
+        "exiftool -tagsfromfile SOURCE DEST".
+
+        :param args: Additional exiftool arguments.
+        :return: Tuple of whether the tags were copied and any error
+                 messages printed by exiftool.
+        """
+        stdout, stderr = self.execute('-tagsfromfile', source, *(
+            list(args) + ['--', dest]))
+        errors = stderr.decode('utf-8', 'replace').strip()
+        failed = any(line.startswith('Error') for line in errors.splitlines())
+        return not failed, errors
+
+
+def _format_value(value):
+    if isinstance(value, list):
+        return ', '.join(str(v) for v in value)
+    return str(value)
+
+
+def _get(pool, args):
+    exit_status = 0
+    records = []
+    for path, record in pool.read_metadata(args.files, args.tags,
+                                           args.batch_size):
+        if record is None:
+            print('{}: Unable to read "{}"'.format(PROGRAM_NAME, path),
+                  file=sys.stderr)
+            exit_status = 1
+            continue
+
+        if args.null:
+            values = [path] + [_format_value(record.get(tag, ''))
+                               for tag in args.tags]
+            sys.stdout.write(''.join(v + '\0' for v in values))
+        else:
+            records.append(record)
+
+    if not args.null:
+        print(json.dumps(records, indent=4, ensure_ascii=False))
+    return exit_status
+
+
+def _copy_tags(pool, args):
+    paths = args.paths
+    if args.stdin:
+        paths = [p for p in sys.stdin.read().split('\0') if p]
+    if len(paths) % 2:
+        print('{}: Expected pairs of SOURCE and DEST paths'.format(
+            PROGRAM_NAME), file=sys.stderr)
+        return 2
+
+    exit_status = 0
+    pairs = list(zip(paths[::2], paths[1::2]))
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        results = executor.map(lambda pair: pool.copy_tags(*pair), pairs)
+        for (source, dest), (copied, errors) in zip(pairs, results):
+            if errors and not args.quiet:
+                print(errors, file=sys.stderr)
+            if not copied:
+                print('{}: Failed to copy tags from "{}" to "{}"'.format(
+                    PROGRAM_NAME, source, dest), file=sys.stderr)
+                exit_status = 1
+    return exit_status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Runs exiftool commands on a pool of long-lived exiftool '
+                    'processes.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=DEFAULT_POOL_SIZE, metavar='N',
+        help='Number of exiftool processes.  Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--exiftool',
+        dest='executable', default=EXIFTOOL, metavar='PATH',
+        help='The exiftool executable.  Defaults to "%(default)s".'
+    )
+    parser.add_argument(
+        '--timeout',
+        dest='timeout', type=float, default=None, metavar='SECONDS',
+        help='Restart exiftool processes whose command takes longer.'
+    )
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    get_parser = subparsers.add_parser(
+        'get', help='Read tags of files.',
+        description='Reads tags of files and prints them as JSON, like '
+                    '"exiftool -j".'
+    )
+    get_parser.add_argument(
+        '-t', '--tag',
+        dest='tags', action='append', default=[], metavar='TAG',
+        help='Tag to read, like "Model".  May be given several times.  '
+             'Defaults to all tags.'
+    )
+    get_parser.add_argument(
+        '-0', '--null',
+        dest='null', action='store_true', default=False,
+        help='Instead of JSON, print the path and the value of every tag '
+             'given with "--tag", each followed by a NUL character.  Files '
+             'that could not be read are left out.'
+    )
+    get_parser.add_argument(
+        '-b', '--batch-size',
+        dest='batch_size', type=int, default=DEFAULT_BATCH_SIZE, metavar='N',
+        help='Number of files read by each exiftool command.  '
+             'Defaults to %(default)s.'
+    )
+    get_parser.add_argument(
+        dest='files', nargs='+', metavar='FILE',
+        help='Files to read.'
+    )
+    get_parser.set_defaults(func=_get)
+
+    copy_parser = subparsers.add_parser(
+        'copy-tags', help='Copy tags between files.',
+        description='Copies all tags from each SOURCE to the following DEST, '
+                    'like "exiftool -tagsfromfile SOURCE DEST".'
+    )
+    copy_parser.add_argument(
+        '--stdin',
+        dest='stdin', action='store_true', default=False,
+        help='Read NUL-separated SOURCE and DEST paths from standard input.'
+    )
+    copy_parser.add_argument(
+        '-q', '--quiet',
+        dest='quiet', action='store_true', default=False,
+        help='Do not print warnings from exiftool.'
+    )
+    copy_parser.add_argument(
+        dest='paths', nargs='*', metavar='SOURCE DEST',
+        help='Pairs of source and destination paths.'
+    )
+    copy_parser.set_defaults(func=_copy_tags)
+
+    args = parser.parse_args()
+
+    if args.command == 'get' and args.null and not args.tags:
+        parser.error('"--null" requires at least one "--tag"')
+
+    try:
+        with ExiftoolPool(max(1, args.jobs), args.executable,
+                          timeout=args.timeout) as pool:
+            sys.exit(args.func(pool, args))
+    except ExiftoolError as e:
+        sys.exit('{}: {!s}'.format(PROGRAM_NAME, e))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
@@ -1,58 +1,373 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 # 
 # http://android.stackexchange.com/questions/58087/read-content-of-thumbdata-file
 # http://android.stackexchange.com/a/109739
 #
 
+import argparse
+import mmap
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-JPEG_HEADER_START = '\xff\xd8'
-JPEG_HEADER_END = '\xff\xd9'
+import dedup_index
+import image_carving
+import instrumentation
 
+JPEG_HEADER_START = b'\xff\xd8'
+JPEG_HEADER_END = b'\xff\xd9'
 
-def extract_files_from_thumbdata_file(path):
-    """extract files from Android thumbdata3 file"""
+# Number of bytes read from the thumbdata file at a time.  Memory use is
+# bounded by this regardless of the size of the input file.
+WINDOW_SIZE = 1024 * 1024
 
+# Pages of memory-mapped thumbdata files are released after every this many
+# bytes, so that resident memory does not grow with the size of the input.
+RELEASE_SIZE = 64 * 1024 * 1024
+
+ENGINES = ['markers', 'segments']
+
+
+class _Output(object):
+    """Carved file being written, hashed on the way if deduplicating."""
+    def __init__(self, path, dedup):
+        self.name = path
+        self.dedup = dedup
+        self.hasher = None
+        with instrumentation.timer('write'):
+            if dedup:
+                self.hasher = dedup_index.new_hasher()
+                # Never write through a hard link to another copy.
+                if os.path.lexists(path):
+                    os.remove(path)
+            self.fh = open(path, 'wb')
+
+    def write(self, data):
+        with instrumentation.timer('write'):
+            self.fh.write(data)
+            if self.hasher:
+                self.hasher.update(data)
+        instrumentation.count('bytes_written', len(data))
+
+    def close(self):
+        with instrumentation.timer('write'):
+            self.fh.close()
+            if self.dedup and not self.dedup.add_written(
+                    self.name, self.hasher.digest()):
+                instrumentation.count('duplicates')
+
+
+def extract_files_from_thumbdata_file(path, out_dir='.',
+                                      window_size=WINDOW_SIZE, dedup=None):
+    """extract files from Android thumbdata3 file
+
+    Carved images are written to "out_dir" as "extracted%03d.jpg".
+    Returns the number of carved files.
+
+    If given a "dedup_index.DedupIndex" as "dedup", files whose contents
+    have already been written are removed or hard-linked once written.
+
+    The file is read in fixed-size windows and every carved JPEG is written
+    straight from the read buffer, so arbitrarily large thumbdata files can
+    be processed in constant memory.  Markers that straddle two windows are
+    handled by carrying a trailing 0xFF byte over to the next window.
+
+    NOTE: As always, the written files run from the start-of-image marker up
+          to and including the 0xFF of the end-of-image marker.
+    """
+    if window_size < 2:
+        raise ValueError('window_size must be at least 2 bytes')
+
+    buf = bytearray(window_size)
+    view = memoryview(buf)
+
+    count = 0
+    out = None
+    carry = 0
     with open(path, 'rb') as f:
-        thumb_data = f.read()
+        while True:
+            with instrumentation.timer('read'):
+                n = f.readinto(view[carry:])
+            if not n:
+                break
+            instrumentation.count('bytes_read', n)
+            end = carry + n
+
+            pos = 0
+            with instrumentation.timer('scan'):
+                while True:
+                    if out is None:
+                        x1 = buf.find(JPEG_HEADER_START, pos, end)
+                        if x1 < 0:
+                            break
+
+                        out_file = os.path.join(
+                            out_dir, 'extracted{:03d}.jpg'.format(count))
+                        out = _Output(out_file, dedup)
+                        count += 1
+                        pos = x1
+
+                    x2 = buf.find(JPEG_HEADER_END, pos, end)
+                    if x2 < 0:
+                        break
+
+                    out.write(view[pos:x2 + 1])
+                    out.close()
+                    out = None
+                    pos = x2 + 2
+
+            # Hold back a trailing 0xFF; it might be the first half of a
+            # marker continued in the next window.
+            carry = 1 if pos < end and buf[end - 1] == 0xff else 0
+            if out is not None:
+                out.write(view[pos:end - carry])
+            if carry:
+                buf[0] = buf[end - 1]
+
+    if out is not None:
+        # Ran out of data before the end-of-image marker.
+        if carry:
+            out.write(view[:carry])
+        out.close()
+        print('Truncated last file "{}"'.format(out.name))
+
+    instrumentation.count('images_found', count)
+    return count
+
+
+def _release_pages(mm, released, offset):
+    if not hasattr(mmap, 'MADV_DONTNEED') or offset - released < RELEASE_SIZE:
+        return released
+
+    offset -= offset % mmap.PAGESIZE
+    mm.madvise(mmap.MADV_DONTNEED, released, offset - released)
+    return offset
+
+
+def carve_files_from_thumbdata_file(path, out_dir='.', dedup=None):
+    """carve files from Android thumbdata3 file by walking their structure
 
+    Unlike "extract_files_from_thumbdata_file()", JPEG images are walked
+    segment by segment, so that end-of-image markers inside embedded EXIF
+    thumbnails or compressed data do not cut images short.  PNG and WebP
+    images are carved as well.
+
+    Carved images are written to "out_dir" as "extracted%03d.<extension>".
+    Returns the number of carved files.
+
+    If given a "dedup_index.DedupIndex" as "dedup", images whose contents
+    have already been written are skipped or hard-linked.
+    """
     count = 0
-    start = 0
-    while True:
-        x1 = thumb_data.find(JPEG_HEADER_START, start)
-        if x1 < 0:
-            break
-        x2 = thumb_data.find(JPEG_HEADER_END, x1)
-        jpg = thumb_data[x1:x2 + 1]
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return count
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mm) as view, instrumentation.timer('scan'):
+                released = 0
+                for extension, start, end in image_carving.carve(mm):
+                    out_file = os.path.join(
+                        out_dir, 'extracted{:03d}.{}'.format(count, extension))
+                    with instrumentation.timer('write'):
+                        if dedup:
+                            if not dedup.write(view[start:end], out_file):
+                                instrumentation.count('duplicates')
+                        else:
+                            with open(out_file, 'wb') as fw:
+                                fw.write(view[start:end])
+                    instrumentation.count('bytes_written', end - start)
+                    count += 1
+                    released = _release_pages(mm, released, end)
+        finally:
+            mm.close()
+
+    # The file is mapped, so reading it is part of scanning it.
+    instrumentation.count('bytes_read', size)
+    instrumentation.count('images_found', count)
+    return count
+
+
+def output_dirs(paths, out_dir):
+    """
+    Maps each input path to the directory its carved images are written to.
+
+    A single input writes directly to "out_dir".  With several inputs, each
+    one gets a "<input basename>_extracted" sub-directory so that the
+    "extracted%03d.jpg" counters of different inputs never collide.
+    """
+    if len(paths) == 1:
+        return {paths[0]: out_dir}
+
+    dirs = {}
+    used = set()
+    for path in paths:
+        name = '{}_extracted'.format(os.path.basename(path).lstrip('.'))
+        unique_name = name
+        n = 1
+        while unique_name in used:
+            unique_name = '{}-{}'.format(name, n)
+            n += 1
+        used.add(unique_name)
+        dirs[path] = os.path.join(out_dir, unique_name)
+
+    return dirs
+
+
+def _extract_to_dir(path, out_dir, engine, dedup_path=None, hardlink=False):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    dedup = None
+    if dedup_path:
+        dedup = dedup_index.DedupIndex(dedup_path, hardlink)
+    try:
+        if engine == 'markers':
+            return extract_files_from_thumbdata_file(path, out_dir,
+                                                     dedup=dedup)
+        return carve_files_from_thumbdata_file(path, out_dir, dedup)
+    finally:
+        if dedup:
+            dedup.close()
 
-        out_file = 'extracted{:03d}.jpg'.format(count)
-        with open(out_file, 'wb') as fw:
-            fw.write(jpg)
 
-        start = x2 + 2
-        count += 1
+def _extract_in_worker(*args):
+    # Sends the metrics of the worker process back along with the count.
+    instrumentation.metrics.reset()
+    count = _extract_to_dir(*args)
+    return count, instrumentation.metrics.state()
 
-    print('Wrote {} files'.format(count))
+
+def extract_all(inputs, dirs, engine, dedup_path=None, hardlink=False,
+                jobs=1, in_process=False):
+    """
+    Extracts the images of every input file to its directory of "dirs", in
+    parallel, with the metrics of the workers merged into those of this
+    process.
+
+    :param in_process: Whether to extract the files one at a time in this
+                       process instead, E.G. to profile the extraction.
+    :return: Generator of tuples of the input path, the number of carved
+             files and the error, one of which is None, as files finish.
+    """
+    if in_process:
+        for path in inputs:
+            try:
+                count = _extract_to_dir(path, dirs[path], engine, dedup_path,
+                                        hardlink)
+            except (IOError, OSError) as e:
+                yield path, None, e
+            else:
+                yield path, count, None
+        return
+
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+        for path in inputs:
+            future = executor.submit(_extract_in_worker, path, dirs[path],
+                                     engine, dedup_path, hardlink)
+            futures[future] = path
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                count, state = future.result()
+            except (IOError, OSError) as e:
+                yield path, None, e
+            else:
+                instrumentation.metrics.merge(state)
+                yield path, count, None
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('Usage: {} [FILE [FILE ...]]'.format(sys.argv[0]))
-        print('')
-        print(' NOTE: Any files named "extracted%03d.jpg" in working ')
-        print('       directory could be overwritten! Use with caution.')
+    parser = argparse.ArgumentParser(
+        description='Extracts JPEG thumbnails from Android thumbdata files.',
+        epilog='NOTE: Any files named "extracted%03d.*" in the output '
+               'directory could be overwritten! Use with caution.'
+    )
+    parser.add_argument(
+        dest='files', nargs='+', metavar='FILE',
+        help='Android thumbdata file(s), I.E. ".thumbdata3-*".  When given '
+             'more than one file, images are written to one sub-directory '
+             'per file.'
+    )
+    parser.add_argument(
+        '-o', '--output-dir',
+        dest='output_dir', default='.', metavar='DIR',
+        help='Directory to write extracted images to.  Defaults to the '
+             'current working directory.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=1, metavar='N',
+        help='Number of files to process in parallel.  Defaults to 1.'
+    )
+    parser.add_argument(
+        '-e', '--engine',
+        dest='engine', choices=ENGINES, default=ENGINES[0],
+        help='How to find the images.  "markers" copies everything between '
+             'JPEG start and end markers.  "segments" walks the structure of '
+             'JPEG, PNG and WebP images, so that markers inside embedded EXIF '
+             'thumbnails do not cut images short.  Defaults to "%(default)s".'
+    )
+    parser.add_argument(
+        '--dedup-index',
+        dest='dedup_index', default=None, metavar='PATH',
+        help='Path to a deduplication index database, shared with the other '
+             'extractors.  Images whose contents are already in the index '
+             'are not written again.'
+    )
+    parser.add_argument(
+        '--hardlink-duplicates',
+        dest='hardlink', action='store_true', default=False,
+        help='Hard-link duplicate images to the first written copy instead '
+             'of skipping them.  Requires "--dedup-index".'
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    inputs = []
+    for arg in args.files:
+        if os.path.isfile(arg):
+            if not os.access(arg, os.R_OK):
+                print('Not authorized to read file: "{}"'.format(str(arg)))
+                continue
+            else:
+                inputs.append(arg)
+        else:
+            print('Not a file: "{}"'.format(str(arg)))
+            continue
+
+    if not inputs:
         sys.exit(1)
-    else:
-        for arg in sys.argv[1:]:
-            if os.path.isfile(arg):
-                if not os.access(arg, os.R_OK):
-                    print('Not authorized to read file: "{}"'.format(str(arg)))
-                    continue
-                else:
-                    extract_files_from_thumbdata_file(arg)
+
+    dirs = output_dirs(inputs, args.output_dir)
+
+    total_count = 0
+    failed = []
+    with instrumentation.Session(args, os.path.basename(__file__)) \
+            as session:
+        progress = session.progress(
+            sum(os.path.getsize(path) for path in inputs) / 2 ** 20, 'MiB')
+        # The profilers only see this process, so extract in it.
+        results = extract_all(inputs, dirs, args.engine, args.dedup_index,
+                              args.hardlink, args.jobs,
+                              in_process=bool(args.profile))
+        for path, count, error in results:
+            if error:
+                progress.print('Failed to extract "{}": {}'.format(path, error))
+                failed.append(path)
             else:
-                print('Not a file: "{}"'.format(str(arg)))
-                continue
+                progress.print('Carved {} files from "{}" to "{}"'.format(
+                    count, path, dirs[path]))
+                total_count += count
+            progress.update(os.path.getsize(path) / 2 ** 20)
+        progress.close()
 
-        sys.exit(0)
+        print('Carved {} files from {} of {} thumbdata files'.format(
+            total_count, len(inputs) - len(failed), len(inputs)))
+        if args.dedup_index:
+            with dedup_index.DedupIndex(args.dedup_index) as dedup:
+                print(dedup.format_stats())
+    sys.exit(1 if failed else 0)
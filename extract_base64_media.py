@@ -23,22 +23,49 @@
 # _____________________________________________________________________
 
 
-import base64
+import binascii
+import collections
+import itertools
 import logging
 import os
+import queue
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dedup_index
+import instrumentation
 
 PROGRAM_NAME = os.path.basename(__file__)
 
+# Number of bytes read from the HTML files at a time.  Memory use is bounded
+# by this regardless of the size of the files and the embedded images.
+CHUNK_SIZE = 256 * 1024
 
-RE_ENCODED_JPEG = re.compile(
-    r'^.*?src="data:image/jpeg;charset=utf-8;base64,(.*)%0A">\s*',
-    re.DOTALL | re.MULTILINE,
-)
-RE_ENCODED_PNG = re.compile(
-    r'data:image/png(?:;charset=utf-8)?;base64,(.*)',
-    re.DOTALL | re.MULTILINE,
+RE_DATA_URI_HEADER = re.compile(
+    rb'data:image/([a-zA-Z0-9.+-]+)((?:;[^;,\s"\'<>]*)*?);base64,'
 )
+# Number of decoded chunks the scanning of a file may run ahead of writing
+# its images.
+PREFETCH_CHUNKS = 16
+
+# Longest data URI header kept around while waiting for the rest of it.
+DATA_URI_HEADER_MAX_LENGTH = 256
+
+# Base64 payloads, possibly interspersed with whitespace and URL-encoded
+# characters like "%0A".  Payloads end with any padding.
+RE_ENCODED_PAYLOAD = re.compile(rb'(?:[A-Za-z0-9+/\s]|%[0-9A-Fa-f]{2})*')
+RE_ENCODED_PADDING = re.compile(rb'(?:=|%3[dD])+')
+RE_URL_ENCODED_CHAR = re.compile(rb'%([0-9A-Fa-f]{2})')
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+FILETYPE_EXTENSIONS = {
+    'jpeg': 'jpg',
+    'pjpeg': 'jpg',
+    'svg+xml': 'svg',
+    'x-icon': 'ico',
+    'vnd.microsoft.icon': 'ico',
+}
 
 
 def validate_file(arg):
@@ -50,86 +77,363 @@ def validate_file(arg):
     raise argparse.ArgumentTypeError('Invalid file: "{}"'.format(str(arg)))
 
 
-def decode_and_write_to_disk(found_data, dry_run=False):
-    def _format_filename(_number, _extension):
-        return 'extracted_{:04d}.{!s}'.format(_number, _extension)
+def _filetype_from_mime_subtype(subtype):
+    subtype = subtype.decode('ascii').lower()
+    if subtype in FILETYPE_EXTENSIONS:
+        return FILETYPE_EXTENSIONS[subtype]
+    return re.sub(r'[^a-z0-9]', '', subtype) or 'bin'
 
-    i = 0
-    write_count = 0
-    error_count = 0
-    for image in found_data:
-        raw_data = image['data']
-        raw_data = raw_data.strip()
-        if not raw_data:
-            log.warning('Skipping (empty raw_data) ..')
-            continue
 
-        outfile = _format_filename(i, image['filetype'])
-        while os.path.exists(outfile):
-            log.debug('Destination exists: "{}"'.format(outfile))
-            i += 1
-            outfile = _format_filename(i, image['filetype'])
+def _url_decode_char(match):
+    return binascii.unhexlify(match.group(1))
 
-        # TODO: Handle data encoding properly.
-        raw_data = raw_data.replace('%0A', '')
-        raw_data = raw_data.encode('utf-8')
 
-        if dry_run:
-            log.info('[--dry-run] Would have written {} bytes to file '
-                     '"{}" ..'.format(len(raw_data), str(outfile)))
-        else:
-            if os.path.exists(outfile):
-                log.error('Destination exists: "{}"'.format(outfile))
-                error_count += 1
+class DataURIScanner(object):
+    """
+    Finds base64-encoded "data:image/..." URIs in a binary file object.
+
+    Iterating over the scanner yields tuples of the file type and a
+    generator of decoded chunks of the image.  The file is read a chunk at
+    a time and images are decoded while they are being read, so neither
+    the file nor any image needs to fit in memory.  URIs are allowed to
+    span any number of lines.
+
+    The chunks of each image must be consumed before advancing to the next
+    image; any chunks left unconsumed are skipped.
+    """
+    def __init__(self, file_object, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        :param file_object: Binary file object to scan.
+        :param chunk_size: Number of bytes to read at a time.
+        :param progress: Optional "instrumentation.Progress", updated with
+                         the number of MiB read.
+        """
+        self.file_object = file_object
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.offset = 0
+        self._buf = b''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        with instrumentation.timer('read'):
+            data = self.file_object.read(self.chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        instrumentation.count('bytes_read', len(data))
+        if self.progress:
+            self.progress.update(len(data) / 2 ** 20)
+
+        self.offset += self._pos
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def __iter__(self):
+        while True:
+            with instrumentation.timer('scan'):
+                match = RE_DATA_URI_HEADER.search(self._buf, self._pos)
+            if not match:
+                # Keep enough of the buffer to find a header split in two.
+                self._pos = max(self._pos,
+                                len(self._buf) - DATA_URI_HEADER_MAX_LENGTH)
+                if not self._fill():
+                    return
                 continue
 
-            log.info('Writing {} bytes to "{}" ..'.format(len(raw_data),
-                                                          str(outfile)))
+            log.debug('Found base64 encoded %s image at offset %d',
+                      match.group(1).decode('ascii'),
+                      self.offset + match.start())
+            instrumentation.count('data_uris_found')
+            self._pos = match.end()
+            chunks = self._decode_payload()
+            yield _filetype_from_mime_subtype(match.group(1)), chunks
+            for _ in chunks:
+                pass
+
+    def _decode_payload(self):
+        pending = b''
+        while True:
+            with instrumentation.timer('scan'):
+                match = RE_ENCODED_PAYLOAD.match(self._buf, self._pos)
+                end = match.end()
+                encoded = self._buf[self._pos:end]
+                self._pos = end
+
+            with instrumentation.timer('decode'):
+                if b'%' in encoded:
+                    encoded = RE_URL_ENCODED_CHAR.sub(_url_decode_char,
+                                                      encoded)
+                pending += encoded.translate(None, WHITESPACE)
+
+                # Decode whole 4-character groups, the rest waits for more
+                # data.
+                usable = len(pending) - len(pending) % 4
+                if usable:
+                    decoded = binascii.a2b_base64(pending[:usable])
+                    pending = pending[usable:]
+            if usable:
+                instrumentation.count('bytes_decoded', len(decoded))
+                yield decoded
+
+            padding = RE_ENCODED_PADDING.match(self._buf, self._pos)
+            if padding:
+                self._pos = padding.end()
+                break
+
+            # The payload may continue in the next chunk, possibly with an
+            # URL-encoded character split in two.
+            if end < len(self._buf) - 2 or not self._fill():
+                break
+
+        if len(pending) > 1:
+            with instrumentation.timer('decode'):
+                decoded = binascii.a2b_base64(
+                    pending + b'=' * (-len(pending) % 4))
+            instrumentation.count('bytes_decoded', len(decoded))
+            yield decoded
+
+
+class ImagePrefetcher(object):
+    """
+    Scans a file and decodes its images in a background thread, so that
+    reading, scanning and decoding overlap writing the images.
+
+    Takes and yields images like "extract_encoded_images_from_html()".
+    At most "depth" decoded chunks are queued, so memory use stays bounded.
+    As with the scanner, the chunks of each image must be consumed before
+    advancing to the next image; any chunks left unconsumed are skipped.
+    """
+    def __init__(self, found_data, depth=PREFETCH_CHUNKS):
+        """
+        :param found_data: Iterable of images to prefetch.
+        :param depth: Maximum number of decoded chunks queued.
+        """
+        self.found_data = found_data
+        self._queue = queue.Queue(depth)
+        self._stopped = threading.Event()
+        self._next_item = None
+
+    def _put(self, kind, value=None):
+        # Gives up once the consumer is gone, instead of blocking forever.
+        while not self._stopped.is_set():
             try:
-                with open(outfile, "wb") as fh:
-                    fh.write(base64.decodebytes(raw_data))
-                    # outfile_raw = 'extracted_{0:04d}.raw'.format(i)
-                    # with open(outfile_raw, "wb") as fhr:
-                    #    fhr.write(raw_data)
-            except Exception:
-                log.error('Write (decode) operation failed ..')
-                error_count += 1
+                self._queue.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for image in self.found_data:
+                if not self._put('image', image['filetype']):
+                    return
+                try:
+                    for chunk in image['chunks']:
+                        if not self._put('chunk', chunk):
+                            return
+                except Exception as e:
+                    # Fails this image only, like it would when decoding
+                    # while writing.
+                    if not self._put('chunk_error', e):
+                        return
+        except Exception as e:
+            self._put('error', e)
+        finally:
+            close = getattr(self.found_data, 'close', None)
+            if close:
+                close()
+            self._put('end')
+
+    def _get(self):
+        if self._next_item:
+            item, self._next_item = self._next_item, None
+            return item
+        return self._queue.get()
+
+    def _chunks(self):
+        while True:
+            kind, value = self._get()
+            if kind == 'chunk':
+                yield value
+            elif kind == 'chunk_error':
+                raise value
             else:
-                write_count += 1
+                self._next_item = kind, value
+                return
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                kind, value = self._get()
+                if kind == 'image':
+                    yield {
+                        'filetype': value,
+                        'chunks': self._chunks(),
+                    }
+                elif kind == 'error':
+                    raise value
+                elif kind == 'end':
+                    return
+        finally:
+            self._stopped.set()
+            thread.join()
+
+
+class OutputNameReserver(object):
+    """
+    Hands out unique "extracted_NNNN.<extension>" filenames in a directory.
+
+    The directory is listed once and numbering continues after the highest
+    number in use.  Files are created with O_EXCL, so names are never
+    handed out twice, even to concurrent writers or other processes.
+    """
+    RE_OUTPUT_FILENAME = re.compile(r'^extracted_(\d+)\.')
 
-        i += 1
+    def __init__(self, directory=''):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._next_number = 0
+        for name in os.listdir(directory or os.curdir):
+            match = self.RE_OUTPUT_FILENAME.match(name)
+            if match:
+                self._next_number = max(self._next_number,
+                                        int(match.group(1)) + 1)
 
+    def next_name(self, extension):
+        """Returns the next unused filename, without creating the file."""
+        with self._lock:
+            number = self._next_number
+            self._next_number += 1
+        return os.path.join(self.directory,
+                            'extracted_{:04d}.{!s}'.format(number, extension))
+
+    def create(self, extension):
+        """
+        Creates a new, empty file with the next unused filename.
+
+        :return: Tuple of the path and a binary file object open for writing.
+        """
+        while True:
+            outfile = self.next_name(extension)
+            try:
+                fd = os.open(outfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o666)
+            except FileExistsError:
+                log.debug('Destination exists: "{}"'.format(outfile))
+                continue
+            return outfile, os.fdopen(fd, 'wb')
+
+
+def write_images(found_data, names, dry_run=False, dedup=None):
+    """
+    Writes decoded images to files named by "names".
+
+    :param found_data: Iterable of images, as returned by
+                       "extract_encoded_images_from_html()".
+    :param names: Instance of "OutputNameReserver".
+    :param dry_run: Only decode the images, do not write anything.
+    :param dedup: Optional "dedup_index.DedupIndex".
+    :return: Counter of found, written, duplicate and failed images.
+    """
+    counts = collections.Counter()
+    for image in found_data:
+        counts['found'] += 1
+        chunks = (chunk for chunk in image['chunks'] if chunk)
+        try:
+            first_chunk = next(chunks, None)
+        except binascii.Error:
+            first_chunk = None
+        if not first_chunk:
+            log.warning('Skipping (empty or invalid data) ..')
+            continue
+        chunks = itertools.chain([first_chunk], chunks)
+
+        if dry_run:
+            outfile = names.next_name(image['filetype'])
+            try:
+                size = sum(len(chunk) for chunk in chunks)
+            except binascii.Error:
+                log.error('Decode operation failed ..')
+                counts['errors'] += 1
+                continue
+            log.info('[--dry-run] Would have written {} bytes to file '
+                     '"{}" ..'.format(size, str(outfile)))
+            continue
+
+        outfile, fh = names.create(image['filetype'])
+        log.info('Writing "{}" ..'.format(str(outfile)))
+        size = 0
+        hasher = dedup_index.new_hasher() if dedup else None
+        try:
+            with fh:
+                for chunk in chunks:
+                    with instrumentation.timer('write'):
+                        fh.write(chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                    size += len(chunk)
+        except Exception:
+            log.error('Write (decode) operation failed ..')
+            counts['errors'] += 1
+            os.remove(outfile)
+            continue
+
+        log.debug('Wrote {} bytes to "{}"'.format(size, outfile))
+        instrumentation.count('bytes_written', size)
+        if dedup and not dedup.add_written(outfile, hasher.digest()):
+            log.info('Skipped duplicate "{}" ..'.format(outfile))
+            counts['duplicates'] += 1
+        else:
+            counts['written'] += 1
+
+    return counts
+
+
+def log_summary(counts):
     log.info('[DONE] All Finished!')
-    if write_count > 0:
-        log.info('Successfully wrote {} files to disk.'.format(write_count))
-    if error_count > 0:
-        log.info('Failed to decode/write {} files.'.format(error_count))
-
-
-def extract_encoded_images_from_html(filename):
-    results = []
-
-    with open(filename) as file_data:
-        for num, line in enumerate(file_data, 1):
-            match_jpg = RE_ENCODED_JPEG.match(line)
-            if match_jpg:
-                log.debug('Found base64 encoded jpeg image on line %d', num)
-                results.append({
-                    'filetype': 'jpg',
-                    'data': match_jpg.group(1),
-                })
-
-            log.debug('Trying to matching line: %s', line)
-            match_png = RE_ENCODED_PNG.match(line)
-            if match_png:
-                log.debug('Found base64 encoded PNG image on line %d', num)
-                results.append({
-                    'filetype': 'png',
-                    'data': match_png.group(1),
-                })
-
-    log.debug('Extracted %d images ..', len(results))
-    return results
+    if counts['found'] == 0:
+        log.info('No data was found')
+    else:
+        log.info('Found {} encoded files'.format(counts['found']))
+    if counts['written'] > 0:
+        log.info('Successfully wrote {} files to disk.'.format(
+            counts['written']))
+    if counts['duplicates'] > 0:
+        log.info('Skipped {} duplicate files.'.format(counts['duplicates']))
+    if counts['errors'] > 0:
+        log.info('Failed to decode/write {} files.'.format(counts['errors']))
+
+
+def decode_and_write_to_disk(found_data, dry_run=False, dedup=None):
+    names = OutputNameReserver()
+    log_summary(write_images(found_data, names, dry_run, dedup))
+
+
+def extract_encoded_images_from_html(filename, progress=None):
+    """
+    Finds base64-encoded images in a file.
+
+    This is a generator; the file is scanned while the images are consumed.
+
+    :param filename: Path to the (HTML) file to scan.
+    :param progress: Optional "instrumentation.Progress", updated with the
+                     number of MiB read.
+    :return: Generator of dicts with the image "filetype" and the decoded
+             image data "chunks".
+    """
+    log.info('Processing file: "{}" ..'.format(str(filename)))
+    with open(filename, 'rb') as file_data:
+        for filetype, chunks in DataURIScanner(file_data, progress=progress):
+            yield {
+                'filetype': filetype,
+                'chunks': chunks,
+            }
 
 
 if __name__ == '__main__':
@@ -147,9 +451,27 @@ if __name__ == '__main__':
                            action='store_true', default=False, dest='dry_run',
                            help='Simulate what would happen but do not actually'
                                 'modify/write anything.')
+    argparser.add_argument('-j', '--jobs',
+                           type=int, default=1, dest='jobs', metavar='N',
+                           help='Number of files to process concurrently. '
+                                'Each file is scanned and decoded in a '
+                                'thread of its own while its images are '
+                                'written. Defaults to 1.')
+    argparser.add_argument('--dedup-index',
+                           default=None, dest='dedup_index', metavar='PATH',
+                           help='Path to a deduplication index database, '
+                                'shared with the other extractors. Images '
+                                'whose contents are already in the index are '
+                                'not written again.')
+    argparser.add_argument('--hardlink-duplicates',
+                           action='store_true', default=False, dest='hardlink',
+                           help='Hard-link duplicate images to the first '
+                                'written copy instead of skipping them. '
+                                'Requires "--dedup-index".')
     argparser.add_argument(dest='files', nargs='*', metavar='FILE',
                            type=validate_file,
                            help='File to convert.')
+    instrumentation.add_arguments(argparser)
 
     args = argparser.parse_args()
 
@@ -164,13 +486,32 @@ if __name__ == '__main__':
 
     log = logging.getLogger()
 
-    encoded_data = []
-    for f in args.files:
-        log.info('Processing file: "{}" ..'.format(str(f)))
-        encoded_data += extract_encoded_images_from_html(f)
-
-    if encoded_data:
-        log.info('[FINISHED] Found {} encoded files'.format(len(encoded_data)))
-        decode_and_write_to_disk(encoded_data, args.dry_run)
-    else:
-        log.info('[FINISHED] No data was found')
+    with instrumentation.Session(args, PROGRAM_NAME) as session:
+        progress = session.progress(
+            sum(os.path.getsize(f) for f in args.files) / 2 ** 20, 'MiB')
+        dedup = None
+        if args.dedup_index:
+            dedup = dedup_index.DedupIndex(args.dedup_index, args.hardlink)
+        try:
+            # Files are processed concurrently, with output filenames
+            # handed out by a single shared reserver.  Within a file,
+            # scanning and decoding run ahead of writing.
+            names = OutputNameReserver()
+            total_counts = collections.Counter()
+            with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+                futures = [
+                    executor.submit(write_images,
+                                    ImagePrefetcher(
+                                        extract_encoded_images_from_html(
+                                            f, progress)),
+                                    names, args.dry_run, dedup)
+                    for f in args.files
+                ]
+                for future in futures:
+                    total_counts.update(future.result())
+            progress.close()
+            log_summary(total_counts)
+        finally:
+            if dedup:
+                log.info(dedup.format_stats())
+                dedup.close()
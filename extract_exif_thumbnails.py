@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# extract_exif_thumbnails.py
+# ==========================
+# Extracts EXIF thumbnails from one or more given filepaths.
+# Extracted thumbnails are written to filenames on the form
+# ${ORIGINAL_FILENAME_WITHOUT_EXTENSION}_exif_thumbnail.jpg
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Replacement for "extract_exif_thumbnails.sh" that does not run "readlink",
+"file" and "exif" for every file.
+
+The thumbnail is a byte range within the EXIF segment at the start of a
+JPEG, so only the first "exif_thumbnail.HEADER_READ_SIZE" bytes of each
+file are read, with a single "os.pread()", and the thumbnail is written
+straight from that buffer.  Nothing is decoded.  Files are handled by a
+pool of threads, as the work is almost entirely waiting on the disk.
+
+Arguments that are not readable JPEG files are ignored, existing
+thumbnails are never overwritten and the exit status is 1 if a thumbnail
+could not be extracted from any JPEG, just like the shell script.
+"""
+
+import argparse
+import collections
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import dedup_index
+import exif_thumbnail
+import image_discovery
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+THUMBNAIL_SUFFIX = '_exif_thumbnail.jpg'
+
+# Number of files queued per worker thread.
+QUEUED_FILES_PER_JOB = 16
+
+# Outcomes of extracting the thumbnail of a file.
+EXTRACTED = 'EXTRACTED'
+DUPLICATE = 'DUPLICATE'
+EXISTS = 'EXISTS'
+IGNORED = 'IGNORED'
+FAILED = 'FAILED'
+
+
+def thumbnail_path(path):
+    """Returns the path the thumbnail of the image at "path" is written to."""
+    return os.path.splitext(path)[0] + THUMBNAIL_SUFFIX
+
+
+def extract_thumbnail(path, dedup=None):
+    """
+    Extracts the EXIF thumbnail of a JPEG file.
+
+    :param path: Path to the file.
+    :param dedup: Optional "dedup_index.DedupIndex".  Thumbnails already in
+                  the index are hard-linked to the first copy.
+    :return: Tuple of the outcome, one of "EXTRACTED", "DUPLICATE",
+             "EXISTS", "IGNORED" and "FAILED", and the path to the
+             thumbnail or an error message.
+    """
+    if not os.access(path, os.R_OK):
+        return IGNORED, None
+    path = os.path.realpath(path)
+    if not os.path.isfile(path):
+        return IGNORED, None
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        return FAILED, 'Unable to read "{}": {!s}'.format(path, e)
+    try:
+        return _extract_thumbnail(path, fd, dedup)
+    finally:
+        os.close(fd)
+
+
+def _extract_thumbnail(path, fd, dedup):
+    try:
+        header = os.pread(fd, exif_thumbnail.HEADER_READ_SIZE, 0)
+    except OSError as e:
+        return FAILED, 'Unable to read "{}": {!s}'.format(path, e)
+    if image_discovery.image_type_from_header(header) != 'jpg':
+        return IGNORED, None
+
+    out_path = thumbnail_path(path)
+    if os.path.lexists(out_path):
+        return EXISTS, out_path
+
+    try:
+        location = exif_thumbnail.find_exif_thumbnail(header)
+    except exif_thumbnail.ExifError as e:
+        return FAILED, 'Malformed EXIF data in "{}": {!s}'.format(path, e)
+    if location is None:
+        return FAILED, '"{}" does not contain a thumbnail'.format(path)
+
+    offset, length = location
+    try:
+        if offset + length <= len(header):
+            data = memoryview(header)[offset:offset + length]
+        else:
+            # Unusually large segments before the EXIF segment.
+            data = os.pread(fd, length, offset)
+        if dedup is not None:
+            if not dedup.write(data, out_path):
+                return DUPLICATE, out_path
+        else:
+            with open(out_path, 'xb') as fh:
+                fh.write(data)
+    except FileExistsError:
+        return EXISTS, out_path
+    except OSError as e:
+        return FAILED, 'Unable to write "{}": {!s}'.format(out_path, e)
+    return EXTRACTED, out_path
+
+
+def extract_thumbnails(paths, jobs=1, dedup=None):
+    """
+    Extracts the EXIF thumbnails of files in a pool of threads.
+
+    :param paths: Iterable of paths to files, consumed lazily.
+    :param jobs: Number of threads.
+    :param dedup: Optional "dedup_index.DedupIndex".
+    :return: Generator of tuples of the path and the result of
+             "extract_thumbnail()", in the same order as "paths".
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        queued = collections.deque()
+        for path in paths:
+            queued.append((path, executor.submit(extract_thumbnail, path,
+                                                 dedup)))
+            if len(queued) >= jobs * QUEUED_FILES_PER_JOB:
+                path, future = queued.popleft()
+                yield path, future.result()
+        while queued:
+            path, future = queued.popleft()
+            yield path, future.result()
+
+
+def main(paths, jobs=1, dedup=None, verbose=False):
+    """
+    :return: 0 if thumbnails were extracted from all JPEG files, otherwise 1.
+    """
+    exit_status = 0
+    for path, (outcome, message) in extract_thumbnails(paths, jobs, dedup):
+        if outcome == EXISTS:
+            print('{}: Skipped existing file: {}'.format(PROGRAM_NAME, path))
+        elif outcome == FAILED:
+            print('{}: {}'.format(PROGRAM_NAME, message), file=sys.stderr)
+            exit_status = 1
+        elif verbose and outcome in (EXTRACTED, DUPLICATE):
+            print(message)
+    return exit_status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Extracts EXIF thumbnails from one or more given '
+                    'filepaths.  Extracted thumbnails are written to '
+                    'filenames on the form '
+                    '${ORIGINAL_FILENAME_WITHOUT_EXTENSION}_exif_thumbnail.jpg',
+        epilog='Exit status is 0 if thumbnails was successfully extracted '
+               'from all given filepaths, otherwise 1.'
+    )
+    parser.add_argument(
+        dest='files', nargs='*', metavar='FILEPATH',
+        help='JPEG files.  Other files are ignored.'
+    )
+    parser.add_argument(
+        '-r', '--recursive',
+        dest='recursive', action='store_true', default=False,
+        help='Extract thumbnails of all JPEG files in the given '
+             'directories, recursively.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=min(32, (os.cpu_count() or 1) * 4),
+        metavar='N',
+        help='Number of files read concurrently.  Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--dedup-index',
+        dest='dedup_index', default=os.environ.get('DEDUP_INDEX') or None,
+        metavar='PATH',
+        help='Path to a deduplication index database (see dedup_index.py). '
+             'Thumbnails whose contents are already in the index are '
+             'replaced by hard links to the first extracted copy.  Defaults '
+             'to the environment variable DEDUP_INDEX.'
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        dest='verbose', action='store_true', default=False,
+        help='Print the paths of extracted thumbnails.'
+    )
+    args = parser.parse_args()
+
+    if not args.files:
+        parser.print_usage(sys.stderr)
+        sys.exit(1)
+
+    paths = args.files
+    if args.recursive:
+        # Leave out thumbnails extracted by earlier runs.
+        paths = (path for path in image_discovery.walk_files(args.files)
+                 if not path.endswith(THUMBNAIL_SUFFIX))
+
+    dedup = None
+    if args.dedup_index:
+        dedup = dedup_index.DedupIndex(args.dedup_index, hardlink=True)
+
+    try:
+        sys.exit(main(paths, max(1, args.jobs), dedup, args.verbose))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
+    finally:
+        if dedup is not None:
+            dedup.close()
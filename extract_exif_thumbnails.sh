@@ -12,6 +12,9 @@ set -o nounset -o errexit -o pipefail -o noclobber
 _SELF_BASENAME="$(basename -- "${BASH_SOURCE[0]}")"
 readonly _SELF_BASENAME
 
+_SELF_DIRPATH="$(dirname -- "$(readlink --canonicalize -- "${BASH_SOURCE[0]}")")"
+readonly _SELF_DIRPATH
+
 
 if [ $# -eq 0 ]
 then
@@ -26,6 +29,11 @@ then
     Exit status is 0 if thumbnails was successfully extracted
     from all given filepaths, otherwise 1.
 
+    If the environment variable DEDUP_INDEX is set to the path of a
+    deduplication index database (see dedup_index.py), thumbnails
+    whose contents are already in the index are replaced by hard
+    links to the first extracted copy.
+
 EOF
     exit 1
 fi
@@ -48,6 +56,7 @@ fi
 
 
 declare -i exitstatus=0
+declare -a extracted_filepaths=()
 
 for arg in "$@"
 do
@@ -72,12 +81,22 @@ do
         continue
     fi
 
-    if ! command exif \
+    if command exif \
         --extract-thumbnail --no-fixup --output="$out_filepath" -- "$filepath"
     then
+        extracted_filepaths+=("$out_filepath")
+    else
         exitstatus=1
     fi
 done
 
 
+if [ -n "${DEDUP_INDEX:-}" ] && [ "${#extracted_filepaths[@]}" -gt 0 ]
+then
+    command python3 "${_SELF_DIRPATH}/dedup_index.py" \
+        --index "$DEDUP_INDEX" --hardlink -- "${extracted_filepaths[@]}" ||
+        exitstatus=1
+fi
+
+
 exit "$exitstatus"
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# image_carving.py
+# ================
+# Locates images embedded in arbitrary binary data, like Android thumbnail
+# caches and data recovery dumps.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Structure-aware image carving.
+
+Rather than searching for the next end-of-image marker, images are walked
+segment by segment (JPEG) or chunk by chunk (PNG, WebP) using the lengths
+declared in the data itself.  Marker bytes that happen to appear inside
+EXIF thumbnails, ICC profiles or compressed data are thereby skipped over.
+
+All functions accept any object supporting the buffer protocol, indexing
+and "find()", like "bytes", "bytearray" and "mmap.mmap".
+"""
+
+import re
+import struct
+import zlib
+
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+RIFF_SIGNATURE = b'RIFF'
+
+JPEG_MARKER_EOI = 0xd9
+JPEG_MARKER_SOS = 0xda
+
+# Matches a marker ending entropy-coded data; I.E. 0xFF followed by anything
+# but a stuffed zero byte, a restart marker or another fill byte.
+RE_JPEG_SCAN_MARKER = re.compile(b'\xff[^\x00\xd0-\xd7\xff]')
+
+
+class CarvingError(Exception):
+    """Data at the given offset is not a complete, well-formed image."""
+
+
+def jpeg_end(buf, start, limit=None, strict=False):
+    """
+    Walks the JPEG starting at "start" segment by segment.
+
+    Segments are skipped using their declared lengths and entropy-coded
+    scan data is searched for the first marker that is neither a stuffed
+    byte nor a restart marker.
+
+    :param buf: Buffer containing the image.
+    :param start: Offset of the start-of-image marker.
+    :param limit: Offset at which the data ends. Defaults to the buffer size.
+    :param strict: Whether to also require a start-of-frame segment followed
+                   by at least one scan, I.E. actual image data.
+    :return: Offset just past the end-of-image marker.
+    :raises CarvingError: The data is not a complete JPEG image.
+    """
+    if limit is None:
+        limit = len(buf)
+    if buf[start:start + 2] != b'\xff\xd8':
+        raise CarvingError('Missing JPEG start-of-image marker')
+
+    pos = start + 2
+    has_frame = has_scan = False
+    while True:
+        if pos + 1 >= limit:
+            raise CarvingError('Truncated before end-of-image marker')
+        if buf[pos] != 0xff:
+            raise CarvingError('Expected marker at offset {}'.format(pos))
+
+        # Any number of 0xFF fill bytes may precede a marker.
+        while buf[pos + 1] == 0xff:
+            pos += 1
+            if pos + 1 >= limit:
+                raise CarvingError('Truncated before end-of-image marker')
+
+        marker = buf[pos + 1]
+        pos += 2
+        if marker == JPEG_MARKER_EOI:
+            if strict and not has_scan:
+                raise CarvingError('No image data before end-of-image marker')
+            return pos
+        if 0xd0 <= marker <= 0xd7 or marker == 0x01:
+            # Standalone markers without a length field.
+            continue
+        if marker == 0x00 or marker == 0xd8:
+            raise CarvingError('Unexpected marker 0x{:02X} at offset {}'.format(
+                marker, pos - 2))
+
+        if pos + 2 > limit:
+            raise CarvingError('Truncated segment header at offset {}'.format(
+                pos - 2))
+        length = (buf[pos] << 8) | buf[pos + 1]
+        if length < 2:
+            raise CarvingError('Invalid segment length {} at offset {}'.format(
+                length, pos - 2))
+        pos += length
+        if pos > limit:
+            raise CarvingError('Truncated segment 0x{:02X}'.format(marker))
+
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            has_frame = True
+        elif marker == JPEG_MARKER_SOS:
+            if strict and not has_frame:
+                raise CarvingError('Scan before start-of-frame at offset '
+                                   '{}'.format(pos - length - 2))
+            has_scan = True
+            match = RE_JPEG_SCAN_MARKER.search(buf, pos, limit)
+            if not match:
+                raise CarvingError('Truncated scan data')
+            pos = match.start()
+
+
+def png_end(buf, start, limit=None, verify_crc=False, strict=False):
+    """
+    Walks the PNG starting at "start" chunk by chunk, up to the IEND chunk.
+
+    :param buf: Buffer containing the image.
+    :param start: Offset of the PNG signature.
+    :param limit: Offset at which the data ends. Defaults to the buffer size.
+    :param verify_crc: Whether to verify the CRC of every chunk.
+    :param strict: Whether to also require at least one IDAT chunk, I.E.
+                   actual image data.
+    :return: Offset just past the IEND chunk.
+    :raises CarvingError: The data is not a complete PNG image.
+    """
+    if limit is None:
+        limit = len(buf)
+    if buf[start:start + 8] != PNG_SIGNATURE:
+        raise CarvingError('Missing PNG signature')
+
+    pos = start + 8
+    first_chunk = True
+    has_data = False
+    while True:
+        if pos + 12 > limit:
+            raise CarvingError('Truncated before IEND chunk')
+        length, chunk_type = struct.unpack_from('>I4s', buf, pos)
+        if not chunk_type.isalpha():
+            raise CarvingError('Invalid chunk type at offset {}'.format(pos))
+        if first_chunk and chunk_type != b'IHDR':
+            raise CarvingError('First chunk is not IHDR')
+        first_chunk = False
+
+        chunk_end = pos + 12 + length
+        if chunk_end > limit:
+            raise CarvingError('Truncated {} chunk'.format(
+                chunk_type.decode('ascii')))
+
+        if verify_crc:
+            with memoryview(buf) as view:
+                crc = zlib.crc32(view[pos + 4:chunk_end - 4]) & 0xffffffff
+            expected_crc, = struct.unpack_from('>I', buf, chunk_end - 4)
+            if crc != expected_crc:
+                raise CarvingError('CRC mismatch in {} chunk at offset {}'.format(
+                    chunk_type.decode('ascii'), pos))
+
+        pos = chunk_end
+        if chunk_type == b'IDAT':
+            has_data = True
+        elif chunk_type == b'IEND':
+            if strict and not has_data:
+                raise CarvingError('No IDAT chunk before IEND chunk')
+            return pos
+
+
+def webp_end(buf, start, limit=None):
+    """
+    Gets the end of the WebP starting at "start" from its RIFF header.
+
+    :param buf: Buffer containing the image.
+    :param start: Offset of the RIFF header.
+    :param limit: Offset at which the data ends. Defaults to the buffer size.
+    :return: Offset just past the RIFF container.
+    :raises CarvingError: The data is not a complete WebP image.
+    """
+    if limit is None:
+        limit = len(buf)
+    if start + 16 > limit:
+        raise CarvingError('Truncated RIFF header')
+
+    riff, size, form, chunk_type = struct.unpack_from('<4sI4s4s', buf, start)
+    if riff != RIFF_SIGNATURE or form != b'WEBP':
+        raise CarvingError('Not a RIFF WEBP container')
+    if chunk_type not in (b'VP8 ', b'VP8L', b'VP8X'):
+        raise CarvingError('Unknown first WebP chunk')
+
+    end = start + 8 + size
+    if end > limit:
+        raise CarvingError('Truncated RIFF container')
+    return end
+
+
+# Signatures searched for by "carve()" with the extension used for carved
+# images and the function walking each image type.
+SIGNATURES = [
+    (JPEG_SIGNATURE, 'jpg', jpeg_end),
+    (PNG_SIGNATURE, 'png', png_end),
+    (RIFF_SIGNATURE, 'webp', webp_end),
+]
+
+
+def carve(buf, start=0, limit=None, signatures=None):
+    """
+    Finds complete images in a buffer.
+
+    Images are returned in the order they appear.  Carving continues after
+    the end of each found image, so images embedded in other images (like
+    EXIF thumbnails) are not returned separately.
+
+    :param buf: Buffer to search, like "bytes" or "mmap.mmap".
+    :param start: Offset to start searching from.
+    :param limit: Offset at which the data ends. Defaults to the buffer size.
+    :param signatures: Subset of "SIGNATURES" to search for.
+    :return: Generator of tuples (extension, start offset, end offset).
+    """
+    if limit is None:
+        limit = len(buf)
+    if signatures is None:
+        signatures = SIGNATURES
+
+    # Offset of the next occurrence of each signature, or -1 if there is no
+    # occurrence before the offset in "searched".  Signatures are only looked
+    # for up to the nearest candidate, so that the less common ones are not
+    # searched for within the images carved in between.
+    next_offsets = [-1] * len(signatures)
+    searched = [start] * len(signatures)
+    while True:
+        nearest = min([o for o in next_offsets if o >= 0] or [limit])
+        for i, (signature, _, _) in enumerate(signatures):
+            if next_offsets[i] < 0 and searched[i] < nearest:
+                offset = buf.find(signature, searched[i],
+                                  min(limit, nearest + len(signature) - 1))
+                if 0 <= offset < nearest:
+                    next_offsets[i] = searched[i] = nearest = offset
+                else:
+                    searched[i] = nearest
+
+        if nearest >= limit:
+            return
+
+        i = next_offsets.index(nearest)
+        signature, extension, find_end = signatures[i]
+        try:
+            end = find_end(buf, nearest, limit)
+        except CarvingError:
+            next_offsets[i] = -1
+            searched[i] = nearest + 1
+            continue
+
+        yield extension, nearest, end
+
+        # Skip past any signatures found within the carved image.
+        for j, next_offset in enumerate(next_offsets):
+            if next_offset < end:
+                next_offsets[j] = -1
+                searched[j] = max(searched[j], end)
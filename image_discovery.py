@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# image_discovery.py
+# ==================
+# Finds image files in directory trees, lazily, so that processing can
+# start before the whole tree has been walked.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Image file discovery.
+
+Directories are walked with "os.scandir()", which gets the file type of
+most entries from the directory listing itself instead of calling "stat()"
+on every one.  Files are identified either by their extension or, like
+"file --mime-type" does, by their first few bytes ("sniffing"), which finds
+images with missing or wrong extensions at the cost of opening every file.
+"""
+
+import argparse
+import os
+import sys
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp',
+                    '.tif', '.tiff']
+
+# Number of bytes read from each file when sniffing its type.
+SNIFF_SIZE = 16
+
+# Signatures at the start of image files, mapped to the canonical extension.
+MAGIC_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'BM', 'bmp'),
+]
+
+
+def image_type_from_header(header):
+    """
+    Identifies an image by its first bytes.
+
+    :param header: At least the first "SNIFF_SIZE" bytes of a file.
+    :return: The canonical extension of the image type, like "jpg", or None
+             if the header does not match any known image type.
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in MAGIC_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+def sniff_image_type(path):
+    """
+    Identifies an image by reading its first bytes.
+
+    :param path: Path to the file.
+    :return: The canonical extension of the image type, or None if the file
+             is not an image or could not be read.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            return image_type_from_header(fh.read(SNIFF_SIZE))
+    except (IOError, OSError):
+        return None
+
+
+def has_extension(path, extensions=IMAGE_EXTENSIONS):
+    """Returns True if "path" ends with any of "extensions", ignoring case."""
+    return path.lower().endswith(tuple(ext.lower() for ext in extensions))
+
+
+def walk_files(paths, recursive=True, follow_symlinks=False, onerror=None):
+    """
+    Yields the regular files among "paths" and in directories among "paths".
+
+    Directories are walked depth-first with an explicit stack, so deep
+    trees do not hit the recursion limit, and entries are yielded as soon
+    as they are read.  Yielded paths are the directory path joined with the
+    entry name, so they can be opened regardless of the working directory
+    whenever the given paths can.
+
+    :param paths: Paths to files and/or directories.
+    :param recursive: Whether to descend into sub-directories.  If False,
+                      only the immediate contents of directories are listed.
+    :param follow_symlinks: Whether to descend into symbolic links to
+                            directories.  Every directory is still only
+                            walked once, so link loops are harmless.
+    :param onerror: Optional function called with the "OSError" raised when
+                    a directory cannot be listed.  Errors are ignored by
+                    default, like "os.walk()" does.
+    """
+    visited = set()
+
+    def _visit(path):
+        if not follow_symlinks:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        key = (st.st_dev, st.st_ino)
+        if key in visited:
+            return False
+        visited.add(key)
+        return True
+
+    stack = []
+    for path in paths:
+        if os.path.isdir(path):
+            if _visit(path):
+                stack.append(path)
+        elif os.path.isfile(path):
+            yield path
+
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    subdirs = []
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                yield entry.path
+                            elif recursive and \
+                                    entry.is_dir(follow_symlinks=follow_symlinks):
+                                subdirs.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError as e:
+                if onerror is not None:
+                    onerror(e)
+                continue
+
+            # Reversed, so that sub-directories are walked in listing order.
+            for subdir in reversed(subdirs):
+                if _visit(subdir):
+                    stack.append(subdir)
+
+
+def find_images(paths, recursive=True, sniff=False,
+                extensions=IMAGE_EXTENSIONS, follow_symlinks=False,
+                onerror=None):
+    """
+    Yields image files among "paths" and in directories among "paths".
+
+    :param paths: Paths to files and/or directories.
+    :param recursive: Whether to descend into sub-directories.
+    :param sniff: Identify images by their first bytes instead of by their
+                  extensions.
+    :param extensions: Extensions of images when not sniffing.
+    :param follow_symlinks: Whether to descend into symbolic links to
+                            directories.
+    :param onerror: Optional function called with any "OSError" raised when
+                    listing directories.
+    """
+    for path in walk_files(paths, recursive, follow_symlinks, onerror):
+        if sniff:
+            if sniff_image_type(path):
+                yield path
+        elif has_extension(path, extensions):
+            yield path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Lists image files in the given files and directories.'
+    )
+    parser.add_argument(
+        dest='paths', nargs='+', metavar='PATH',
+        help='Files and/or directories to search.'
+    )
+    parser.add_argument(
+        '-n', '--no-recurse',
+        dest='recursive', action='store_false', default=True,
+        help='Only list the immediate contents of directories.'
+    )
+    parser.add_argument(
+        '-m', '--magic',
+        dest='sniff', action='store_true', default=False,
+        help='Identify images by their header bytes instead of by their '
+             'extensions.'
+    )
+    parser.add_argument(
+        '-L', '--follow-symlinks',
+        dest='follow_symlinks', action='store_true', default=False,
+        help='Descend into symbolic links to directories.'
+    )
+    parser.add_argument(
+        '-0', '--null',
+        dest='null', action='store_true', default=False,
+        help='Separate paths with NUL characters, for "xargs -0".'
+    )
+    args = parser.parse_args()
+
+    def _report(error):
+        print('{}: {}'.format(PROGRAM_NAME, error), file=sys.stderr)
+
+    terminator = '\0' if args.null else '\n'
+    try:
+        for image in find_images(args.paths, args.recursive, args.sniff,
+                                 follow_symlinks=args.follow_symlinks,
+                                 onerror=_report):
+            sys.stdout.write(image + terminator)
+    except BrokenPipeError:
+        sys.stderr.close()
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# instrumentation.py
+# ==================
+# Shared timers, counters, progress output and profiling hooks for the
+# Python tools in this repository.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Instrumentation of the hot paths of the tools.
+
+Code being measured records into the process-wide "metrics":
+
+    with instrumentation.timer('read'):
+        data = fh.read(CHUNK_SIZE)
+    instrumentation.count('bytes_read', len(data))
+    instrumentation.observe('http_latency_seconds', seconds)
+
+Timers measure the time spent in each stage of the work.  Nested timers
+are exclusive; the time spent in an inner stage is not counted in the
+outer one, so the stages add up to the total.  Time spent in several
+threads at once is added up.  Worker processes send their "state()" back
+to the parent, which "merge()"s it.
+
+Programs add the options of "add_arguments()" to their argument parser
+and run within a "Session", which prints a progress line with the rate
+and time left, profiles the program with cProfile or tracemalloc and
+writes a JSON summary of the metrics when done.
+"""
+
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Minimum number of seconds between updates of the progress line.
+PROGRESS_INTERVAL = 0.5
+
+# Minimum number of seconds between progress lines when not writing to a
+# terminal.
+PROGRESS_LOG_INTERVAL = 10.0
+
+# Number of functions or allocation sites listed by the profilers.
+PROFILE_TOP_ENTRIES = 25
+
+PROFILERS = ['cprofile', 'tracemalloc']
+
+
+def _percentile(values, point):
+    return values[min(len(values) - 1, int(round(point / 100 * len(values))))]
+
+
+class Metrics(object):
+    """
+    Thread-safe stage timers, counters and histograms of samples, like the
+    latency of every HTTP request.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = collections.Counter()
+            self.stages = collections.defaultdict(lambda: [0.0, 0])
+            self.samples = collections.defaultdict(list)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        """Adds a sample to the histogram "name"."""
+        with self._lock:
+            self.samples[name].append(value)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            totals = self.stages[stage]
+            totals[0] += seconds
+            totals[1] += calls
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Measures the time spent in "stage", excluding nested stages."""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        now = time.perf_counter()
+        if stack:
+            outer = stack[-1]
+            self.add_time(outer[0], now - outer[1], calls=0)
+        entry = [stage, now]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            self.add_time(stage, now - entry[1])
+            if stack:
+                stack[-1][1] = now
+
+    def state(self):
+        """Returns the metrics as plain, picklable data, for "merge()"."""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'stages': {k: list(v) for k, v in self.stages.items()},
+                'samples': {k: list(v) for k, v in self.samples.items()},
+            }
+
+    def merge(self, state):
+        """Adds metrics returned by "state()", I.E. of another process."""
+        with self._lock:
+            self.counters.update(state['counters'])
+            for stage, (seconds, calls) in state['stages'].items():
+                self.stages[stage][0] += seconds
+                self.stages[stage][1] += calls
+            for name, values in state['samples'].items():
+                self.samples[name].extend(values)
+
+    def summary(self):
+        """
+        :return: Dict of the elapsed wall time, counters, the seconds and
+                 number of calls of each stage, and percentiles of the
+                 histograms.
+        """
+        state = self.state()
+        histograms = {}
+        for name, values in state['samples'].items():
+            if not values:
+                continue
+            values = sorted(values)
+            histograms[name] = {
+                'count': len(values),
+                'min': values[0],
+                'mean': sum(values) / len(values),
+                'p50': _percentile(values, 50),
+                'p90': _percentile(values, 90),
+                'p99': _percentile(values, 99),
+                'max': values[-1],
+            }
+        return {
+            'elapsed_seconds': time.time() - self.started,
+            'counters': state['counters'],
+            'stages': {stage: {'seconds': seconds, 'calls': calls}
+                       for stage, (seconds, calls)
+                       in state['stages'].items()},
+            'histograms': histograms,
+        }
+
+
+# Metrics of this process.
+metrics = Metrics()
+
+
+def count(name, value=1):
+    metrics.count(name, value)
+
+
+def observe(name, value):
+    metrics.observe(name, value)
+
+
+def timer(stage):
+    return metrics.timer(stage)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60,
+                                     seconds % 60)
+
+
+class Progress(object):
+    """
+    Progress line with the amount done, the rate and the estimated time
+    left, on standard error.  Redrawn in place on a terminal, and
+    otherwise printed as separate lines now and then.
+    """
+    def __init__(self, total=None, unit='files', enabled=True, live=None,
+                 stream=None):
+        """
+        :param total: Total amount of work, if known, for the time left.
+        :param unit: Name of the unit of work.
+        :param enabled: Whether to print anything at all.
+        :param live: Whether to redraw the line in place.  Defaults to
+                     whether "stream" is a terminal.
+        :param stream: File to print to.  Defaults to standard error.
+        """
+        self.total = total
+        self.unit = unit
+        self.enabled = enabled
+        self.stream = stream or sys.stderr
+        if live is None:
+            live = self.stream.isatty()
+        self.live = live
+        self.done = 0
+        self.started = time.perf_counter()
+        self._shown = 0.0
+        self._drawn = None
+        self._lock = threading.Lock()
+
+    def format(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        parts = ['{:.0f}'.format(self.done)]
+        if self.total:
+            parts[0] += '/{:.0f}'.format(self.total)
+            parts.append('({:.0%})'.format(self.done / self.total))
+        parts[0] += ' ' + self.unit
+        parts.append('{:.1f} {}/s'.format(rate, self.unit))
+        if self.total and rate > 0:
+            parts.append('ETA {}'.format(_format_duration(
+                max(0, self.total - self.done) / rate)))
+        parts.append('elapsed {}'.format(_format_duration(elapsed)))
+        return '  '.join(parts)
+
+    def update(self, amount=1, force=False):
+        """Adds "amount" of work done and redraws the line if it is due."""
+        if not self.enabled:
+            with self._lock:
+                self.done += amount
+            return
+        with self._lock:
+            self.done += amount
+            now = time.perf_counter()
+            interval = PROGRESS_INTERVAL if self.live \
+                else PROGRESS_LOG_INTERVAL
+            if not force and now - self._shown < interval:
+                return
+            self._shown = now
+            self._draw()
+
+    def _draw(self):
+        self._drawn = self.done
+        if self.live:
+            self.stream.write('\r\x1b[K' + self.format())
+        else:
+            self.stream.write(self.format() + '\n')
+        self.stream.flush()
+
+    def print(self, *args, **kwargs):
+        """
+        Prints a message to standard output without mixing it up with the
+        progress line, which is drawn again below it.
+        """
+        with self._lock:
+            live = self.enabled and self.live
+            if live:
+                self.stream.write('\r\x1b[K')
+                self.stream.flush()
+            print(*args, **kwargs)
+            if live:
+                sys.stdout.flush()
+                self._draw()
+
+    def close(self):
+        """Draws the final line, unless it is already shown."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.live or self._drawn != self.done:
+                self._draw()
+            if self.live:
+                self.stream.write('\n')
+                self.stream.flush()
+            self.enabled = False
+
+
+def add_arguments(parser):
+    """Adds the options used by "Session" to an argument parser."""
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument(
+        '--progress',
+        dest='progress', action='store_true', default=False,
+        help='Print a progress line with the rate and time left to '
+             'standard error.'
+    )
+    group.add_argument(
+        '--metrics',
+        dest='metrics', default=None, metavar='PATH',
+        help='Write the time spent in each stage, counters and latencies '
+             'as JSON to PATH when done, or to standard error if PATH is '
+             '"-", so that it is kept apart from the output of the program.'
+    )
+    group.add_argument(
+        '--profile',
+        dest='profile', choices=PROFILERS, default=None,
+        help='Profile the main thread with cProfile, or memory allocations '
+             'with tracemalloc, and print the top entries to standard error '
+             'when done.'
+    )
+    group.add_argument(
+        '--profile-output',
+        dest='profile_output', default=None, metavar='PATH',
+        help='Write the profile to PATH instead, in the pstats format for '
+             'cProfile.'
+    )
+
+
+class Session(object):
+    """
+    Runs a program with the instrumentation selected by the options of
+    "add_arguments()".  Used as a context manager, or with "start()" and
+    "finish()" by programs that exit from several places.
+    """
+    def __init__(self, args, program):
+        """
+        :param args: Parsed arguments, with the options of
+                     "add_arguments()".
+        :param program: Name of the program, included in the summary.
+        """
+        self.program = program
+        self.show_progress = getattr(args, 'progress', False)
+        self.metrics_path = getattr(args, 'metrics', None)
+        self.profiler = getattr(args, 'profile', None)
+        self.profile_output = getattr(args, 'profile_output', None)
+        self._profile = None
+        self._progress = []
+        self._finished = False
+
+    def progress(self, total=None, unit='files', live=None):
+        """Returns a "Progress", which only prints with "--progress"."""
+        progress = Progress(total, unit, self.show_progress, live)
+        self._progress.append(progress)
+        return progress
+
+    def start(self):
+        metrics.reset()
+        if self.profiler == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif self.profiler == 'tracemalloc':
+            tracemalloc.start()
+        return self
+
+    def finish(self):
+        """Stops profiling and reports.  Only has an effect once."""
+        if self._finished:
+            return
+        self._finished = True
+        for progress in self._progress:
+            progress.close()
+        if self.profiler == 'cprofile':
+            self._profile.disable()
+            self._report_cprofile()
+        elif self.profiler == 'tracemalloc':
+            self._report_tracemalloc()
+        if self.metrics_path:
+            self._write_metrics()
+
+    def _report_cprofile(self):
+        if self.profile_output:
+            self._profile.dump_stats(self.profile_output)
+            return
+        stats = pstats.Stats(self._profile, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+
+    def _report_tracemalloc(self):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        metrics.count('tracemalloc_peak_bytes', peak)
+
+        out = io.StringIO()
+        out.write('Traced memory: {} bytes, peak {} bytes\n'.format(current,
+                                                                  peak))
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ENTRIES]:
+            out.write('{}\n'.format(stat))
+        if self.profile_output:
+            with open(self.profile_output, 'w') as fh:
+                fh.write(out.getvalue())
+        else:
+            sys.stderr.write(out.getvalue())
+
+    def _write_metrics(self):
+        summary = metrics.summary()
+        summary['program'] = self.program
+        summary['pid'] = os.getpid()
+        if self.metrics_path == '-':
+            json.dump(summary, sys.stderr, indent=2, sort_keys=True)
+            sys.stderr.write('\n')
+            sys.stderr.flush()
+            return
+        with open(self.metrics_path, 'w') as fh:
+            json.dump(summary, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.finish()
@@ -13,18 +13,42 @@
 # A proper solution to this would be to do both the preview, selection and
 # actual processing at once. But this is at least better than an all manual
 # approach for now.
+#
+# With "--review", low resolution previews of the next few videos are
+# created with ffmpeg in the background while the current video is
+# reviewed, a rotation is suggested from the MP4 metadata, and all the
+# videos are renamed at once after the review.
 
 import sys
 import os
 import argparse
+import collections
+import contextlib
+import json
+import math
+import struct
 import subprocess
 import shutil
+import signal
 import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
 
 # Video player executable to use for previewing the videos.
 VIDEO_PLAYER = 'mplayer'
 VIDEO_PLAYER_ARGS = ['-really-quiet']
 
+# Used to create low resolution copies of the videos in review mode.
+# The videos are not rotated, so that they play like the originals.
+PROXY_ENCODER = 'ffmpeg'
+PROXY_ENCODER_ARGS = ['-nostdin', '-v', 'error', '-noautorotate', '-an',
+                      '-vf', 'scale=-2:360', '-c:v', 'libx264',
+                      '-preset', 'ultrafast', '-crf', '30']
+
 parser = argparse.ArgumentParser(
     prog='interactive-video-rotation-renamer.py',
     description='Helper for renaming videos prior to rotating using other '
@@ -44,6 +68,27 @@ parser.add_argument('-v', '--verbose',
                     dest='verbose',
                     action='store_true',
                     help='Enable verbose (debug) output.')
+parser.add_argument('-r', '--review',
+                    dest='review',
+                    action='store_true',
+                    help='Prepare low resolution previews of the next videos '
+                         'in the background while the current one is '
+                         'reviewed, and rename all videos after the review. '
+                         'Previews are created with {}, if '
+                         'available.'.format(PROXY_ENCODER))
+parser.add_argument('-p', '--prefetch',
+                    dest='prefetch',
+                    type=int,
+                    default=4,
+                    metavar='N',
+                    help='Number of videos to prepare ahead in review mode. '
+                         'Defaults to %(default)s.')
+parser.add_argument('--journal',
+                    dest='journal',
+                    metavar='PATH',
+                    help='Append the renames made in review mode to this '
+                         'file, one JSON object per line.')
+instrumentation.add_arguments(parser)
 args = parser.parse_args()
 
 LOG_FORMAT = '%(asctime)s  %(levelname)-8.8s  %(message)-s'
@@ -52,13 +97,16 @@ if args.verbose:
 else:
     logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 
+session = instrumentation.Session(args, parser.prog).start()
+
 
 def exit_program(retval):
     logging.debug('Exiting')
+    session.finish()
     exit(retval)
 
 
-def prompt_for_rotation():
+def prompt_for_rotation(suggestion=None):
     prompt_options = {
         '1': {'description': 'Do not rotate (reencode only)',
               'action': 'todo_0deg_'},
@@ -83,7 +131,15 @@ def prompt_for_rotation():
         for number, option in sorted(prompt_options.items()):
             print('[{}]  {}'.format(number, option['description']))
 
-        choice = input('\nPlease input selection: ')
+        if suggestion in prompt_options:
+            print('\nSuggested from metadata: [{}]  {}'.format(
+                suggestion, prompt_options[suggestion]['description']))
+            with instrumentation.timer('prompt'):
+                choice = input('Please input selection, or press enter for '
+                               'the suggestion: ') or suggestion
+        else:
+            with instrumentation.timer('prompt'):
+                choice = input('\nPlease input selection: ')
 
         if choice in prompt_options:
             return prompt_options[choice]['action']
@@ -92,13 +148,267 @@ def prompt_for_rotation():
 
 
 def prepend_to_filename(prepend_str, filename):
-    new_name = prepend_str + filename
+    dirname, basename = os.path.split(filename)
+    new_name = os.path.join(dirname, prepend_str + basename)
     if os.path.exists(new_name):
         logging.warning('File exists: "{}" .. Skipping.'.format(new_name))
         return
 
     logging.info('Renaming "{}" to "{}" ..'.format(filename, new_name))
-    os.rename(filename, new_name)
+    with instrumentation.timer('rename'):
+        os.rename(filename, new_name)
+    instrumentation.count('renamed')
+    return new_name
+
+
+def play_video(video):
+    logging.debug('Using {p} to preview video: "{v}"'.format(p=VIDEO_PLAYER,
+                                                             v=video))
+    try:
+        cmd = [VIDEO_PLAYER] + VIDEO_PLAYER_ARGS + [video]
+        with instrumentation.timer('play'):
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        logging.error('[ERROR] {p} returned exit code {c} and the following'
+                      ' standard output:'.format(p=VIDEO_PLAYER,
+                                                 c=e.returncode))
+        for line in e.output.decode('utf-8', 'replace').splitlines():
+            logging.error(line)
+
+
+# Selections matching the rotation needed to display a video upright, in
+# degrees clockwise.
+ROTATION_SELECTIONS = {0: '1', 90: '2', 180: '5', 270: '3'}
+
+
+def _mp4_boxes(fh, start, end):
+    offset = start
+    while offset + 8 <= end:
+        fh.seek(offset)
+        size, box_type = struct.unpack('>I4s', fh.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', fh.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def read_rotation(video):
+    """
+    Reads the rotation of a MP4 video from the transformation matrix of its
+    video track, like "ffprobe" does.
+
+    Returns the number of degrees to rotate the video clockwise to display
+    it upright, or None if the file could not be read.
+    """
+    try:
+        with instrumentation.timer('read_rotation'), open(video, 'rb') as fh:
+            end = fh.seek(0, os.SEEK_END)
+            for box_type, start, stop in _mp4_boxes(fh, 0, end):
+                if box_type != b'moov':
+                    continue
+                for trak, trak_start, trak_stop in _mp4_boxes(fh, start, stop):
+                    if trak != b'trak':
+                        continue
+                    rotation = _track_rotation(fh, trak_start, trak_stop)
+                    if rotation is not None:
+                        return rotation
+    except (OSError, struct.error) as e:
+        logging.debug('Unable to read metadata of "{}": {!s}'.format(video, e))
+    return None
+
+
+def _track_rotation(fh, start, stop):
+    for box_type, box_start, _ in _mp4_boxes(fh, start, stop):
+        if box_type != b'tkhd':
+            continue
+        fh.seek(box_start)
+        version = fh.read(1)[0]
+        # Skip the flags, times, track ID and duration, the reserved fields,
+        # layer, alternate group and volume.
+        fh.seek(box_start + (24 if version == 0 else 36) + 16)
+        matrix = struct.unpack('>9i', fh.read(36))
+        width, height = struct.unpack('>II', fh.read(8))
+        if not (width and height):
+            # Audio track.
+            return None
+        a, b = matrix[0], matrix[1]
+        degrees = round(math.degrees(math.atan2(b, a)))
+        return degrees % 360
+    return None
+
+
+class EncoderProcesses(object):
+    """
+    Runs proxy encoders, keeping track of the running ones so that they can
+    be stopped when the review ends early.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._stopped = False
+
+    def run(self, cmd):
+        """
+        Runs an encoder and waits for it.
+
+        :raises OSError: The encoder could not be started, or the encoders
+                         have been stopped.
+        :raises subprocess.CalledProcessError: The encoder failed.
+        """
+        with self._lock:
+            if self._stopped:
+                raise OSError('Encoders stopped')
+            # In a process group of its own, so that it and any children
+            # can be terminated together.
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+            self._processes.add(proc)
+        try:
+            output, _ = proc.communicate()
+        finally:
+            with self._lock:
+                self._processes.discard(proc)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+
+    def stop(self):
+        """Terminates the running encoders and refuses to start more."""
+        with self._lock:
+            self._stopped = True
+            for proc in self._processes:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+
+def create_proxy(video, tempdir, encoders=None):
+    """
+    Creates a low resolution copy of a video in "tempdir", optionally with
+    the encoder run by the given "EncoderProcesses".
+
+    Returns the path to the copy, or None if it could not be created.
+    """
+    if not shutil.which(PROXY_ENCODER):
+        return None
+    fd, proxy = tempfile.mkstemp(suffix='.mp4', dir=tempdir)
+    os.close(fd)
+    cmd = [PROXY_ENCODER, '-y', '-i', video] + PROXY_ENCODER_ARGS + [proxy]
+    try:
+        with instrumentation.timer('create_proxy'):
+            (encoders or EncoderProcesses()).run(cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.debug('Unable to create preview of "{}": {!s}'.format(video,
+                                                                     e))
+        instrumentation.count('proxy_failures')
+        os.remove(proxy)
+        return None
+    instrumentation.count('proxies_created')
+    return proxy
+
+
+def prepare_preview(video, tempdir, encoders=None):
+    rotation = read_rotation(video)
+    return (create_proxy(video, tempdir, encoders),
+            ROTATION_SELECTIONS.get(rotation))
+
+
+def prepared_previews(videos, prefetch):
+    """
+    Prepares previews of videos in a pool of threads, "prefetch" videos
+    ahead of the one being reviewed.
+
+    Generator of tuples of each video, the path to its preview, or the
+    video itself if no preview could be created, and the suggested
+    selection, if any.  When closed early, queued previews are cancelled
+    and running encoders terminated instead of waited for.
+    """
+    encoders = EncoderProcesses()
+    with tempfile.TemporaryDirectory(prefix='video-rotation-') as tempdir:
+        pool = ThreadPoolExecutor(max_workers=min(prefetch,
+                                                  os.cpu_count() or 1))
+        videos = iter(videos)
+        queued = collections.deque()
+        try:
+            while True:
+                while len(queued) <= prefetch:
+                    video = next(videos, None)
+                    if video is None:
+                        break
+                    queued.append((video, pool.submit(prepare_preview, video,
+                                                      tempdir, encoders)))
+                if not queued:
+                    break
+                video, future = queued.popleft()
+                # Time spent waiting shows whether prefetching keeps up.
+                started = time.perf_counter()
+                with instrumentation.timer('wait_for_preview'):
+                    proxy, suggestion = future.result()
+                instrumentation.observe('preview_wait_seconds',
+                                        time.perf_counter() - started)
+                yield video, proxy or video, suggestion
+                if proxy:
+                    os.remove(proxy)
+        finally:
+            if queued:
+                pool.shutdown(wait=False, cancel_futures=True)
+                encoders.stop()
+            # Only waits for the terminated encoders to exit, before their
+            # files are removed with the temporary directory.
+            pool.shutdown()
+
+
+def review(videos, prefetch, journal_path=None, progress=None):
+    """
+    Prompts for the rotation of every video, playing previews prepared in
+    the background, and renames all videos when done or when quitting.
+
+    Optionally updates the "instrumentation.Progress" "progress" as videos
+    are reviewed.
+    """
+    decisions = []
+    try:
+        with contextlib.closing(prepared_previews(videos, prefetch)) as \
+                previews:
+            for video, preview, suggestion in previews:
+                choice = 'replay'
+                while choice == 'replay':
+                    play_video(preview)
+                    choice = prompt_for_rotation(suggestion)
+                if choice == 'quit':
+                    break
+                elif choice == 'skip':
+                    logging.debug('Skipping "{}" ..'.format(video))
+                else:
+                    decisions.append((video, choice))
+                    instrumentation.count('decisions')
+                if progress:
+                    progress.update(force=True)
+    except (EOFError, KeyboardInterrupt):
+        print()
+        logging.info('Review interrupted ..')
+
+    logging.info('Renaming {} videos ..'.format(len(decisions)))
+    journal = None
+    if journal_path and decisions:
+        journal = open(journal_path, 'a', encoding='utf-8')
+    try:
+        for video, choice in decisions:
+            new_name = prepend_to_filename(choice, video)
+            if new_name and journal is not None:
+                journal.write(json.dumps({'src': video, 'dst': new_name}) +
+                              '\n')
+    finally:
+        if journal is not None:
+            journal.close()
 
 
 if len(sys.argv) == 1:
@@ -114,7 +424,7 @@ if not shutil.which(cmd=VIDEO_PLAYER):
 
 mp4_files = [name for name in args.filenames if
              os.path.isfile(name) and name.endswith('.mp4')
-             and not name.startswith('todo_')]
+             and not os.path.basename(name).startswith('todo_')]
 
 if len(mp4_files) == 0:
     logging.debug('Got no files matching "!(todo_)*.mp4" ..')
@@ -125,33 +435,32 @@ for number, file in enumerate(mp4_files):
     logging.debug('[{}] "{}"'.format(number, file))
 
 
+# Progress is printed between the prompts, not redrawn in place.
+progress = session.progress(len(mp4_files), 'videos', live=False)
+
+if args.review:
+    review(mp4_files, max(1, args.prefetch), args.journal, progress)
+    exit_program(0)
+
 for video in mp4_files:
-    play_video = True
-    while play_video:
-        logging.debug('Using {p} to preview video: "{v}"'.format(p=VIDEO_PLAYER,
-                                                                 v=video))
-        try:
-            cmd = [VIDEO_PLAYER] + VIDEO_PLAYER_ARGS + [video]
-            cmd_output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            stdout = e.output
-            retval = e.returncode
-            logging.error('[ERROR] {p} returned exit code {c} and the following'
-                          ' standard output:'.format(p=VIDEO_PLAYER, c=retval))
-            logging.error(line for line in stdout)
-
-        play_video = False
+    play = True
+    while play:
+        play_video(video)
+
+        play = False
         choice = prompt_for_rotation()
 
         if choice == 'quit':
             exit_program(0)
         elif choice == 'replay':
             logging.debug('Replaying video ..')
-            play_video = True
+            play = True
         elif choice == 'skip':
             logging.debug('Skipping "{}" ..'.format(video))
             continue
         else:
             prepend_to_filename(choice, video)
+            instrumentation.count('decisions')
+    progress.update(force=True)
 
 exit_program(0)
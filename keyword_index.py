@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# keyword_index.py
+# ================
+# Persistent, incrementally updated index of the IPTC/XMP keywords of
+# images, for finding tagged images without scanning the whole library.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Keyword index of images.
+
+The directory trees are walked once with "image_discovery" and only files
+that are new or whose size or modification time changed since the last
+update are read, by a pool of exiftool processes ("exiftool_pool").
+Files that have since been removed are dropped from the index.
+
+The index is a SQLite database mapping files to keywords and keywords to
+files, so looking up the images tagged with a keyword is a single query.
+"""
+
+import argparse
+import os
+import sqlite3
+import string
+import sys
+
+import content_cache
+import exiftool_pool
+import image_discovery
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+INDEX_FILENAME = 'keyword_index.sqlite'
+
+# Tags holding keywords; IPTC "Keywords" and XMP "Subject" (dc:subject).
+KEYWORD_TAGS = ['Keywords', 'Subject']
+
+# Number of changed files written to the index per transaction.
+WRITE_BATCH_SIZE = 500
+
+# Case folding of the NOCASE collation of keywords, which only folds ASCII
+# letters.
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _keywords_from_record(record):
+    keywords = []
+    for tag in KEYWORD_TAGS:
+        value = record.get(tag)
+        if value is None:
+            continue
+        if not isinstance(value, list):
+            # A single keyword, which may itself contain commas.
+            value = [value]
+        for keyword in value:
+            keyword = str(keyword).strip()
+            if keyword and keyword not in keywords:
+                keywords.append(keyword)
+    return keywords
+
+
+class KeywordIndex(object):
+    """Maps image files to their keywords and back."""
+    def __init__(self, path):
+        """
+        :param path: Path to the SQLite database, created if missing.
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA foreign_keys=ON')
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'id INTEGER PRIMARY KEY, path TEXT UNIQUE, '
+                         'size INTEGER, mtime_ns INTEGER, generation INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS keywords ('
+                         'file_id INTEGER REFERENCES files (id) '
+                         'ON DELETE CASCADE, '
+                         'keyword TEXT COLLATE NOCASE, '
+                         'PRIMARY KEY (file_id, keyword))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS keywords_keyword '
+                         'ON keywords (keyword)')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_generation(self):
+        generation, = self._db.execute(
+            'SELECT COALESCE(MAX(generation), 0) + 1 FROM files').fetchone()
+        return generation
+
+    def _changed_files(self, paths, generation, counts):
+        """
+        Yields the paths of files that are new or changed since they were
+        indexed.  Unchanged files are marked as seen in this generation.
+        """
+        unchanged = []
+        for path in paths:
+            counts['scanned'] += 1
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            row = self._db.execute(
+                'SELECT size, mtime_ns FROM files WHERE path = ?', (path, )
+            ).fetchone()
+            if row == (st.st_size, st.st_mtime_ns):
+                unchanged.append((generation, path))
+                if len(unchanged) >= WRITE_BATCH_SIZE:
+                    self._mark_seen(unchanged)
+                    unchanged = []
+                continue
+
+            yield path, st
+        self._mark_seen(unchanged)
+
+    def _mark_seen(self, items):
+        self._db.execute('BEGIN')
+        self._db.executemany('UPDATE files SET generation = ? WHERE path = ?',
+                             items)
+        self._db.execute('COMMIT')
+
+    def _write(self, entries, generation):
+        self._db.execute('BEGIN')
+        try:
+            for path, st, keywords in entries:
+                self._db.execute('DELETE FROM files WHERE path = ?', (path, ))
+                file_id = self._db.execute(
+                    'INSERT INTO files (path, size, mtime_ns, generation) '
+                    'VALUES (?, ?, ?, ?)',
+                    (path, st.st_size, st.st_mtime_ns, generation)
+                ).lastrowid
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO keywords (file_id, keyword) '
+                    'VALUES (?, ?)', [(file_id, k) for k in keywords]
+                )
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def update(self, roots, pool, recursive=True):
+        """
+        Walks directory trees once and indexes the keywords of new and
+        changed images.  Images under "roots" that were not found are
+        removed from the index.
+
+        :param roots: Paths to directories and/or image files.
+        :param pool: "exiftool_pool.ExiftoolPool" reading the keywords.
+        :param recursive: Whether to descend into sub-directories.
+        :return: Dict with the number of files scanned, indexed, not
+                 readable by exiftool and removed.
+        """
+        roots = [os.path.abspath(root) for root in roots]
+        generation = self._next_generation()
+        counts = {'scanned': 0, 'indexed': 0, 'unreadable': 0, 'removed': 0}
+
+        paths = image_discovery.find_images(roots, recursive)
+        changed = self._changed_files(paths, generation, counts)
+        stats = {}
+
+        def _paths():
+            for path, st in changed:
+                # Overlapping roots yield some files more than once.
+                if path not in stats:
+                    stats[path] = st
+                    yield path
+
+        entries = []
+        for path, record in pool.read_metadata(_paths(), KEYWORD_TAGS):
+            st = stats.pop(path)
+            if record is None:
+                counts['unreadable'] += 1
+                # Indexed without keywords, so that it is not read again
+                # until it changes.
+                keywords = []
+            else:
+                keywords = _keywords_from_record(record)
+            entries.append((path, st, keywords))
+            counts['indexed'] += 1
+            if len(entries) >= WRITE_BATCH_SIZE:
+                self._write(entries, generation)
+                entries = []
+        self._write(entries, generation)
+
+        for root in roots:
+            prefix = root.rstrip(os.sep) + os.sep
+            removed = [
+                (file_id, ) for file_id, path in self._db.execute(
+                    'SELECT id, path FROM files WHERE generation < ? AND '
+                    '(path = ? OR substr(path, 1, ?) = ?)',
+                    (generation, root, len(prefix), prefix)
+                ).fetchall()
+                if recursive or path == root or
+                os.path.dirname(path) == root.rstrip(os.sep)
+            ]
+            self._db.execute('BEGIN')
+            self._db.executemany('DELETE FROM files WHERE id = ?', removed)
+            self._db.execute('COMMIT')
+            counts['removed'] += len(removed)
+        return counts
+
+    def files_with_keywords(self, keywords, match_all=True):
+        """
+        :param keywords: Keywords to look up, ignoring case.
+        :param match_all: Whether files must have all of the keywords, or
+                          any of them.
+        :return: Sorted list of paths to files.
+        """
+        # Duplicates ignoring case, as they only match once.
+        keywords = list({k.translate(_NOCASE): k for k in keywords}.values())
+        query = ('SELECT f.path FROM files f JOIN keywords k '
+                 'ON k.file_id = f.id WHERE k.keyword IN ({}) '
+                 'GROUP BY f.id'.format(','.join('?' * len(keywords))))
+        params = keywords
+        if match_all:
+            query += ' HAVING COUNT(DISTINCT k.keyword) = ?'
+            params = keywords + [len(keywords)]
+        return sorted(row[0] for row in self._db.execute(query, params))
+
+    def keywords_of(self, path):
+        """Returns the sorted keywords of an indexed file."""
+        return [row[0] for row in self._db.execute(
+            'SELECT k.keyword FROM keywords k JOIN files f '
+            'ON k.file_id = f.id WHERE f.path = ? ORDER BY k.keyword',
+            (os.path.abspath(path), ))]
+
+    def keyword_counts(self):
+        """Returns a list of tuples of every keyword and its number of files."""
+        return self._db.execute(
+            'SELECT keyword, COUNT(*) FROM keywords GROUP BY keyword '
+            'ORDER BY keyword').fetchall()
+
+    def tagged_files(self):
+        """Yields tuples of the path and keywords of every tagged file."""
+        rows = self._db.execute(
+            "SELECT f.path, GROUP_CONCAT(k.keyword, ', ') FROM files f "
+            "JOIN keywords k ON k.file_id = f.id GROUP BY f.id ORDER BY f.path")
+        for path, keywords in rows:
+            yield path, keywords
+
+
+def _update(index, args):
+    with exiftool_pool.ExiftoolPool(max(1, args.jobs)) as pool:
+        counts = index.update(args.paths, pool, args.recursive)
+    print('Scanned {scanned} images, indexed {indexed} new or changed '
+          '({unreadable} unreadable), removed {removed}'.format(**counts))
+    return 0
+
+
+def _search(index, args):
+    paths = index.files_with_keywords(args.keywords, not args.any)
+    for path in paths:
+        print(path)
+    return 0 if paths else 1
+
+
+def _show(index, args):
+    if not args.files:
+        for path, keywords in index.tagged_files():
+            print('{}\t{}'.format(path, keywords))
+        return 0
+    for path in args.files:
+        print('{}\t{}'.format(path, ', '.join(index.keywords_of(path))))
+    return 0
+
+
+def _keywords(index, args):
+    for keyword, count in index.keyword_counts():
+        print('{:6d}  {}'.format(count, keyword))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Maintains and queries an index of image keywords.'
+    )
+    parser.add_argument(
+        '-i', '--index',
+        dest='index', default=None, metavar='PATH',
+        help='Path to the index database.  Defaults to '
+             '"~/.cache/image-utils/{}".'.format(INDEX_FILENAME)
+    )
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    update_parser = subparsers.add_parser(
+        'update', help='Index new and changed images.',
+        description='Walks the given directories once and indexes the '
+                    'keywords of images that are new or changed since the '
+                    'last update.  Removed images are dropped.'
+    )
+    update_parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=exiftool_pool.DEFAULT_POOL_SIZE,
+        metavar='N',
+        help='Number of exiftool processes.  Defaults to the number of CPUs.'
+    )
+    update_parser.add_argument(
+        '-n', '--no-recurse',
+        dest='recursive', action='store_false', default=True,
+        help='Only index the immediate contents of directories.'
+    )
+    update_parser.add_argument(
+        dest='paths', nargs='+', metavar='PATH',
+        help='Directories and/or images to index.'
+    )
+    update_parser.set_defaults(func=_update)
+
+    search_parser = subparsers.add_parser(
+        'search', help='List images tagged with keywords.',
+        description='Lists indexed images tagged with all of the given '
+                    'keywords, ignoring case.  Exits with status 1 if none '
+                    'were found.'
+    )
+    search_parser.add_argument(
+        '-a', '--any',
+        dest='any', action='store_true', default=False,
+        help='List images tagged with any of the keywords.'
+    )
+    search_parser.add_argument(
+        dest='keywords', nargs='+', metavar='KEYWORD',
+    )
+    search_parser.set_defaults(func=_search)
+
+    show_parser = subparsers.add_parser(
+        'show', help='List keywords of images.',
+        description='Lists the keywords of the given images, or of all '
+                    'tagged images.'
+    )
+    show_parser.add_argument(
+        dest='files', nargs='*', metavar='FILE',
+    )
+    show_parser.set_defaults(func=_show)
+
+    keywords_parser = subparsers.add_parser(
+        'keywords', help='List all keywords.',
+        description='Lists all keywords and their number of images.'
+    )
+    keywords_parser.set_defaults(func=_keywords)
+
+    args = parser.parse_args()
+
+    try:
+        with KeywordIndex(args.index or
+                          content_cache.default_cache_path(INDEX_FILENAME)) \
+                as index:
+            sys.exit(args.func(index, args))
+    except exiftool_pool.ExiftoolError as e:
+        sys.exit('{}: {!s}'.format(PROGRAM_NAME, e))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
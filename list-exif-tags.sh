@@ -64,11 +64,9 @@ path=${1:-}
 [ -d "$path" ] || die "Invalid path"
 
 
-find "$path" -mindepth 0 -type d -print | while IFS= read -r dir
-do
-    [ -d "$dir" ] || continue
-    find_images_with_exif_tags "$dir"
-done | column -t -s'¤'
+# A single recursive exiftool run visits every file exactly once.  For repeated
+# lookups, see "keyword_index.py", which only reads new and changed files.
+find_images_with_exif_tags "$path" | column -t -s'¤'
 
 
 exit $?
@@ -22,29 +22,415 @@
 
 # This is me playing around with the Microsoft Vision API on a friday night.
 
-from __future__ import print_function
-
 import sys
 import os
 import json
-import urllib
 import argparse
+import collections
+import contextlib
+import io
 import logging
-import requests
-
-# Python 2.6+
-if sys.version_info[0] == 2:
-    from urllib import urlencode
-    import httplib
-
-# Python 3.x
-if sys.version_info[0] == 3:
-    from urllib.parse import urlencode
-    import http.client as httplib
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlencode, urlsplit
+import http.client as httplib
+
+import content_cache
+import exif_thumbnail
+import image_discovery
+import instrumentation
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 PROGRAM_NAME = os.path.basename(__file__)
 IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg']
 
+# Number of queued images per concurrent query.  Images are submitted as
+# they are found, so that querying starts while directories are still being
+# walked, but no more than this many are kept waiting at a time.
+QUEUED_IMAGES_PER_JOB = 4
+
+DEFAULT_ENDPOINT = \
+    'https://westus.api.cognitive.microsoft.com/vision/v1.0/describe'
+
+# Maximum number of requests per second allowed by the API pricing tiers.
+API_TIER_RATES = {
+    'free': 20 / 60.0,
+    'standard': 10.0,
+}
+
+# Requests failing with HTTP status 429 (rate limited) or 5xx are retried,
+# waiting exponentially longer between each attempt.
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+CONNECTION_TIMEOUT = 60
+
+# API responses are cached by image content, endpoint and parameters.
+CACHE_FILENAME = 'microsoft_vision.sqlite'
+DEFAULT_CACHE_TTL_DAYS = 180
+DEFAULT_CACHE_MAX_SIZE_MB = 100
+
+# Images are optionally downscaled before being uploaded. The API does not
+# make use of much more than this resolution anyway.
+DEFAULT_UPLOAD_MAX_SIZE = 1024
+DEFAULT_UPLOAD_QUALITY = 85
+
+
+class VisionAPIError(Exception):
+    """Error querying the Microsoft Vision API."""
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP(S) connections to a single host, shared by
+    several threads.  Connections are kept alive between requests, so the
+    TCP and TLS handshakes are done once per connection instead of once
+    per request.
+    """
+    def __init__(self, url, size=1):
+        parts = urlsplit(url)
+        if parts.scheme == 'https':
+            self._connection_class = httplib.HTTPSConnection
+        elif parts.scheme == 'http':
+            self._connection_class = httplib.HTTPConnection
+        else:
+            raise ValueError('Unsupported URL scheme: "{}"'.format(url))
+
+        self.host = parts.netloc
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager providing a connection from the pool.  Connections
+        are returned to the pool afterwards, unless an exception was raised.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connection_class(self.host,
+                                          timeout=CONNECTION_TIMEOUT)
+
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, shared by several threads.
+    Each call to "acquire()" takes a token, waiting for one if necessary.
+    """
+    def __init__(self, rate, capacity=1.0):
+        """
+        :param rate: Number of tokens added per second.
+        :param capacity: Maximum number of tokens, I.E. the largest burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class UploadPreprocessor(object):
+    """
+    Reduces the size of images before they are uploaded, either by using
+    the embedded EXIF thumbnail if it is large enough, or by downscaling
+    and re-encoding the image in memory.  Downscaling requires Pillow.
+    """
+    def __init__(self, max_size=None, quality=DEFAULT_UPLOAD_QUALITY,
+                 exif_thumbnail_min_size=None):
+        """
+        :param max_size: Maximum width and height of uploaded images, or
+                         None to not downscale images.
+        :param quality: JPEG quality of downscaled images.
+        :param exif_thumbnail_min_size: Upload the EXIF thumbnail instead of
+                                        the image if its width or height is
+                                        at least this, or None to never use
+                                        EXIF thumbnails.
+        """
+        if max_size and Image is None:
+            raise RuntimeError('Downscaling images requires Pillow')
+
+        self.max_size = max_size
+        self.quality = quality
+        self.exif_thumbnail_min_size = exif_thumbnail_min_size
+
+    def cache_params(self):
+        """Returns the parameters affecting the uploaded data."""
+        return self.max_size, self.quality, self.exif_thumbnail_min_size
+
+    def _exif_thumbnail(self, content):
+        try:
+            location = exif_thumbnail.find_exif_thumbnail(content)
+        except exif_thumbnail.ExifError:
+            return None
+        if location is None:
+            return None
+
+        offset, length = location
+        thumbnail = content[offset:offset + length]
+        dimensions = exif_thumbnail.jpeg_dimensions(thumbnail)
+        if dimensions and max(dimensions) >= self.exif_thumbnail_min_size:
+            return thumbnail
+        return None
+
+    def _downscale(self, content):
+        image = Image.open(io.BytesIO(content))
+        if max(image.size) <= self.max_size and image.format == 'JPEG':
+            return content
+
+        # Let the JPEG decoder do most of the downscaling.
+        image.draft('RGB', (self.max_size, self.max_size))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((self.max_size, self.max_size), Image.BICUBIC)
+
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=self.quality)
+        downscaled = out.getvalue()
+        return downscaled if len(downscaled) < len(content) else content
+
+    def process(self, content):
+        """
+        :param content: The original image data.
+        :return: Tuple of the data to upload and whether it is the EXIF
+                 thumbnail.
+        """
+        if self.exif_thumbnail_min_size:
+            thumbnail = self._exif_thumbnail(content)
+            if thumbnail:
+                return thumbnail, True
+
+        if self.max_size:
+            try:
+                return self._downscale(content), False
+            except (IOError, OSError) as e:
+                log.warning('Unable to downscale image: {!s}'.format(e))
+
+        return content, False
+
+
+class VisionClient(object):
+    """
+    Client for the Microsoft Vision API, safe to share between threads.
+
+    Requests go through a pool of persistent connections, are optionally
+    rate limited and are retried with exponential backoff when the API
+    responds with HTTP status 429 or 5xx.
+
+    Responses are optionally cached, keyed by the image content, the
+    endpoint and the query parameters.
+
+    The number of bytes read and sent and the time spent reading,
+    preprocessing and uploading images are accumulated in "stats".  The
+    counts and times are recorded in "instrumentation.metrics" as well,
+    along with the latency of every request and the number of retries.
+    """
+    def __init__(self, api_key, endpoint=DEFAULT_ENDPOINT, concurrency=1,
+                 rate=None, max_retries=MAX_RETRIES, cache=None,
+                 refresh=False, preprocessor=None):
+        """
+        :param api_key: Microsoft Vision API key.
+        :param endpoint: URL of the "describe" API endpoint.
+        :param concurrency: Number of threads that will share the client.
+        :param rate: Maximum number of requests per second, or None.
+        :param max_retries: Number of times failed requests are retried.
+        :param cache: Optional "content_cache.ContentCache" of responses.
+        :param refresh: Query the API even if the response is cached.
+        :param preprocessor: Optional "UploadPreprocessor".
+        """
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.max_retries = max_retries
+        self.cache = cache
+        self.refresh = refresh
+        self.preprocessor = preprocessor
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self.params = {
+            'maxCandidates': '1',
+        }
+        self._pool = ConnectionPool(endpoint, concurrency)
+        self._bucket = TokenBucket(rate) if rate else None
+
+    def close(self):
+        self._pool.close()
+
+    def _count(self, **values):
+        with self._stats_lock:
+            self.stats.update(values)
+        for name, value in values.items():
+            # Times are recorded by the instrumentation timers.
+            if not name.endswith('_seconds'):
+                instrumentation.count(name, value)
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.getheader('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), RETRY_MAX_DELAY)
+
+        delay = RETRY_BASE_DELAY * 2 ** attempt
+        return min(delay + random.uniform(0, delay / 2), RETRY_MAX_DELAY)
+
+    def post(self, content):
+        """
+        Queries the API with image data.
+
+        :param content: The image data.
+        :return: The API JSON data response.
+        :raises VisionAPIError: The query failed.
+        """
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Ocp-Apim-Subscription-Key': self.api_key,
+        }
+        url = '{}?{}'.format(urlsplit(self.endpoint).path,
+                             urlencode(self.params))
+
+        for attempt in range(self.max_retries + 1):
+            if self._bucket:
+                with instrumentation.timer('rate_limit'):
+                    self._bucket.acquire()
+
+            response = None
+            started = time.perf_counter()
+            try:
+                with self._pool.connection() as conn:
+                    conn.request('POST', url, content, headers)
+                    self._count(requests=1, bytes_sent=len(content))
+                    response = conn.getresponse()
+                    response_data = response.read()
+            except (httplib.HTTPException, OSError) as e:
+                error = 'Connection failed: {!s}'.format(e)
+                instrumentation.count('connection_errors')
+            else:
+                instrumentation.observe('http_latency_seconds',
+                                        time.perf_counter() - started)
+                instrumentation.count('http_status_{}'.format(
+                    response.status))
+                if 200 <= response.status < 300:
+                    try:
+                        return json.loads(response_data.decode('utf-8'))
+                    except ValueError as e:
+                        raise VisionAPIError('Invalid JSON response: '
+                                             '{!s}'.format(e))
+
+                error = 'HTTP {} {}: {}'.format(
+                    response.status, response.reason,
+                    response_data.decode('utf-8', 'replace'))
+                if response.status != 429 and response.status < 500:
+                    raise VisionAPIError(error)
+
+            if attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                log.warning('{}; retrying in {:.1f} seconds ..'.format(
+                    error, delay))
+                instrumentation.count('retries')
+                with instrumentation.timer('retry_wait'):
+                    time.sleep(delay)
+
+        raise VisionAPIError(error)
+
+    def query(self, image_file):
+        """
+        Queries the API with a given image.
+
+        :param image_file: Path to the image file used in the query.
+        :return: The API JSON data response.
+        :raises VisionAPIError: The query failed.
+        """
+        started = time.perf_counter()
+        with instrumentation.timer('read'), open(image_file, 'rb') as fh:
+            content = fh.read()
+        self._count(images=1, bytes_read=len(content),
+                    read_seconds=time.perf_counter() - started)
+
+        key = None
+        if self.cache is not None:
+            key = content_cache.content_key(
+                content, self.endpoint, sorted(self.params.items()),
+                self.preprocessor.cache_params() if self.preprocessor else None
+            )
+            if not self.refresh:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    log.debug('Using cached response for "{}"'.format(
+                        image_file))
+                    self._count(cache_hits=1)
+                    return json.loads(cached.decode('utf-8'))
+
+        if self.preprocessor:
+            started = time.perf_counter()
+            with instrumentation.timer('preprocess'):
+                content, is_thumbnail = self.preprocessor.process(content)
+            self._count(preprocess_seconds=time.perf_counter() - started,
+                        exif_thumbnails=int(is_thumbnail))
+
+        started = time.perf_counter()
+        with instrumentation.timer('upload'):
+            json_data = self.post(content)
+        self._count(upload_seconds=time.perf_counter() - started)
+
+        if key is not None:
+            self.cache.put(key, json.dumps(json_data).encode('utf-8'))
+        return json_data
+
+    def format_stats(self):
+        stats = self.stats
+        lines = [
+            'Images:       {} ({} cached responses, {} EXIF thumbnails)'.format(
+                stats['images'], stats['cache_hits'],
+                stats['exif_thumbnails']),
+            'Bytes read:   {}'.format(stats['bytes_read']),
+            'Bytes sent:   {} in {} requests'.format(stats['bytes_sent'],
+                                                     stats['requests']),
+        ]
+        for stage in ('read', 'preprocess', 'upload'):
+            seconds = stats[stage + '_seconds']
+            lines.append('{:13s} {:.3f} s total, {:.3f} s per image'.format(
+                stage.capitalize() + ':', seconds,
+                seconds / max(1, stats['images'] - stats['cache_hits'])
+                if stage != 'read' else seconds / max(1, stats['images'])))
+        return '\n'.join(lines)
+
 
 def arg_is_readable_file_or_dir(arg):
     """
@@ -69,68 +455,53 @@ def arg_is_readable_file_or_dir(arg):
     raise argparse.ArgumentTypeError('Invalid file/path: "{}"'.format(str(arg)))
 
 
-def get_images(path_list):
+def get_images(path_list, recursive=False, sniff=False):
     """
-    Takes a list of files and directories and returns files with extension
-    matching any in "IMAGE_EXTENSIONS".
-    The directories are only traversed one level, I.E. not recursively.
+    Takes a list of files and directories and yields files with extension
+    matching any in "IMAGE_EXTENSIONS", or that are identified as images by
+    their header bytes if "sniff" is True.  Files in directories are yielded
+    as they are found, joined with the directory path.
 
     :param path_list: List of paths to files and/or directories.
-    :return: Files whose extensions match those in "IMAGE_EXTENSIONS".
+    :param recursive: Whether to traverse directories recursively.
+                      Otherwise, they are only traversed one level.
+    :param sniff: Identify images by header bytes instead of extension.
+    :return: Generator of paths to images.
     """
-    out = []
-
-    for path in path_list:
-        if os.path.isdir(path):
-            _files = [f for f in os.listdir(path) if
-                      os.path.isfile(os.path.join(path, f))]
-            _images = [f for f in _files for ext in IMAGE_EXTENSIONS if
-                       f.lower().endswith(ext.lower())]
-            out += _images
-        elif os.path.isfile(path):
-            for ext in IMAGE_EXTENSIONS:
-                if path.lower().endswith(ext.lower()):
-                    out += [path]
+    def _report(error):
+        log.warning('Unable to list directory: {!s}'.format(error))
 
-    return out
+    return image_discovery.find_images(path_list, recursive, sniff,
+                                       IMAGE_EXTENSIONS, onerror=_report)
 
 
-def query_api(image_file, api_key):
+def query_api(image_file, api_key, client=None):
     """
     Queries the Microsoft Vision API with a given image.
 
     :param image_file: Path to the image file used in the query.
+    :param api_key: Microsoft Vision API key.
+    :param client: Optional "VisionClient" to reuse between queries.
     :return: The API JSON data response.
     """
     if not api_key:
         log.error('Unable to continue without an API key!')
         return False
 
-    headers = {
-        'Content-Type': 'application/octet-stream',
-        'Ocp-Apim-Subscription-Key': api_key,
-    }
+    own_client = client is None
+    if own_client:
+        client = VisionClient(api_key)
 
-    params = urlencode({
-        'maxCandidates': '1',
-    })
-
-    content = open(image_file, 'rb')
     try:
-        conn = httplib.HTTPSConnection('westus.api.cognitive.microsoft.com')
-        conn.request("POST", "/vision/v1.0/describe?%s" % params, content,
-                     headers)
-        response = conn.getresponse()
-        response_data = response.read().decode('utf-8')
-        json_data = json.loads(response_data)
-        conn.close()
-        return json_data
-
-    except Exception as e:
+        return client.query(image_file)
+    except (VisionAPIError, IOError, OSError) as e:
         log.error('[ERROR] Caught exception when querying the API;')
         if e:
             log.error(str(e))
         return False
+    finally:
+        if own_client:
+            client.close()
 
 
 def get_caption_text(json_data):
@@ -142,13 +513,16 @@ def get_caption_text(json_data):
     """
     try:
         caption = json_data['description']['captions'][0]['text']
-    except KeyError as e:
-        log.error('[ERROR] Unable to get caption text: ', str(e))
+    except (KeyError, IndexError, TypeError) as e:
+        log.error('[ERROR] Unable to get caption text: {!s}'.format(e))
     else:
         return caption
 
 
-def main(paths, api_key, dump_response=False, print_caption=True):
+def main(paths, api_key, dump_response=False, print_caption=True, jobs=1,
+         rate=None, endpoint=DEFAULT_ENDPOINT, cache=None, refresh=False,
+         preprocessor=None, print_stats=False, recursive=False, sniff=False,
+         progress=None):
     """
     Main program entry point, iterates over paths to images and queries
     the api with the specified API key.
@@ -157,39 +531,94 @@ def main(paths, api_key, dump_response=False, print_caption=True):
     :param api_key: Microsoft Vision API key.
     :param dump_response: True if the JSON data response should be printed.
     :param print_caption: True if the image caption should be printed.
+    :param jobs: Maximum number of concurrent queries.
+    :param rate: Maximum number of queries per second, or None.
+    :param endpoint: URL of the "describe" API endpoint.
+    :param cache: Optional "content_cache.ContentCache" of API responses.
+    :param refresh: Query the API even if the response is cached.
+    :param preprocessor: Optional "UploadPreprocessor".
+    :param print_stats: True if transfer and timing statistics should be
+                        printed when done.
+    :param recursive: Whether to traverse directories recursively.
+    :param sniff: Identify images by header bytes instead of extension.
+    :param progress: Optional "instrumentation.Progress", updated as
+                     queries complete.
     """
-    images = get_images(paths)
-    log.debug('Got images:')
-    for number, image in enumerate(images):
-        log.debug('[{:03d}] "{}"'.format(number, str(image)))
-
-    try:
-        log.debug('Start of processing; querying the Microsoft API ..')
-
-        for image in images:
-            log.info('Querying API with image: "{}"'.format(str(image)))
-
-            response = query_api(image, api_key)
+    images = get_images(paths, recursive, sniff)
+    if progress is None:
+        progress = instrumentation.Progress(enabled=False)
+
+    client = VisionClient(api_key, endpoint, jobs, rate, cache=cache,
+                          refresh=refresh, preprocessor=preprocessor)
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    futures = {}
+    submitted_count = 0
+    completed_count = 0
+    failed_count = 0
+
+    def _handle_completed(done):
+        nonlocal completed_count, failed_count
+        for future in done:
+            image = futures.pop(future)
+            response = future.result()
+            completed_count += 1
+            progress.update()
 
             if not response:
-                log.error('Unable to query to API')
-                sys.exit(1)
+                log.error('[{}/{}] Unable to query the API with image '
+                          '"{}"'.format(completed_count, submitted_count,
+                                        str(image)))
+                failed_count += 1
+                continue
 
-            log.info('Received query response')
+            log.info('[{}/{}] Received query response'.format(
+                completed_count, submitted_count))
 
             _image_basename = os.path.basename(image)
             if dump_response:
-                print('Response JSON data for image '
-                      '"{}":'.format(str(_image_basename)))
-                print(json.dumps(response, indent=8))
+                progress.print('Response JSON data for image '
+                               '"{}":'.format(str(_image_basename)))
+                progress.print(json.dumps(response, indent=8))
             if print_caption:
                 caption = get_caption_text(response)
                 if caption:
-                    print('"{}": {}'.format(str(_image_basename),
-                                            str(caption)))
+                    progress.print('"{}": {}'.format(str(_image_basename),
+                                                     str(caption)))
+            sys.stdout.flush()
+
+    try:
+        log.debug('Start of processing; querying the Microsoft API ..')
+
+        max_queued = jobs * QUEUED_IMAGES_PER_JOB
+        for image in images:
+            log.info('Querying API with image: "{}"'.format(str(image)))
+            futures[executor.submit(query_api, image, api_key, client)] = image
+            submitted_count += 1
+
+            if len(futures) >= max_queued:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                _handle_completed(done)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            _handle_completed(done)
 
     except KeyboardInterrupt:
+        for future in futures:
+            future.cancel()
         sys.exit('Received Keyboard Interrupt; Exiting ..')
+    finally:
+        executor.shutdown(wait=False)
+        client.close()
+
+    progress.close()
+    if print_stats:
+        print(client.format_stats(), file=sys.stderr)
+
+    if failed_count:
+        log.error('Failed to query the API with {} of {} images'.format(
+            failed_count, submitted_count))
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -202,13 +631,30 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         help='Images and/or paths to directories containing images. '
-             'Ignores all files except those whose extension matches: "{}". '
-             'Directory traversal is non-recursive.'.format(_valid_extensions),
+             'Ignores all files except those whose extension matches: "{}", '
+             'unless "--magic" is given. Directory traversal is '
+             'non-recursive unless "--recursive" is given.'.format(
+                 _valid_extensions),
         dest='input_files_or_dir',
         type=arg_is_readable_file_or_dir,
         nargs='*',
         metavar='IMAGE_PATH'
     )
+    parser.add_argument(
+        '-R', '--recursive',
+        help='Traverse directories recursively.',
+        dest='recursive',
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '-m', '--magic',
+        help='Identify images by their header bytes instead of by their '
+             'extensions.',
+        dest='sniff',
+        action='store_true',
+        default=False,
+    )
     parser.add_argument(
         '-d', '--dump',
         help='Prints all API query responses in JSON format.',
@@ -236,9 +682,116 @@ if __name__ == '__main__':
         dest='api_key',
         required=True,
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Maximum number of concurrent API queries. Defaults to 4.',
+        dest='jobs',
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        '-t', '--tier',
+        help='Limit the query rate to that allowed by the API pricing tier.',
+        dest='tier',
+        choices=sorted(API_TIER_RATES),
+        default=None,
+    )
+    parser.add_argument(
+        '-r', '--rate',
+        help='Limit the query rate to RATE queries per second. '
+             'Overrides "--tier".',
+        dest='rate',
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        '--cache',
+        help='Path to the API response cache database. Defaults to '
+             '"~/.cache/image-utils/{}".'.format(CACHE_FILENAME),
+        dest='cache_path',
+        default=None,
+    )
+    parser.add_argument(
+        '--no-cache',
+        help='Do not cache API responses.',
+        dest='use_cache',
+        action='store_false',
+        default=True,
+    )
+    parser.add_argument(
+        '--refresh',
+        help='Query the API even for images with cached responses. '
+             'The cache is updated with the new responses.',
+        dest='refresh',
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        help='Number of days cached responses are used. '
+             'Defaults to {}.'.format(DEFAULT_CACHE_TTL_DAYS),
+        dest='cache_ttl_days',
+        type=float,
+        default=DEFAULT_CACHE_TTL_DAYS,
+    )
+    parser.add_argument(
+        '--cache-max-size',
+        help='Maximum size of the cache in megabytes. Least recently used '
+             'responses are evicted first. '
+             'Defaults to {}.'.format(DEFAULT_CACHE_MAX_SIZE_MB),
+        dest='cache_max_size_mb',
+        type=float,
+        default=DEFAULT_CACHE_MAX_SIZE_MB,
+    )
+    parser.add_argument(
+        '-s', '--downscale',
+        help='Downscale images so that neither width nor height exceeds '
+             'PIXELS before uploading them. {} is plenty for captions. '
+             'Requires Pillow.'.format(DEFAULT_UPLOAD_MAX_SIZE),
+        dest='downscale',
+        type=int,
+        default=None,
+        metavar='PIXELS',
+    )
+    parser.add_argument(
+        '-q', '--quality',
+        help='JPEG quality of downscaled images. '
+             'Defaults to {}.'.format(DEFAULT_UPLOAD_QUALITY),
+        dest='quality',
+        type=int,
+        default=DEFAULT_UPLOAD_QUALITY,
+    )
+    parser.add_argument(
+        '--exif-thumbnail',
+        help='Upload the embedded EXIF thumbnail instead of the image if its '
+             'width or height is at least PIXELS.',
+        dest='exif_thumbnail_min_size',
+        type=int,
+        default=None,
+        metavar='PIXELS',
+    )
+    parser.add_argument(
+        '--stats',
+        help='Print the number of bytes read and sent and the time spent '
+             'reading, preprocessing and uploading images.',
+        dest='print_stats',
+        action='store_true',
+        default=False,
+    )
+    parser.add_argument(
+        '--endpoint',
+        help='URL of the API "describe" endpoint. '
+             'Defaults to "{}".'.format(DEFAULT_ENDPOINT),
+        dest='endpoint',
+        default=DEFAULT_ENDPOINT,
+    )
+    instrumentation.add_arguments(parser)
 
     args = parser.parse_args()
 
+    if args.downscale and Image is None:
+        parser.error('"--downscale" requires Pillow to be installed')
+
     if args.verbose:
         log_format = '{} %(asctime)s %(levelname)-8.8s %(funcName)-25.25s' \
                      '(%(lineno)3d) %(message)s'.format(PROGRAM_NAME)
@@ -256,4 +809,30 @@ if __name__ == '__main__':
         log.info('No images specified. Use "--help" for usage information')
         sys.exit(0)
 
-    main(args.input_files_or_dir, args.api_key, args.dump, args.dump_caption)
+    rate = args.rate
+    if rate is None and args.tier:
+        rate = API_TIER_RATES[args.tier]
+
+    cache = None
+    if args.use_cache:
+        cache = content_cache.ContentCache(
+            args.cache_path or content_cache.default_cache_path(CACHE_FILENAME),
+            ttl=args.cache_ttl_days * 24 * 3600,
+            max_size=int(args.cache_max_size_mb * 1024 * 1024)
+        )
+
+    preprocessor = None
+    if args.downscale or args.exif_thumbnail_min_size:
+        preprocessor = UploadPreprocessor(args.downscale, args.quality,
+                                          args.exif_thumbnail_min_size)
+
+    try:
+        with instrumentation.Session(args, PROGRAM_NAME) as session:
+            main(args.input_files_or_dir, args.api_key, args.dump,
+                 args.dump_caption, max(1, args.jobs), rate, args.endpoint,
+                 cache, args.refresh, preprocessor, args.print_stats,
+                 args.recursive, args.sniff,
+                 session.progress(unit='images'))
+    finally:
+        if cache:
+            cache.close()
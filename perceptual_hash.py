@@ -0,0 +1,750 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# perceptual_hash.py
+# ==================
+# Persistent index of perceptual hashes of images, for finding copies of
+# the same photo at different sizes and qualities.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Near-duplicate detection with perceptual hashes.
+
+Every image is reduced to two 64-bit hashes, a difference hash ("dHash")
+and a DCT hash ("pHash"), computed the same way as the "imagehash"
+library.  Resized and recompressed copies of a photo get hashes that
+differ in only a few bits, so near-duplicates are images whose hashes are
+within a small Hamming distance of each other.
+
+JPEG images with an embedded EXIF thumbnail are hashed from the thumbnail,
+which is read along with the file header, so the full image is never
+decoded.  Other JPEG images are decoded at a reduced scale.  The hashes are
+computed with NumPy if it is available, and in pure Python otherwise.
+
+The hashes are kept in a SQLite database that is updated incrementally,
+like "keyword_index".  Near-duplicates are found with multi-index
+hashing: the 64 bits are split into parts, and by the pigeonhole
+principle, hashes within the distance of each other are equal in some of
+the parts.  Only hashes that are equal in those parts are compared, instead
+of all pairs.
+"""
+
+import argparse
+import collections
+import io
+import itertools
+import math
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import content_cache
+import exif_thumbnail
+import image_discovery
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+INDEX_FILENAME = 'perceptual_hash.sqlite'
+
+HASH_NAMES = ['dhash', 'phash']
+HASH_BITS = 64
+
+# Maximum Hamming distance between near-duplicates, by default.
+DEFAULT_DISTANCE = 4
+
+# Size of the image the DCT hash is computed from, and the number of low
+# frequencies kept in each direction.
+PHASH_SIZE = 32
+PHASH_LOW_FREQUENCIES = 8
+
+# Runs of hashes equal in two parts that are longer than this are split
+# on the rest of the bits instead of comparing every pair.
+RUN_COMPARE_LIMIT = 64
+
+# Number of changed files written to the index per transaction.
+WRITE_BATCH_SIZE = 500
+
+# Number of images passed to a worker process at a time.
+CHUNK_SIZE = 16
+
+# Number of batches of images queued per worker process.
+QUEUED_BATCHES_PER_JOB = 4
+
+# Basis of the DCT-II, one row per frequency.
+_DCT_BASIS = [[math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SIZE))
+               for x in range(PHASH_SIZE)]
+              for u in range(PHASH_LOW_FREQUENCIES)]
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bool(bit)
+    return value
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def dhash(image):
+    """
+    Returns the 64-bit difference hash of a Pillow image: whether each
+    pixel of a 9x8 grayscale copy is brighter than its left neighbour.
+    """
+    pixels = image.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+    if numpy is not None:
+        pixels = numpy.frombuffer(pixels, dtype=numpy.uint8).reshape(8, 9)
+        diff = pixels[:, 1:] > pixels[:, :-1]
+        return int.from_bytes(numpy.packbits(diff).tobytes(), 'big')
+    return _bits_to_int(pixels[row * 9 + col + 1] > pixels[row * 9 + col]
+                        for row in range(8) for col in range(8))
+
+
+def phash(image):
+    """
+    Returns the 64-bit DCT hash of a Pillow image: whether each of the
+    8x8 lowest frequencies of the DCT of a 32x32 grayscale copy is above
+    their median.
+    """
+    pixels = image.convert('L').resize((PHASH_SIZE, PHASH_SIZE),
+                                       Image.LANCZOS).tobytes()
+    if numpy is not None:
+        basis = numpy.array(_DCT_BASIS)
+        pixels = numpy.frombuffer(pixels, dtype=numpy.uint8).reshape(
+            PHASH_SIZE, PHASH_SIZE).astype(numpy.float64)
+        low = basis @ pixels @ basis.T
+        diff = low > numpy.median(low)
+        return int.from_bytes(numpy.packbits(diff).tobytes(), 'big')
+
+    rows = [pixels[y * PHASH_SIZE:(y + 1) * PHASH_SIZE]
+            for y in range(PHASH_SIZE)]
+    # DCT of the rows, then of the columns, keeping the low frequencies.
+    row_dct = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT_BASIS]
+               for row in rows]
+    low = [sum(basis[y] * row_dct[y][u] for y in range(PHASH_SIZE))
+           for basis in _DCT_BASIS
+           for u in range(PHASH_LOW_FREQUENCIES)]
+    median = _median(low)
+    return _bits_to_int(value > median for value in low)
+
+
+def load_image(path, use_thumbnail=True):
+    """
+    Opens an image for hashing, preferring the EXIF thumbnail of JPEG
+    images.  Only as much of the image as needed is decoded.
+
+    :raises OSError: The image could not be read.
+    :raises ValueError: The image could not be decoded.
+    """
+    with open(path, 'rb') as fh:
+        header = fh.read(exif_thumbnail.HEADER_READ_SIZE)
+
+    if use_thumbnail and \
+            image_discovery.image_type_from_header(header) == 'jpg':
+        try:
+            location = exif_thumbnail.find_exif_thumbnail(header)
+        except exif_thumbnail.ExifError:
+            location = None
+        if location is not None:
+            offset, length = location
+            try:
+                image = Image.open(io.BytesIO(header[offset:offset + length]))
+                image.load()
+                return image
+            except (OSError, ValueError):
+                # Fall back to the full image.
+                pass
+
+    image = Image.open(path)
+    # Only has an effect on JPEG images, which are then decoded at 1/2,
+    # 1/4 or 1/8 of their size.
+    image.draft('L', (PHASH_SIZE * 2, PHASH_SIZE * 2))
+    image.load()
+    return image
+
+
+def hash_image(path, use_thumbnail=True):
+    """
+    :return: Tuple of the difference hash and DCT hash of an image, or
+             None if it could not be read.
+    """
+    try:
+        image = load_image(path, use_thumbnail)
+        return dhash(image), phash(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def _hash_images(paths, use_thumbnail):
+    return [hash_image(path, use_thumbnail) for path in paths]
+
+
+def hamming_distance(a, b):
+    """Returns the number of bits that differ between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit.
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) \
+        else value
+
+
+def _to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def _part_masks(parts, bits):
+    return [((1 << (bits * (i + 1) // parts)) - 1) ^
+            ((1 << (bits * i // parts)) - 1) for i in range(parts)]
+
+
+class MultiIndexHash(object):
+    """
+    Finds hashes within a Hamming distance of each other without comparing
+    every pair.
+
+    Hashes within the distance "d" of each other differ in at most "d" of
+    any "d + 2" parts of the hashes, so they are equal in at least two
+    parts.  Pairs are found by sorting the hashes on every combination of
+    two parts and only comparing hashes that are equal in those parts.
+    Long runs of hashes equal in two parts are split the same way, on one
+    of "d + 1" parts of the rest of the bits.  Single queries instead look
+    up hashes equal in one of "d + 1" parts, in tables built on the first
+    query.
+
+    Identical hashes are all within the distance of each other, so they
+    are better added once; see "group_duplicates()".
+    """
+    def __init__(self, distance=DEFAULT_DISTANCE, bits=HASH_BITS):
+        """
+        :param distance: Maximum Hamming distance of queries.
+        :param bits: Number of bits of the hashes.
+        """
+        if not 0 <= distance < bits:
+            raise ValueError('Distance must be between 0 and {}'.format(
+                bits - 1))
+        self.distance = distance
+        self.bits = bits
+        self._masks = _part_masks(min(distance + 2, bits), bits)
+        self._query_masks = _part_masks(distance + 1, bits)
+        self._tables = None
+        self._hashes = []
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, value):
+        """
+        Adds a hash.
+
+        :return: Its number, used to refer to it in results.
+        """
+        self._hashes.append(value)
+        if self._tables is not None:
+            self._add_to_tables(len(self._hashes) - 1)
+        return len(self._hashes) - 1
+
+    def _add_to_tables(self, number):
+        value = self._hashes[number]
+        for mask, table in zip(self._query_masks, self._tables):
+            table[value & mask].append(number)
+
+    def query(self, value):
+        """
+        :return: List of tuples of the distance and number of every added
+                 hash within the distance of "value", nearest first.
+        """
+        if self._tables is None:
+            self._tables = [collections.defaultdict(list)
+                            for _ in self._query_masks]
+            for number in range(len(self._hashes)):
+                self._add_to_tables(number)
+
+        matches = {}
+        for mask, table in zip(self._query_masks, self._tables):
+            for number in table.get(value & mask, ()):
+                if number not in matches:
+                    matches[number] = hamming_distance(
+                        value, self._hashes[number])
+        return sorted((distance, number)
+                      for number, distance in matches.items()
+                      if distance <= self.distance)
+
+    def _runs(self, mask):
+        """Yields lists of the numbers of hashes equal under "mask"."""
+        if numpy is not None:
+            keys = numpy.array(self._hashes, dtype=numpy.uint64) & \
+                numpy.uint64(mask)
+            order = numpy.argsort(keys, kind='stable')
+            keys = keys[order]
+            starts = numpy.flatnonzero(keys[1:] != keys[:-1]) + 1
+            bounds = numpy.concatenate(([0], starts, [len(keys)]))
+            for i in numpy.flatnonzero(numpy.diff(bounds) > 1):
+                yield order[bounds[i]:bounds[i + 1]].tolist()
+            return
+
+        keys = [value & mask for value in self._hashes]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        run = []
+        for number in order:
+            if run and keys[run[0]] != keys[number]:
+                if len(run) > 1:
+                    yield run
+                run = []
+            run.append(number)
+        if len(run) > 1:
+            yield run
+
+    def _rest_masks(self, mask):
+        # Splits the bits not in "mask" into "d + 1" parts.
+        positions = [bit for bit in range(self.bits) if not mask >> bit & 1]
+        parts = self.distance + 1
+        masks = []
+        for i in range(parts):
+            part = 0
+            for bit in positions[len(positions) * i // parts:
+                                 len(positions) * (i + 1) // parts]:
+                part |= 1 << bit
+            masks.append(part)
+        return masks
+
+    def _run_candidates(self, run, mask):
+        """Yields the pairs of hashes in a run that may be within the
+        distance, each once."""
+        if len(run) <= RUN_COMPARE_LIMIT:
+            for j, a in enumerate(run):
+                for b in run[j + 1:]:
+                    yield a, b
+            return
+
+        hashes = self._hashes
+        rest_masks = self._rest_masks(mask)
+        for i, rest_mask in enumerate(rest_masks):
+            buckets = collections.defaultdict(list)
+            for number in run:
+                buckets[hashes[number] & rest_mask].append(number)
+            for bucket in buckets.values():
+                for j, a in enumerate(bucket):
+                    for b in bucket[j + 1:]:
+                        # Only from the first part where they are equal.
+                        diff = hashes[a] ^ hashes[b]
+                        if all(diff & m for m in rest_masks[:i]):
+                            yield a, b
+
+    def pairs(self, skip_run=None):
+        """
+        Yields tuples of the numbers of all hashes within the distance.
+
+        :param skip_run: Optional function called with the numbers of the
+                         hashes of each run that are compared, returning
+                         True if their pairs are not needed, E.G. because
+                         they are already known to be in the same group.
+        """
+        hashes, masks = self._hashes, self._masks
+        matching = len(masks) - self.distance
+        for combination in itertools.combinations(range(len(masks)),
+                                                  matching):
+            mask = 0
+            for i in combination:
+                mask |= masks[i]
+            for run in self._runs(mask):
+                if skip_run is not None and skip_run(run):
+                    continue
+                for a, b in self._run_candidates(run, mask):
+                    diff = hashes[a] ^ hashes[b]
+                    if bin(diff).count('1') > self.distance:
+                        continue
+                    # Report every pair once, from the first combination
+                    # of parts where the hashes are equal.
+                    first = tuple(i for i, m in enumerate(masks)
+                                  if not diff & m)[:matching]
+                    if first == combination:
+                        yield a, b
+
+
+def group_duplicates(items, distance=DEFAULT_DISTANCE):
+    """
+    Groups near-duplicates.  Images are in the same group if they are
+    connected by a chain of hashes within the distance of each other.
+
+    :param items: List of tuples of any identifier and hash.
+    :param distance: Maximum Hamming distance between near-duplicates.
+    :return: List of lists of the identifiers in each group of more than
+             one image.
+    """
+    # Exact copies are common, and are grouped without comparing them.
+    identifiers = collections.defaultdict(list)
+    for identifier, value in items:
+        identifiers[value].append(identifier)
+    values = list(identifiers)
+
+    index = MultiIndexHash(distance)
+    for value in values:
+        index.add(value)
+
+    parents = list(range(len(values)))
+
+    def _root(number):
+        while parents[number] != number:
+            parents[number] = parents[parents[number]]
+            number = parents[number]
+        return number
+
+    def _grouped(run):
+        root = _root(run[0])
+        return all(_root(number) == root for number in run)
+
+    for a, b in index.pairs(_grouped):
+        root_a, root_b = _root(a), _root(b)
+        if root_a != root_b:
+            parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = collections.defaultdict(list)
+    for number, value in enumerate(values):
+        groups[_root(number)].extend(identifiers[value])
+    return [group for group in groups.values() if len(group) > 1]
+
+
+class HashIndex(object):
+    """Maps image files to their perceptual hashes."""
+    def __init__(self, path):
+        """
+        :param path: Path to the SQLite database, created if missing.
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'path TEXT PRIMARY KEY, size INTEGER, '
+                         'mtime_ns INTEGER, generation INTEGER, '
+                         'dhash INTEGER, phash INTEGER)')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_generation(self):
+        generation, = self._db.execute(
+            'SELECT COALESCE(MAX(generation), 0) + 1 FROM files').fetchone()
+        return generation
+
+    def _changed_files(self, paths, generation, counts):
+        """
+        Yields the paths of files that are new or changed since they were
+        indexed.  Unchanged files are marked as seen in this generation.
+        """
+        unchanged = []
+        for path in paths:
+            counts['scanned'] += 1
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            row = self._db.execute(
+                'SELECT size, mtime_ns FROM files WHERE path = ?', (path, )
+            ).fetchone()
+            if row == (st.st_size, st.st_mtime_ns):
+                unchanged.append((generation, path))
+                if len(unchanged) >= WRITE_BATCH_SIZE:
+                    self._mark_seen(unchanged)
+                    unchanged = []
+                continue
+
+            yield path, st
+        self._mark_seen(unchanged)
+
+    def _mark_seen(self, items):
+        self._db.execute('BEGIN')
+        self._db.executemany('UPDATE files SET generation = ? WHERE path = ?',
+                             items)
+        self._db.execute('COMMIT')
+
+    def _write(self, entries):
+        self._db.execute('BEGIN')
+        self._db.executemany(
+            'INSERT OR REPLACE INTO files '
+            '(path, size, mtime_ns, generation, dhash, phash) '
+            'VALUES (?, ?, ?, ?, ?, ?)', entries)
+        self._db.execute('COMMIT')
+
+    def update(self, roots, jobs=1, recursive=True, use_thumbnails=True):
+        """
+        Walks directory trees once and hashes new and changed images in a
+        pool of processes.  Images under "roots" that were not found are
+        removed from the index.
+
+        :param roots: Paths to directories and/or image files.
+        :param jobs: Number of worker processes.
+        :param recursive: Whether to descend into sub-directories.
+        :param use_thumbnails: Whether to hash EXIF thumbnails of JPEG
+                               images instead of the images.
+        :return: Dict with the number of files scanned, hashed, not
+                 readable and removed.
+        """
+        roots = [os.path.abspath(root) for root in roots]
+        generation = self._next_generation()
+        counts = {'scanned': 0, 'hashed': 0, 'unreadable': 0, 'removed': 0}
+
+        paths = image_discovery.find_images(roots, recursive)
+        changed = self._changed_files(paths, generation, counts)
+        stats = {}
+
+        def _batches():
+            batch = []
+            for path, st in changed:
+                # Overlapping roots yield some files more than once.
+                if path in stats:
+                    continue
+                stats[path] = st
+                batch.append(path)
+                if len(batch) >= CHUNK_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def _results():
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                queued = collections.deque()
+                for batch in _batches():
+                    queued.append((batch, executor.submit(
+                        _hash_images, batch, use_thumbnails)))
+                    if len(queued) >= jobs * QUEUED_BATCHES_PER_JOB:
+                        batch, future = queued.popleft()
+                        yield from zip(batch, future.result())
+                while queued:
+                    batch, future = queued.popleft()
+                    yield from zip(batch, future.result())
+
+        entries = []
+        for path, hashes in _results():
+            st = stats.pop(path)
+            if hashes is None:
+                counts['unreadable'] += 1
+                # Indexed without hashes, so that it is not read again
+                # until it changes.
+                hashes = (None, None)
+            else:
+                hashes = tuple(_to_signed(h) for h in hashes)
+            entries.append((path, st.st_size, st.st_mtime_ns, generation) +
+                           hashes)
+            counts['hashed'] += 1
+            if len(entries) >= WRITE_BATCH_SIZE:
+                self._write(entries)
+                entries = []
+        self._write(entries)
+
+        for root in roots:
+            prefix = root.rstrip(os.sep) + os.sep
+            removed = [
+                (path, ) for path, in self._db.execute(
+                    'SELECT path FROM files WHERE generation < ? AND '
+                    '(path = ? OR substr(path, 1, ?) = ?)',
+                    (generation, root, len(prefix), prefix)
+                ).fetchall()
+                if recursive or path == root or
+                os.path.dirname(path) == root.rstrip(os.sep)
+            ]
+            self._db.execute('BEGIN')
+            self._db.executemany('DELETE FROM files WHERE path = ?', removed)
+            self._db.execute('COMMIT')
+            counts['removed'] += len(removed)
+        return counts
+
+    def hashes(self, name='dhash'):
+        """
+        :param name: Name of the hash, one of "HASH_NAMES".
+        :return: List of tuples of the path and hash of every hashed image.
+        """
+        if name not in HASH_NAMES:
+            raise ValueError('Unknown hash "{}"'.format(name))
+        rows = self._db.execute(
+            'SELECT path, {0} FROM files WHERE {0} IS NOT NULL '
+            'ORDER BY path'.format(name))
+        return [(path, _to_unsigned(value)) for path, value in rows]
+
+    def sizes(self, paths):
+        """Returns a dict of the indexed file sizes of the given paths."""
+        sizes = {}
+        for path in paths:
+            row = self._db.execute('SELECT size FROM files WHERE path = ?',
+                                   (path, )).fetchone()
+            sizes[path] = row[0] if row else 0
+        return sizes
+
+
+def _update(index, args):
+    counts = index.update(args.paths, max(1, args.jobs), args.recursive,
+                          args.thumbnails)
+    print('Scanned {scanned} images, hashed {hashed} new or changed '
+          '({unreadable} unreadable), removed {removed}'.format(**counts))
+    return 0
+
+
+def _groups(index, args):
+    groups = group_duplicates(index.hashes(args.hash), args.distance)
+    for number, group in enumerate(groups):
+        sizes = index.sizes(group)
+        if number:
+            print()
+        # Largest first, as it is usually the original.
+        for path in sorted(group, key=lambda p: (-sizes[p], p)):
+            print(path)
+    print('{}: Found {} groups of {} images'.format(
+        PROGRAM_NAME, len(groups), sum(len(g) for g in groups)),
+        file=sys.stderr)
+    return 0 if groups else 1
+
+
+def _query(index, args):
+    items = index.hashes(args.hash)
+    table = MultiIndexHash(args.distance)
+    for _, value in items:
+        table.add(value)
+
+    found = False
+    for path in args.files:
+        hashes = hash_image(path, args.thumbnails)
+        if hashes is None:
+            print('{}: Unable to read "{}"'.format(PROGRAM_NAME, path),
+                  file=sys.stderr)
+            continue
+        value = hashes[HASH_NAMES.index(args.hash)]
+        for distance, number in table.query(value):
+            match = items[number][0]
+            if match != os.path.abspath(path):
+                print('{}\t{}\t{}'.format(path, distance, match))
+                found = True
+    return 0 if found else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Maintains an index of perceptual hashes of images and '
+                    'finds near-duplicates, like resized or recompressed '
+                    'copies of the same photo.'
+    )
+    parser.add_argument(
+        '-i', '--index',
+        dest='index', default=None, metavar='PATH',
+        help='Path to the index database.  Defaults to '
+             '"~/.cache/image-utils/{}".'.format(INDEX_FILENAME)
+    )
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    update_parser = subparsers.add_parser(
+        'update', help='Hash new and changed images.',
+        description='Walks the given directories once and hashes images '
+                    'that are new or changed since the last update.  '
+                    'Removed images are dropped.'
+    )
+    update_parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+        help='Number of worker processes.  Defaults to the number of CPUs.'
+    )
+    update_parser.add_argument(
+        '-n', '--no-recurse',
+        dest='recursive', action='store_false', default=True,
+        help='Only index the immediate contents of directories.'
+    )
+    update_parser.add_argument(
+        dest='paths', nargs='+', metavar='PATH',
+        help='Directories and/or images to index.'
+    )
+    update_parser.set_defaults(func=_update)
+
+    groups_parser = subparsers.add_parser(
+        'groups', help='List groups of near-duplicate images.',
+        description='Lists groups of indexed near-duplicate images, largest '
+                    'file first, separated by empty lines.  Exits with '
+                    'status 1 if none were found.'
+    )
+    groups_parser.set_defaults(func=_groups)
+
+    query_parser = subparsers.add_parser(
+        'query', help='List indexed near-duplicates of images.',
+        description='Lists indexed near-duplicates of the given images, '
+                    'which do not have to be indexed, as tab-separated '
+                    'image, distance and near-duplicate.  Exits with status '
+                    '1 if none were found.'
+    )
+    query_parser.add_argument(
+        dest='files', nargs='+', metavar='FILE',
+    )
+    query_parser.set_defaults(func=_query)
+
+    for subparser in (update_parser, query_parser):
+        subparser.add_argument(
+            '--no-thumbnails',
+            dest='thumbnails', action='store_false', default=True,
+            help='Hash the full images, instead of their EXIF thumbnails.'
+        )
+    for subparser in (groups_parser, query_parser):
+        subparser.add_argument(
+            '-d', '--distance',
+            dest='distance', type=int, default=DEFAULT_DISTANCE, metavar='N',
+            help='Maximum number of differing bits between near-duplicates. '
+                 ' Defaults to %(default)s.'
+        )
+        subparser.add_argument(
+            '--hash',
+            dest='hash', choices=HASH_NAMES, default=HASH_NAMES[0],
+            help='Hash to compare.  Defaults to %(default)s.'
+        )
+
+    args = parser.parse_args()
+
+    if Image is None:
+        sys.exit('[ERROR] Pillow is not available on this system.\n'
+                 '        Please install Pillow before running this script.')
+    if getattr(args, 'distance', 0) not in range(HASH_BITS):
+        parser.error('Distance must be between 0 and {}'.format(HASH_BITS - 1))
+
+    try:
+        with HashIndex(args.index or
+                       content_cache.default_cache_path(INDEX_FILENAME)) \
+                as index:
+            sys.exit(args.func(index, args))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
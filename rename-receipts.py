@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# rename-receipts.py
+# ==================
+# Renames scanned receipts after the date, store and total price read from
+# them with OCR.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+"""
+Replacement for "rename-receipts.sh".
+
+Images are read by a pool of worker processes, each of which loads the
+OCR engine once and keeps it for the whole batch.  With "tesserocr", the
+Tesseract library is called directly; otherwise "pytesseract" runs the
+"tesseract" program for every image.
+
+The rules for finding the date, store and total price are read from a
+JSON file, "receipt_rules.json" by default.  The rules of each category
+are compiled into a single regular expression, so each category is found
+in one pass over the text.  Rules are tried in the order they are listed;
+a match of an earlier rule anywhere in the text wins over later rules.
+
+The OCR text of every receipt is cached, keyed by the image content, so
+receipts are only read once.  After changing the rules, they can be
+applied to already renamed receipts again with "--rematch-only", which
+never runs OCR.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+import content_cache
+import image_discovery
+
+PROGRAM_NAME = os.path.basename(__file__)
+
+DEFAULT_RULES_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'receipt_rules.json'
+)
+
+# Tesseract language of the receipts.
+DEFAULT_LANGUAGE = 'swe'
+
+UNKNOWN_DATE = 'UNKNOWN_DATE'
+UNKNOWN_STORE = 'UNKNOWN_STORE'
+UNKNOWN_PRICE = 'UNKNOWN_PRICE'
+
+# OCR text is cached by image content and language.
+CACHE_FILENAME = 'rename_receipts_ocr.sqlite'
+DEFAULT_CACHE_MAX_SIZE_MB = 50
+
+# Part of every cache key.  Incremented whenever the OCR changes, so that
+# texts read by earlier versions are not used.
+OCR_VERSION = 1
+
+
+class RuleError(Exception):
+    """The rules file is missing or invalid."""
+
+
+class Matcher(object):
+    """
+    Rules of one category, compiled into a single regular expression with
+    one named group per rule.  Rules must not use numbered backreferences,
+    as the groups are renumbered.
+    """
+    def __init__(self, patterns):
+        """
+        :param patterns: Regular expressions, in order of priority.
+        :raises RuleError: A pattern is not a valid regular expression.
+        """
+        alternatives = []
+        for i, pattern in enumerate(patterns):
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise RuleError('Invalid pattern "{}": {!s}'.format(pattern,
+                                                                    e))
+            alternatives.append('(?P<r{}>{})'.format(i, pattern))
+        self.regex = re.compile('|'.join(alternatives) or '(?!)',
+                                re.MULTILINE)
+
+    def match(self, text):
+        """
+        Finds the matching rule listed first.  Every position in the text
+        is tried once, where the alternatives are tried in order, so this
+        is the same as trying each rule over the whole text in turn.
+
+        Like "grep", rules are matched within single lines, so that
+        patterns like "[^0-9]*" never join text from different lines.
+
+        :return: Tuple of the index of the rule and the matched text, or
+                 None if no rule matches.
+        """
+        best = None
+        for line in text.split('\n'):
+            pos = 0
+            match = self.regex.search(line, pos)
+            while match is not None:
+                index = int(match.lastgroup[1:])
+                if best is None or index < best[0]:
+                    best = (index, match.group())
+                    if index == 0:
+                        return best
+                pos = match.start() + 1
+                match = self.regex.search(line, pos)
+        return best
+
+
+class ReceiptRules(object):
+    """Finds the date, store and total price in the text of receipts."""
+    def __init__(self, config):
+        """
+        :param config: Dict with the lists "dates", "stores" and "prices"
+                       of rules, see "receipt_rules.json".
+        :raises RuleError: The rules are invalid.
+        """
+        try:
+            dates = config.get('dates', [])
+            stores = config.get('stores', [])
+            prices = config.get('prices', [])
+            self.date_has_time = [bool(r.get('time')) for r in dates]
+            self.store_names = [r['name'] for r in stores]
+            self.dates = Matcher([r['pattern'] for r in dates])
+            self.stores = Matcher([r['pattern'] for r in stores])
+            self.prices = Matcher([r['pattern'] for r in prices])
+        except (AttributeError, KeyError, TypeError) as e:
+            raise RuleError('Invalid rules: {!r}'.format(e))
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                return cls(json.load(fh))
+        except (OSError, ValueError) as e:
+            raise RuleError('Unable to read rules "{}": {!s}'.format(path, e))
+
+    def find_date(self, text):
+        """
+        :return: The date like "2017-03-31T215735", with "hhmmss" in place
+                 of the time if not found, or None.
+        """
+        found = self.dates.match(text)
+        if found is None:
+            return None
+        index, matched = found
+        digits = re.sub(r'[^0-9]', '', matched)
+        date = '{}-{}-{}'.format(digits[:4], digits[4:6], digits[6:8])
+        if self.date_has_time[index]:
+            return '{}T{}'.format(date, digits[8:14])
+        return date + 'Thhmmss'
+
+    def find_store(self, text):
+        found = self.stores.match(text)
+        return self.store_names[found[0]] if found else None
+
+    def find_price(self, text):
+        """:return: The total price like "123.50", or None."""
+        found = self.prices.match(text)
+        if found is None:
+            return None
+        price = re.sub(r'[^0-9.,]', '', found[1]).replace(',', '.')
+        return price or None
+
+    def new_name(self, text, extension):
+        """
+        :return: The new file name, like
+                 "2017-03-31T215735 ICA Kvantum - 123.50kr.jpg".
+        """
+        price = self.find_price(text)
+        return '{} {} - {}.{}'.format(
+            self.find_date(text) or UNKNOWN_DATE,
+            self.find_store(text) or UNKNOWN_STORE,
+            price + 'kr' if price else UNKNOWN_PRICE,
+            extension
+        )
+
+
+class OCREngine(object):
+    """Reads the text of images with Tesseract."""
+    def __init__(self, language=DEFAULT_LANGUAGE):
+        self.language = language
+        self._api = None
+        if tesserocr is not None:
+            self._api = tesserocr.PyTessBaseAPI(lang=language)
+        elif pytesseract is None:
+            raise RuntimeError('Neither tesserocr nor pytesseract is '
+                               'available')
+
+    def read_text(self, path):
+        if self._api is not None:
+            self._api.SetImageFile(path)
+            return self._api.GetUTF8Text()
+        with Image.open(path) as image:
+            return pytesseract.image_to_string(image, lang=self.language)
+
+    def close(self):
+        if self._api is not None:
+            self._api.End()
+            self._api = None
+
+
+# The OCR engine of a worker process, kept for the whole batch.
+_engine = None
+
+
+def _init_worker(language):
+    global _engine
+    _engine = OCREngine(language)
+
+
+def ocr_image(path):
+    """
+    Reads the text of an image with the OCR engine of the worker process.
+
+    :return: Tuple of the text, or None if no text was found, and an error
+             message, or None.
+    """
+    try:
+        text = _engine.read_text(path)
+    except Exception as e:
+        return None, 'OCR failed for "{}": {!s}'.format(path, e)
+    if not text or not text.strip():
+        return None, 'OCR found no text in "{}"'.format(path)
+    return text, None
+
+
+def check_path(path):
+    """:return: A message if "path" cannot be processed, otherwise None."""
+    if not os.path.isfile(path):
+        return 'Not a file: "{}"'.format(path)
+    if not os.access(path, os.R_OK):
+        return 'Not a readable file: "{}"'.format(path)
+    if image_discovery.sniff_image_type(path) is None:
+        return 'Not an image: "{}"'.format(path)
+    return None
+
+
+def ocr_cache_key(path, language):
+    """Returns the OCR cache key of the image at "path"."""
+    with open(path, 'rb') as fh:
+        return content_cache.content_key(fh.read(), language, OCR_VERSION)
+
+
+def rename_receipt(path, new_basename, dry_run=False):
+    """
+    Renames a receipt within its directory, never overwriting any file.
+
+    :return: True if renamed, or would have been with "dry_run".
+    """
+    new_path = os.path.join(os.path.dirname(path), new_basename)
+    if os.path.basename(path) == new_basename:
+        print('Already named "{}"'.format(path))
+        return False
+    if os.path.lexists(new_path):
+        print('Not renaming "{}": "{}" exists'.format(path, new_path))
+        return False
+    if not dry_run:
+        os.rename(path, new_path)
+    print('renamed \'{}\' -> \'{}\''.format(path, new_path))
+    return True
+
+
+def _cached_texts(receipts, language, cache):
+    """Returns a dict of the cache keys and cached OCR texts by path."""
+    keys = {}
+    for path in receipts:
+        try:
+            keys[path] = ocr_cache_key(path, language)
+        except OSError as e:
+            print('Unable to read "{}": {!s}'.format(path, e),
+                  file=sys.stderr)
+    cached = cache.get_many(list(set(keys.values())))
+    return keys, {path: cached[key].decode('utf-8')
+                  for path, key in keys.items() if key in cached}
+
+
+def main(paths, rules, jobs=1, language=DEFAULT_LANGUAGE, dry_run=False,
+         cache=None, rematch_only=False, refresh=False):
+    """
+    Reads receipts in a pool of worker processes and renames them.
+
+    :param cache: Optional "content_cache.ContentCache" of OCR texts.
+    :param rematch_only: Only rename receipts with cached OCR texts.
+    :param refresh: Read all receipts again, updating the cache.
+    :return: 0 if all receipts were read, otherwise 1.
+    """
+    receipts = []
+    for path in paths:
+        message = check_path(path)
+        if message:
+            print(message)
+        else:
+            receipts.append(path)
+
+    keys = texts = {}
+    if cache is not None:
+        keys, texts = _cached_texts(receipts, language, cache)
+        if refresh:
+            texts = {}
+
+    exit_status = 0
+    executor = None
+    try:
+        futures = {}
+        uncached = [path for path in receipts if path not in texts]
+        if uncached and not rematch_only:
+            executor = ProcessPoolExecutor(max_workers=jobs,
+                                           initializer=_init_worker,
+                                           initargs=(language, ))
+            futures = {path: executor.submit(ocr_image, path)
+                       for path in uncached}
+
+        for path in receipts:
+            print('Processing "{}" ..'.format(path))
+            text = texts.get(path)
+            if text is None:
+                if path not in futures:
+                    print('No cached OCR text for "{}", skipping'.format(path))
+                    continue
+                text, error = futures.pop(path).result()
+                if text is None:
+                    print(error, file=sys.stderr)
+                    exit_status = 1
+                    continue
+                if path in keys:
+                    cache.put(keys[path], text.encode('utf-8'))
+
+            basename = os.path.basename(path)
+            new_name = rules.new_name(text, basename.rpartition('.')[2])
+            print('Result for file: "{}": "{}"'.format(basename, new_name))
+            rename_receipt(path, new_name, dry_run)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return exit_status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        PROGRAM_NAME,
+        description='Renames images of receipts after the date, store and '
+                    'total price read from them with OCR, like '
+                    '"2017-03-31T215735 ICA Kvantum - 123.50kr.jpg".',
+        epilog='Requires tesserocr, or pytesseract and Pillow.'
+    )
+    parser.add_argument(
+        dest='files', nargs='*', metavar='FILE',
+        help='One or more images readable by Tesseract.'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs', type=int, default=os.cpu_count() or 1, metavar='N',
+        help='Number of worker processes.  Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '-l', '--language',
+        dest='language', default=DEFAULT_LANGUAGE, metavar='LANG',
+        help='Tesseract language.  Defaults to "%(default)s".'
+    )
+    parser.add_argument(
+        '--rules',
+        dest='rules_path', default=DEFAULT_RULES_PATH, metavar='PATH',
+        help='JSON file of date, store and price rules.  Defaults to '
+             '"receipt_rules.json" next to this program.'
+    )
+    parser.add_argument(
+        '-n', '--dry-run',
+        dest='dry_run', action='store_true', default=False,
+        help='Print the new names without renaming anything.'
+    )
+    parser.add_argument(
+        '--rematch-only',
+        dest='rematch_only', action='store_true', default=False,
+        help='Apply the rules to the cached OCR texts of the receipts, '
+             'without running OCR.  Receipts without cached texts are '
+             'skipped.'
+    )
+    parser.add_argument(
+        '--cache',
+        dest='cache_path', default=None, metavar='PATH',
+        help='Path to the OCR text cache database.  Defaults to '
+             '"~/.cache/image-utils/{}".'.format(CACHE_FILENAME)
+    )
+    parser.add_argument(
+        '--no-cache',
+        dest='use_cache', action='store_false', default=True,
+        help='Neither use nor update the OCR text cache.'
+    )
+    parser.add_argument(
+        '--refresh',
+        dest='refresh', action='store_true', default=False,
+        help='Read all receipts with OCR again, updating the cache.'
+    )
+    parser.add_argument(
+        '--cache-max-size',
+        dest='cache_max_size_mb', type=float,
+        default=DEFAULT_CACHE_MAX_SIZE_MB, metavar='MB',
+        help='Maximum size of the cache in megabytes.  Least recently used '
+             'texts are evicted first.  Defaults to %(default)s.'
+    )
+    args = parser.parse_args()
+
+    if not args.files:
+        print('USAGE: "{} [FILE]..."'.format(PROGRAM_NAME))
+        print('')
+        print('Where [FILE] is one or more images readable by pytesseract.')
+        sys.exit(1)
+
+    if args.rematch_only and not args.use_cache:
+        parser.error('"--rematch-only" cannot be used with "--no-cache"')
+    if args.rematch_only and args.refresh:
+        parser.error('"--rematch-only" cannot be used with "--refresh"')
+    if tesserocr is None and pytesseract is None and not args.rematch_only:
+        sys.exit('Please install "tesserocr" or "pytesseract" before running '
+                 'this program.')
+
+    try:
+        rules = ReceiptRules.from_file(args.rules_path)
+    except RuleError as e:
+        sys.exit('[ERROR] {!s}'.format(e))
+
+    cache = None
+    if args.use_cache:
+        cache = content_cache.ContentCache(
+            args.cache_path or
+            content_cache.default_cache_path(CACHE_FILENAME),
+            max_size=int(args.cache_max_size_mb * 1024 * 1024)
+        )
+
+    try:
+        sys.exit(main(args.files, rules, max(1, args.jobs), args.language,
+                      args.dry_run, cache, args.rematch_only, args.refresh))
+    except KeyboardInterrupt:
+        sys.exit('Received Keyboard Interrupt; Exiting ..')
+    finally:
+        if cache is not None:
+            cache.close()
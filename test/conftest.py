@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+# conftest.py
+# ===========
+# Makes the modules of the repository and of the benchmarks importable
+# by the tests.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import os
+import sys
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TEST_DIR)
+
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'benchmarks')]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# test_chrome_screencapture_renamer.py
+# ====================================
+# Tests of the rename plan of chrome-screencapture-renamer.py.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import pytest
+
+from harness import load_script
+
+
+@pytest.fixture(scope='module')
+def renamer():
+    return load_script('chrome-screencapture-renamer.py')
+
+
+def _apply(steps, existing):
+    """Renames in a set of names, never replacing a name."""
+    names = set(existing)
+    for src, dst in steps:
+        assert src in names
+        assert dst not in names
+        names.remove(src)
+        names.add(dst)
+    return names
+
+
+def _check(renamer, renames, existing):
+    steps, conflicts = renamer.plan_renames(renames, existing)
+    names = _apply(steps, existing)
+    not_renamed = {src for src, _, _ in conflicts}
+    expected = set(existing) - (set(renames) - not_renamed) | \
+        {dst for src, dst in renames.items() if src not in not_renamed}
+    assert names == expected
+    return steps, conflicts
+
+
+def test_independent_renames(renamer):
+    renames = {'a': 'x', 'b': 'y'}
+    steps, conflicts = _check(renamer, renames, {'a', 'b', 'c'})
+    assert sorted(steps) == [('a', 'x'), ('b', 'y')]
+    assert conflicts == []
+
+
+def test_chain_is_ordered(renamer):
+    renames = {'a': 'b', 'b': 'c', 'c': 'd'}
+    steps, conflicts = _check(renamer, renames, {'a', 'b', 'c'})
+    assert steps == [('c', 'd'), ('b', 'c'), ('a', 'b')]
+    assert conflicts == []
+
+
+@pytest.mark.parametrize('length', [2, 3, 5])
+def test_cycle_goes_through_a_temporary_name(renamer, length):
+    names = ['f{}'.format(i) for i in range(length)]
+    renames = {names[i]: names[(i + 1) % length] for i in range(length)}
+    steps, conflicts = _check(renamer, renames, set(names))
+    assert len(steps) == length + 1
+    assert conflicts == []
+
+
+def test_temporary_name_is_free(renamer):
+    existing = {'a', 'b', '.a.renaming-0'}
+    steps, _ = _check(renamer, {'a': 'b', 'b': 'a'}, existing)
+    assert steps[0] == ('a', '.a.renaming-1')
+
+
+def test_same_new_name(renamer):
+    renames = {'a': 'x', 'b': 'x', 'c': 'y'}
+    steps, conflicts = _check(renamer, renames, {'a', 'b', 'c'})
+    assert steps == [('c', 'y')]
+    assert conflicts == [('a', 'x', 'same new name as another file'),
+                         ('b', 'x', 'same new name as another file')]
+
+
+def test_new_name_exists(renamer):
+    renames = {'a': 'x'}
+    steps, conflicts = _check(renamer, renames, {'a', 'x'})
+    assert steps == []
+    assert conflicts == [('a', 'x', 'new name exists')]
+
+
+def test_blocked_renames_block_the_rest_of_the_chain(renamer):
+    # "b" cannot be renamed to the existing "x", so "b" stays and "a"
+    # cannot take its name.
+    renames = {'a': 'b', 'b': 'x', 'c': 'd'}
+    steps, conflicts = _check(renamer, renames, {'a', 'b', 'c', 'x'})
+    assert steps == [('c', 'd')]
+    assert sorted(conflicts) == [('a', 'b', 'new name exists'),
+                                 ('b', 'x', 'new name exists')]
+
+
+def test_conflict_breaks_a_cycle(renamer):
+    # "c" and "a" both want "b", so neither moves; "b" then cannot move to
+    # "c", which stays put.
+    renames = {'a': 'b', 'b': 'c', 'c': 'b'}
+    steps, conflicts = _check(renamer, renames, {'a', 'b', 'c'})
+    assert steps == []
+    assert sorted(conflicts) == [
+        ('a', 'b', 'same new name as another file'),
+        ('b', 'c', 'new name exists'),
+        ('c', 'b', 'same new name as another file'),
+    ]
+
+
+def test_unchanged_names_are_ignored(renamer):
+    steps, conflicts = _check(renamer, {'a': 'a', 'b': 'c'}, {'a', 'b'})
+    assert steps == [('b', 'c')]
+    assert conflicts == []
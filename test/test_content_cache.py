@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# test_content_cache.py
+# =====================
+# Tests of the size accounting and eviction of content_cache.py.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import time
+
+import pytest
+
+import content_cache
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def _summed_size(cache):
+    return cache._db.execute(
+        'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+
+def _assert_size(cache, size):
+    assert cache.stats()['size'] == size
+    assert _summed_size(cache) == size
+
+
+def test_size_after_put_and_replace(cache_path):
+    with content_cache.ContentCache(cache_path) as cache:
+        cache.put('a', b'x' * 10)
+        cache.put('b', b'x' * 20)
+        _assert_size(cache, 30)
+
+        cache.put('a', b'x' * 5)
+        _assert_size(cache, 25)
+
+        cache.put_many([('b', b'x' * 50), ('c', b'x' * 7), ('c', b'x')])
+        _assert_size(cache, 56)
+        assert cache.stats()['entries'] == 3
+
+
+def test_size_after_delete(cache_path):
+    with content_cache.ContentCache(cache_path) as cache:
+        cache.put_many([(str(i), b'x' * i) for i in range(10)])
+        cache.delete('9')
+        cache.delete('missing')
+        _assert_size(cache, 36)
+
+        cache.delete_many(['1', '2', '3'])
+        _assert_size(cache, 30)
+
+
+def test_size_after_expiry(cache_path):
+    with content_cache.ContentCache(cache_path, ttl=60) as cache:
+        cache.put('a', b'x' * 10)
+        cache.put('b', b'x' * 20)
+        cache._db.execute('UPDATE entries SET created = ? WHERE key = ?',
+                          (time.time() - 120, 'a'))
+
+        assert cache.get('a') is None
+        _assert_size(cache, 20)
+
+
+def test_eviction_keeps_recently_used(cache_path):
+    with content_cache.ContentCache(cache_path, max_size=100) as cache:
+        for i in range(3):
+            cache.put(str(i), b'x' * 30)
+            # Distinct access times.
+            cache._db.execute('UPDATE entries SET accessed = ? '
+                              'WHERE key = ?', (i, str(i)))
+        cache.get('0')
+        cache.put('3', b'x' * 30)
+
+        assert sorted(key for key, _ in cache.items()) == ['0', '2', '3']
+        _assert_size(cache, 90)
+
+
+def test_replacing_with_larger_value_evicts(cache_path):
+    with content_cache.ContentCache(cache_path, max_size=100) as cache:
+        cache.put('a', b'x' * 40)
+        cache.put('b', b'x' * 40)
+        cache.put('b', b'x' * 70)
+
+        assert cache.get('a') is None
+        assert cache.get('b') == b'x' * 70
+        _assert_size(cache, 70)
+
+
+def test_evict_by_age(cache_path):
+    with content_cache.ContentCache(cache_path) as cache:
+        cache.put('old', b'x' * 10)
+        cache.put('new', b'x' * 20)
+        cache._db.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                          (time.time() - 3600, 'old'))
+
+        assert cache.evict(max_age=60) == 1
+        _assert_size(cache, 20)
+
+
+def test_size_survives_reopening(cache_path):
+    with content_cache.ContentCache(cache_path) as cache:
+        cache.put('a', b'x' * 10)
+        cache.put('a', b'x' * 15)
+    with content_cache.ContentCache(cache_path) as cache:
+        _assert_size(cache, 15)
+        cache.put('b', b'x')
+        _assert_size(cache, 16)
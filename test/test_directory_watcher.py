@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# test_directory_watcher.py
+# =========================
+# Tests of the debouncing and the polling fallback of
+# directory_watcher.py.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import os
+
+import pytest
+
+import directory_watcher
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_debouncer_coalesces_events():
+    clock = FakeClock()
+    debouncer = directory_watcher.Debouncer(2.0, clock)
+
+    for _ in range(5):
+        debouncer.touch('a')
+        clock.now += 1.5
+        assert debouncer.pop_ready() == []
+    assert len(debouncer) == 1
+
+    clock.now += 0.5
+    # Reported once, with the time of its first event.
+    assert debouncer.pop_ready() == [('a', 1000.0)]
+    assert len(debouncer) == 0
+    assert debouncer.timeout() is None
+
+
+def test_debouncer_orders_and_limits():
+    clock = FakeClock()
+    debouncer = directory_watcher.Debouncer(1.0, clock)
+    debouncer.touch('a')
+    clock.now += 0.5
+    debouncer.touch('b')
+    debouncer.touch('c')
+    clock.now += 0.25
+    debouncer.touch('a')
+
+    assert debouncer.timeout() == pytest.approx(0.75)
+    clock.now += 0.75
+    assert debouncer.pop_ready() == [('b', 1000.5), ('c', 1000.5)]
+    assert debouncer.timeout() == pytest.approx(0.25)
+
+    clock.now += 1.0
+    debouncer.touch('d')
+    assert debouncer.pop_ready(limit=0) == []
+    assert debouncer.pop_ready(limit=1) == [('a', 1000.0)]
+    assert debouncer.pop_ready() == []
+    assert len(debouncer) == 1
+
+
+@pytest.fixture
+def no_inotify(monkeypatch):
+    monkeypatch.setattr(directory_watcher, '_load_libc', lambda: None)
+
+
+def test_falls_back_to_polling(no_inotify, tmp_path):
+    watcher = directory_watcher.open_watcher([str(tmp_path)])
+    try:
+        assert isinstance(watcher, directory_watcher.PollingWatcher)
+        assert watcher.interval == directory_watcher.DEFAULT_POLL_INTERVAL
+    finally:
+        watcher.close()
+
+
+def test_polling_reports_new_and_changed_files(no_inotify, tmp_path):
+    (tmp_path / 'existing.jpg').write_bytes(b'x')
+    sub_dir = tmp_path / 'sub'
+    sub_dir.mkdir()
+    watcher = directory_watcher.open_watcher([str(tmp_path)], recursive=True,
+                                             poll_interval=0.01)
+    try:
+        assert watcher.read() == []
+
+        (tmp_path / 'new.jpg').write_bytes(b'x')
+        (tmp_path / '.hidden.tmp').write_bytes(b'x')
+        (sub_dir / 'nested.jpg').write_bytes(b'x')
+        assert sorted(watcher.read()) == [str(tmp_path / 'new.jpg'),
+                                          str(sub_dir / 'nested.jpg')]
+
+        (tmp_path / 'existing.jpg').write_bytes(b'xx')
+        assert watcher.read() == [str(tmp_path / 'existing.jpg')]
+        assert watcher.read() == []
+    finally:
+        watcher.close()
+
+
+def test_polling_waits_at_most_the_timeout(no_inotify, tmp_path):
+    watcher = directory_watcher.PollingWatcher([str(tmp_path)], interval=60)
+    (tmp_path / 'new.jpg').write_bytes(b'x')
+    assert watcher.read(timeout=0.01) == []
+
+
+def test_polling_requires_directories(no_inotify, tmp_path):
+    with pytest.raises(directory_watcher.WatchError):
+        directory_watcher.open_watcher([os.path.join(str(tmp_path), 'no')])
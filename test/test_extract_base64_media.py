@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# test_extract_base64_media.py
+# ============================
+# Tests of the streaming data URI scanner of extract_base64_media.py.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import base64
+import io
+import logging
+import random
+
+import pytest
+
+import extract_base64_media
+
+# Chunk sizes splitting the headers, payloads, line breaks and URL-encoded
+# characters at every possible place.
+CHUNK_SIZES = [1, 2, 3, 5, 7, 64, 1000, extract_base64_media.CHUNK_SIZE]
+
+
+@pytest.fixture(autouse=True)
+def log(monkeypatch):
+    # "log" is only set up when run as a program.
+    monkeypatch.setattr(extract_base64_media, 'log',
+                        logging.getLogger('extract_base64_media'),
+                        raising=False)
+
+
+def _images():
+    rng = random.Random(0)
+    return [bytes(rng.getrandbits(8) for _ in range(size))
+            for size in (1, 2, 3, 4, 57, 58, 300, 4000)]
+
+
+def _encode(image, style):
+    encoded = base64.b64encode(image).decode('ascii')
+    if style == 'lines':
+        encoded = '\n'.join(encoded[i:i + 76]
+                            for i in range(0, len(encoded), 76))
+    elif style == 'url':
+        # URL-encoded line breaks and padding, as in some e-mails.
+        encoded = '%0A'.join(encoded[i:i + 16]
+                             for i in range(0, len(encoded), 16))
+        encoded = encoded.replace('=', '%3D')
+    elif style == 'unpadded':
+        encoded = encoded.rstrip('=')
+    return encoded
+
+
+def _scan(content, chunk_size):
+    scanner = extract_base64_media.DataURIScanner(io.BytesIO(content),
+                                                  chunk_size)
+    return [(filetype, b''.join(chunks)) for filetype, chunks in scanner]
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('style', ['plain', 'lines', 'url', 'unpadded'])
+def test_payloads_split_across_chunks(chunk_size, style):
+    images = _images()
+    content = '<html>\n' + '\n'.join(
+        '<img alt="{}" src="data:image/{};base64,{}">'.format(
+            i, subtype, _encode(image, style))
+        for i, (subtype, image) in enumerate(zip(
+            ['png', 'jpeg', 'gif', 'svg+xml'] * 2, images))
+    ) + '\n</html>\n'
+
+    found = _scan(content.encode('ascii'), chunk_size)
+
+    assert found == list(zip(['png', 'jpg', 'gif', 'svg'] * 2, images))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_header_parameters(chunk_size):
+    image = _images()[-1]
+    content = 'url(data:image/png;charset=utf-8;name=a.png;base64,{})'.format(
+        _encode(image, 'plain')).encode('ascii')
+
+    assert _scan(content, chunk_size) == [('png', image)]
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_unconsumed_chunks_are_skipped(chunk_size):
+    images = _images()[-3:]
+    content = ''.join('"data:image/png;base64,{}" '.format(
+        _encode(image, 'lines')) for image in images).encode('ascii')
+    scanner = extract_base64_media.DataURIScanner(io.BytesIO(content),
+                                                  chunk_size)
+
+    found = []
+    for i, (_, chunks) in enumerate(scanner):
+        if i != 1:
+            found.append(b''.join(chunks))
+
+    assert found == [images[0], images[2]]
+
+
+def test_prefetcher_yields_the_same_images():
+    images = _images()
+    content = ''.join('data:image/png;base64,{}"'.format(
+        _encode(image, 'lines')) for image in images).encode('ascii')
+
+    def _found_data():
+        scanner = extract_base64_media.DataURIScanner(io.BytesIO(content), 7)
+        for filetype, chunks in scanner:
+            yield {'filetype': filetype, 'chunks': chunks}
+
+    prefetcher = extract_base64_media.ImagePrefetcher(_found_data(), depth=2)
+    found = [b''.join(image['chunks']) for i, image in enumerate(prefetcher)
+             if i % 2 == 0]
+
+    assert found == images[::2]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# test_image_carving.py
+# =====================
+# Tests of the structure-aware carving engine, compared with the marker
+# based engine of extract-android-thumbdata.py.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import os
+import random
+
+import pytest
+
+import image_carving
+from corpora import synthetic_jpeg, synthetic_png, synthetic_webp
+from harness import load_script
+
+
+@pytest.fixture(scope='module')
+def thumbdata():
+    return load_script('extract-android-thumbdata.py')
+
+
+def _blob(images, rng):
+    """Returns the images with padding in between, and their offsets."""
+    parts = []
+    offsets = []
+    pos = 0
+    for image in images:
+        padding = bytes(rng.randint(0, 64))
+        parts += [padding, image]
+        offsets.append((pos + len(padding), pos + len(padding) + len(image)))
+        pos += len(padding) + len(image)
+    parts.append(bytes(16))
+    return b''.join(parts), offsets
+
+
+def _carved_files(out_dir):
+    files = []
+    for name in sorted(os.listdir(out_dir)):
+        with open(os.path.join(out_dir, name), 'rb') as fh:
+            files.append(fh.read())
+    return files
+
+
+def test_carve_finds_every_kind_of_image():
+    rng = random.Random(1)
+    images = [synthetic_jpeg(rng, 2048), synthetic_png(rng, 1024),
+              synthetic_webp(rng, 999), synthetic_jpeg(rng, 4096, False)]
+    blob, offsets = _blob(images, rng)
+
+    carved = list(image_carving.carve(blob))
+
+    assert [extension for extension, _, _ in carved] == \
+        ['jpg', 'png', 'webp', 'jpg']
+    assert [(start, end) for _, start, end in carved] == offsets
+
+
+def test_carve_skips_truncated_images():
+    rng = random.Random(2)
+    truncated = synthetic_jpeg(rng, 2048, False)[:1000]
+    image = synthetic_png(rng, 512)
+    blob = truncated + bytes(8) + image
+
+    carved = list(image_carving.carve(blob))
+
+    assert carved == [('png', len(truncated) + 8, len(blob))]
+
+
+def test_carve_within_limit():
+    rng = random.Random(3)
+    images = [synthetic_jpeg(rng, 2048, False) for _ in range(3)]
+    blob, offsets = _blob(images, rng)
+
+    carved = list(image_carving.carve(blob, offsets[1][0], offsets[2][1] - 1))
+
+    assert [(start, end) for _, start, end in carved] == [offsets[1]]
+
+
+def test_engines_agree_on_plain_jpegs(thumbdata, tmp_path):
+    rng = random.Random(4)
+    images = [synthetic_jpeg(rng, rng.randint(512, 8192), False)
+              for _ in range(20)]
+    blob, _ = _blob(images, rng)
+    path = tmp_path / 'thumbdata3'
+    path.write_bytes(blob)
+    markers_dir = tmp_path / 'markers'
+    segments_dir = tmp_path / 'segments'
+    markers_dir.mkdir()
+    segments_dir.mkdir()
+
+    # A window smaller than the images, so that they span windows.
+    assert thumbdata.extract_files_from_thumbdata_file(
+        str(path), str(markers_dir), window_size=4096) == len(images)
+    assert thumbdata.carve_files_from_thumbdata_file(
+        str(path), str(segments_dir)) == len(images)
+
+    # The markers engine leaves out the last byte of the end-of-image
+    # marker, as it always has.
+    assert _carved_files(markers_dir) == [image[:-1] for image in images]
+    assert _carved_files(segments_dir) == images
+
+
+def test_segments_engine_keeps_embedded_thumbnails(thumbdata, tmp_path):
+    rng = random.Random(5)
+    images = [synthetic_jpeg(rng, 4096) for _ in range(5)]
+    blob, _ = _blob(images, rng)
+    path = tmp_path / 'thumbdata3'
+    path.write_bytes(blob)
+    markers_dir = tmp_path / 'markers'
+    segments_dir = tmp_path / 'segments'
+    markers_dir.mkdir()
+    segments_dir.mkdir()
+
+    thumbdata.extract_files_from_thumbdata_file(str(path), str(markers_dir))
+    thumbdata.carve_files_from_thumbdata_file(str(path), str(segments_dir))
+
+    # The markers engine stops at the end of the embedded thumbnails.
+    assert not set(_carved_files(markers_dir)) & \
+        {image[:-1] for image in images}
+    assert _carved_files(segments_dir) == images
+
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# test_microsoft_vision.py
+# ========================
+# Tests of the Microsoft Vision API client against the local stand-in of
+# the API in benchmarks/vision_server.py.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import logging
+import time
+
+import pytest
+
+import content_cache
+import microsoft_vision
+from vision_server import VisionStandIn
+
+API_KEY = 'test-key'
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    # "log" is only set up when run as a program.
+    monkeypatch.setattr(microsoft_vision, 'log',
+                        logging.getLogger('microsoft_vision'), raising=False)
+    monkeypatch.setattr(microsoft_vision, 'RETRY_BASE_DELAY', 0.0)
+
+
+@pytest.fixture
+def server():
+    with VisionStandIn() as server:
+        yield server
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / 'image.jpg'
+    path.write_bytes(b'\xff\xd8 not really an image \xff\xd9')
+    return str(path)
+
+
+def _client(server, **kwargs):
+    return microsoft_vision.VisionClient(API_KEY, server.endpoint, **kwargs)
+
+
+def test_query(server, image_file):
+    client = _client(server)
+    try:
+        json_data = client.query(image_file)
+    finally:
+        client.close()
+
+    assert microsoft_vision.get_caption_text(json_data).startswith(
+        'a synthetic image')
+    assert server.requests == 1
+    assert client.stats['requests'] == 1
+    assert client.stats['bytes_sent'] == server.bytes_received
+
+
+@pytest.mark.parametrize('statuses', [[429], [503], [429, 500, 502]])
+def test_retries_throttling_and_server_errors(server, image_file, statuses):
+    server.failures.extend(statuses)
+    client = _client(server)
+    try:
+        client.query(image_file)
+    finally:
+        client.close()
+
+    assert server.requests == len(statuses) + 1
+    assert client.stats['requests'] == len(statuses) + 1
+
+
+def test_gives_up_after_max_retries(server, image_file):
+    server.failures.extend([503] * 3)
+    client = _client(server, max_retries=2)
+    try:
+        with pytest.raises(microsoft_vision.VisionAPIError, match='503'):
+            client.query(image_file)
+    finally:
+        client.close()
+
+    assert server.requests == 3
+
+
+def test_does_not_retry_client_errors(server, image_file):
+    client = microsoft_vision.VisionClient('', server.endpoint)
+    try:
+        with pytest.raises(microsoft_vision.VisionAPIError, match='401'):
+            client.query(image_file)
+    finally:
+        client.close()
+
+    assert server.requests == 1
+
+
+def test_retries_connection_errors(image_file):
+    with VisionStandIn() as server:
+        endpoint = server.endpoint
+    client = microsoft_vision.VisionClient(API_KEY, endpoint, max_retries=1)
+    try:
+        with pytest.raises(microsoft_vision.VisionAPIError,
+                           match='Connection failed'):
+            client.post(b'content')
+    finally:
+        client.close()
+
+
+def test_cached_responses(server, image_file, tmp_path):
+    with content_cache.ContentCache(str(tmp_path / 'cache.sqlite')) as cache:
+        client = _client(server, cache=cache)
+        try:
+            first = client.query(image_file)
+            second = client.query(image_file)
+        finally:
+            client.close()
+        assert first == second
+        assert server.requests == 1
+        assert client.stats['cache_hits'] == 1
+
+        client = _client(server, cache=cache, refresh=True)
+        try:
+            client.query(image_file)
+        finally:
+            client.close()
+        assert server.requests == 2
+        assert client.stats['cache_hits'] == 0
+
+
+def test_failed_queries_are_not_cached(server, image_file, tmp_path):
+    server.failures.append(400)
+    with content_cache.ContentCache(str(tmp_path / 'cache.sqlite')) as cache:
+        client = _client(server, cache=cache)
+        try:
+            with pytest.raises(microsoft_vision.VisionAPIError):
+                client.query(image_file)
+            client.query(image_file)
+        finally:
+            client.close()
+    assert server.requests == 2
+    assert client.stats['cache_hits'] == 0
+
+
+def test_connection_pool_reuses_connections(server):
+    pool = microsoft_vision.ConnectionPool(server.endpoint, size=1)
+    try:
+        with pool.connection() as first:
+            first.request('POST', '/', b'')
+            first.getresponse().read()
+        with pool.connection() as second:
+            assert second is first
+            # Only "size" connections are kept.
+            with pool.connection() as third:
+                assert third is not first
+        with pool.connection() as conn:
+            assert conn in (first, third)
+            assert pool._idle.qsize() == 0
+        assert pool._idle.qsize() == 1
+    finally:
+        pool.close()
+
+
+def test_connection_pool_drops_failed_connections(server):
+    pool = microsoft_vision.ConnectionPool(server.endpoint, size=2)
+    try:
+        with pytest.raises(OSError):
+            with pool.connection() as failed:
+                raise OSError('failed')
+        with pool.connection() as conn:
+            assert conn is not failed
+    finally:
+        pool.close()
+
+
+def test_connection_pool_rejects_other_schemes():
+    with pytest.raises(ValueError):
+        microsoft_vision.ConnectionPool('ftp://example.com/')
+
+
+def test_token_bucket_burst():
+    bucket = microsoft_vision.TokenBucket(rate=1.0, capacity=5)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.5
+
+
+def test_token_bucket_rate():
+    bucket = microsoft_vision.TokenBucket(rate=50.0)
+    started = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # The first token is there from the start.
+    assert time.monotonic() - started >= 10 / 50.0 * 0.9
+
+
+def test_rate_limited_client(server, image_file):
+    client = _client(server, rate=50.0)
+    started = time.monotonic()
+    try:
+        for _ in range(6):
+            client.query(image_file)
+    finally:
+        client.close()
+    assert time.monotonic() - started >= 5 / 50.0 * 0.9
+    assert server.requests == 6
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# test_perceptual_hash.py
+# =======================
+# Tests of the near-duplicate grouping of perceptual_hash.py, compared
+# with comparing every pair of hashes.
+# _____________________________________________________________________
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# _____________________________________________________________________
+
+import itertools
+import random
+
+import pytest
+
+import perceptual_hash
+
+
+def _brute_force_groups(items, distance):
+    parents = list(range(len(items)))
+
+    def _root(number):
+        while parents[number] != number:
+            number = parents[number]
+        return number
+
+    for a, b in itertools.combinations(range(len(items)), 2):
+        if perceptual_hash.hamming_distance(items[a][1],
+                                            items[b][1]) <= distance:
+            root_a, root_b = _root(a), _root(b)
+            if root_a != root_b:
+                parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = {}
+    for number, (identifier, _) in enumerate(items):
+        groups.setdefault(_root(number), []).append(identifier)
+    return _normalized(groups.values())
+
+
+def _normalized(groups):
+    return sorted(sorted(group) for group in groups if len(group) > 1)
+
+
+def _clustered_items(rng, count, clusters, max_flips):
+    """Hashes near a few random hashes, with some exact copies."""
+    centers = [rng.getrandbits(64) for _ in range(clusters)]
+    items = []
+    for identifier in range(count):
+        value = rng.choice(centers)
+        for _ in range(rng.randint(0, max_flips)):
+            value ^= 1 << rng.randrange(64)
+        items.append((identifier, value))
+    return items
+
+
+@pytest.mark.parametrize('distance', [0, 1, 4, 6])
+@pytest.mark.parametrize('seed', range(4))
+def test_group_duplicates_matches_brute_force(distance, seed):
+    rng = random.Random(seed)
+    items = _clustered_items(rng, 200, 5, 8)
+
+    assert _normalized(perceptual_hash.group_duplicates(items, distance)) \
+        == _brute_force_groups(items, distance)
+
+
+@pytest.mark.parametrize('distance', [2, 4])
+def test_long_runs_match_brute_force(monkeypatch, distance):
+    # Splits runs of hashes equal in two parts on the rest of the bits.
+    monkeypatch.setattr(perceptual_hash, 'RUN_COMPARE_LIMIT', 4)
+    rng = random.Random(distance)
+    items = _clustered_items(rng, 300, 2, 6)
+
+    assert _normalized(perceptual_hash.group_duplicates(items, distance)) \
+        == _brute_force_groups(items, distance)
+
+
+@pytest.mark.parametrize('distance', [0, 3, 5])
+def test_pairs_are_all_pairs_within_distance(distance):
+    rng = random.Random(distance)
+    values = list(dict.fromkeys(
+        value for _, value in _clustered_items(rng, 150, 4, 7)))
+    index = perceptual_hash.MultiIndexHash(distance)
+    for value in values:
+        index.add(value)
+
+    pairs = list(index.pairs())
+
+    assert len(pairs) == len(set(pairs))
+    assert {tuple(sorted(pair)) for pair in pairs} == {
+        (a, b) for a, b in itertools.combinations(range(len(values)), 2)
+        if perceptual_hash.hamming_distance(values[a], values[b]) <= distance
+    }
+
+
+def test_query_matches_brute_force():
+    rng = random.Random(7)
+    items = _clustered_items(rng, 200, 3, 6)
+    index = perceptual_hash.MultiIndexHash(4)
+    for _, value in items:
+        index.add(value)
+
+    for _, value in items[:20]:
+        assert index.query(value) == sorted(
+            (perceptual_hash.hamming_distance(value, other), number)
+            for number, (_, other) in enumerate(items)
+            if perceptual_hash.hamming_distance(value, other) <= 4)
+
+
+def test_exact_copies_are_grouped():
+    items = [('a', 1), ('b', 1), ('c', 2 ** 63), ('d', 1)]
+    assert _normalized(perceptual_hash.group_duplicates(items, 0)) == \
+        [['a', 'b', 'd']]